@@ -0,0 +1,206 @@
+# coding=utf-8
+
+"""
+Rolls up series into aggregates before the metrics reach the handlers, for
+example the sum of the user time of all cpus or the highest utilization of
+any disk.
+
+Rules are configured in the [aggregations] section of diamond.conf, one
+subsection per aggregate, named after it:
+
+    [aggregations]
+    [[cpu.all.user]]
+    match = cpu.cpu*.user
+    functions = sum, avg
+    drop_inputs = True
+
+match is a glob, or a regular expression when prefixed with re:, matched
+against the path after the hostname (collector.metric). The functions are
+sum, avg, min, max, count and percentiles like p50, p95 or p99. Every batch of
+metrics, which holds the metrics of one collector run, yields one metric per
+function and host, <path_prefix>.<hostname>.<name>.<function>, for example
+servers.host.cpu.all.user.sum. With drop_inputs set, the matched metrics are
+not passed on.
+"""
+
+import math
+
+from diamond.error import DiamondException
+from diamond.filter import compile_pattern
+from diamond.metric import Metric
+from diamond.utils.config import str_to_bool
+from diamond.utils.lru import LRUCache
+
+# Number of metric paths whose matching rules are remembered
+DEFAULT_CACHE_SIZE = 20000
+
+FUNCTIONS = ['sum', 'avg', 'min', 'max', 'count']
+
+
+def percentile(values, pct):
+    """
+    Returns the nearest rank pct percentile of a sorted list of values
+    """
+    rank = int(math.ceil(pct / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def _check_function(function):
+    if function in FUNCTIONS:
+        return function
+    if function.startswith('p'):
+        try:
+            pct = float(function[1:])
+        except ValueError:
+            pct = None
+        if pct is not None and 0 < pct <= 100:
+            return function
+    raise DiamondException('Unknown aggregation function %r' % function)
+
+
+class AggregationRule(object):
+    """
+    Aggregates the metrics whose path matches a pattern
+    """
+
+    def __init__(self, name, match, functions, drop_inputs=False):
+        self.name = name
+        self.regex = compile_pattern(match)
+        if isinstance(functions, basestring):
+            functions = functions.split(',')
+        self.functions = [_check_function(function.strip().lower())
+                          for function in functions if function.strip()]
+        if not self.functions:
+            raise DiamondException('No aggregation functions for %s' % name)
+        self.drop_inputs = drop_inputs
+
+    def matches(self, name):
+        return self.regex.match(name) is not None
+
+    def aggregate(self, head, metrics):
+        """
+        Returns the aggregates of metrics, with head as their path prefix
+        """
+        values = [metric.value for metric in metrics]
+        first = metrics[0]
+        precision = max([metric.precision for metric in metrics])
+
+        # All metrics of a run share the timestamp of the run
+        timestamp = first.timestamp
+        if first.timestamp_ms is not None:
+            timestamp = first.get_timestamp_ms() / 1000.0
+
+        ordered = None
+        aggregates = []
+        for function in self.functions:
+            if function == 'sum':
+                value = sum(values)
+            elif function == 'avg':
+                value = float(sum(values)) / len(values)
+            elif function == 'min':
+                value = min(values)
+            elif function == 'max':
+                value = max(values)
+            elif function == 'count':
+                value = len(values)
+            else:
+                if ordered is None:
+                    ordered = sorted(values)
+                value = percentile(ordered, float(function[1:]))
+
+            if function == 'count':
+                function_precision = 0
+            elif function == 'avg' or function.startswith('p'):
+                function_precision = max(precision, 2)
+            else:
+                function_precision = precision
+
+            aggregates.append(Metric(
+                '%s%s.%s' % (head, self.name, function), value,
+                timestamp=timestamp, precision=function_precision,
+                host=first.host, metric_type='GAUGE', ttl=first.ttl))
+        return aggregates
+
+
+class Aggregator(object):
+    """
+    Applies aggregation rules to batches of metrics
+    """
+
+    def __init__(self, rules, cache_size=DEFAULT_CACHE_SIZE):
+        self.rules = list(rules)
+        # path -> (path up to the hostname, indexes of the matching rules)
+        self.matches = LRUCache(cache_size)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Returns an aggregator for the [aggregations] section of the config,
+        or None if there are no rules
+        """
+        if not config:
+            return None
+        default_drop = str_to_bool(config.get('drop_inputs', False))
+        rules = []
+        for name, rule in config.iteritems():
+            if not isinstance(rule, dict):
+                continue
+            if 'match' not in rule:
+                raise DiamondException('No match pattern for aggregation %s'
+                                       % name)
+            rules.append(AggregationRule(
+                name, rule['match'], rule.get('functions', 'sum'),
+                str_to_bool(rule.get('drop_inputs', default_drop))))
+        if not rules:
+            return None
+        return cls(rules)
+
+    def _match(self, metric):
+        path = metric.path
+        try:
+            return self.matches.young[path]
+        except KeyError:
+            pass
+
+        match = self.matches.get(path)
+        if match is None:
+            head = ''
+            if metric.host:
+                offset = path.find('.%s.' % metric.host)
+                if offset != -1:
+                    head = path[:offset + len(metric.host) + 2]
+            name = path[len(head):]
+            match = (head, tuple([index for index, rule
+                                  in enumerate(self.rules)
+                                  if rule.matches(name)]))
+            self.matches[path] = match
+        return match
+
+    def process(self, metrics):
+        """
+        Returns the metrics with the aggregates added and the dropped
+        inputs removed, or metrics itself if no rule matched
+        """
+        # (rule index, head) -> metrics
+        groups = {}
+        passed = []
+        for metric in metrics:
+            head, indexes = self._match(metric)
+            drop = False
+            for index in indexes:
+                key = (index, head)
+                if key in groups:
+                    groups[key].append(metric)
+                else:
+                    groups[key] = [metric]
+                drop = drop or self.rules[index].drop_inputs
+            if not drop:
+                passed.append(metric)
+
+        if not groups:
+            return metrics
+
+        for index, head in sorted(groups):
+            passed.extend(self.rules[index].aggregate(head,
+                                                      groups[(index, head)]))
+        return passed
@@ -0,0 +1,303 @@
+# coding=utf-8
+
+"""
+A compact, columnar representation of a batch of metrics, used to ship the
+metrics of one collection run from a collector process to the handler process
+"""
+
+from array import array
+
+from diamond.metric import Metric
+
+# Layout of the per metric flags
+_TYPE_MASK = 0x03
+_INT_VALUE = 0x04
+_MILLISECONDS = 0x08
+
+# Largest integer a double can hold exactly
+_MAX_EXACT_INT = 2 ** 53
+
+
+def _index_typecode(size):
+    """
+    Smallest array typecode that can index size entries
+    """
+    if size <= 0xFFFF:
+        return 'H'
+    return 'I'
+
+
+class MetricBatch(object):
+    """
+    Holds a batch of metrics as columns instead of a list of Metric objects.
+
+    Attributes shared by the whole batch (host, ttl and the path prefix up to
+    and including the host name) are stored once. The remaining part of every
+    path goes into a path dictionary, itself stored as indexes into a table
+    of unique path segments since per cpu, disk or interface series repeat
+    the same few segments over and over. Values, timestamps, precisions and
+    metric types are kept in typed arrays that pickle to a few bytes per
+    metric.
+
+    Metrics that do not fit the shared attributes of the batch are kept as
+    they are, so any Metric can be appended. Iterating over the batch yields
+    Metric objects built on the fly.
+    """
+
+    def __init__(self, host=None, ttl=None, prefix='', intern=None):
+        self.host = host
+        self.ttl = ttl
+        self.prefix = prefix
+        self.names = []
+        self.segments = []
+        self.paths = array('I')
+        self.values = array('d')
+        self.timestamps = array('l')
+        # The milliseconds of the timestamps, only once a metric has some
+        self.milliseconds = None
+        self.precisions = array('B')
+        self.flags = array('B')
+        self.raw_values = None
+        self.extra = {}
+
+        self._index = {}
+        self._segment_index = {}
+        # Maps full paths to their interned suffix, per prefix. May be shared
+        # between the batches of a collector
+        if intern is None:
+            intern = {}
+        self._intern = intern.setdefault(prefix, {})
+
+    @classmethod
+    def from_metrics(cls, metrics, intern=None):
+        """
+        Create a batch holding all the given metrics
+        """
+        batch = None
+        for metric in metrics:
+            if batch is None:
+                batch = cls.for_metric(metric, intern)
+            batch.append(metric)
+        if batch is None:
+            batch = cls(intern=intern)
+        return batch
+
+    @classmethod
+    def for_metric(cls, metric, intern=None):
+        """
+        Create an empty batch whose shared attributes match metric
+        """
+        prefix = ''
+        if metric.host:
+            offset = metric.path.find('.%s.' % metric.host)
+            if offset != -1:
+                prefix = metric.path[:offset + len(metric.host) + 2]
+        return cls(host=metric.host, ttl=metric.ttl, prefix=prefix,
+                   intern=intern)
+
+    def append(self, metric):
+        index = len(self.flags)
+        name = self._suffix(metric.path)
+        value = metric.value
+        flags = Metric._METRIC_TYPES.index(metric.metric_type)
+
+        if isinstance(value, (int, long)) and not isinstance(value, bool):
+            if -_MAX_EXACT_INT <= value <= _MAX_EXACT_INT:
+                flags |= _INT_VALUE
+            else:
+                name = None
+        elif not isinstance(value, float):
+            name = None
+
+        precision = metric.precision
+        if (not isinstance(precision, int) or isinstance(precision, bool)
+                or not 0 <= precision <= 255):
+            name = None
+
+        milliseconds = 0
+        if metric.timestamp_ms is not None and name is not None:
+            milliseconds = metric.timestamp_ms - metric.timestamp * 1000
+            if 0 <= milliseconds < 1000:
+                flags |= _MILLISECONDS
+            else:
+                name = None
+
+        if (name is None or metric.host != self.host
+                or metric.ttl != self.ttl
+                or not isinstance(metric.timestamp, int)):
+            # Keep anything that does not fit the columns as it is
+            self.extra[index] = metric
+            self.paths.append(0)
+            self.values.append(0.0)
+            self.timestamps.append(0)
+            if self.milliseconds is not None:
+                self.milliseconds.append(0)
+            self.precisions.append(0)
+            self.flags.append(0)
+            if self.raw_values is not None:
+                self.raw_values.append(None)
+            return
+
+        if name in self._index:
+            self.paths.append(self._index[name])
+        else:
+            self._index[name] = len(self.names)
+            self.paths.append(len(self.names))
+            self.names.append(name)
+
+        self.values.append(value)
+        self.timestamps.append(metric.timestamp)
+        if flags & _MILLISECONDS and self.milliseconds is None:
+            self.milliseconds = array('H', [0]) * index
+        if self.milliseconds is not None:
+            self.milliseconds.append(milliseconds)
+        self.precisions.append(precision)
+        self.flags.append(flags)
+
+        if metric.raw_value is not None and self.raw_values is None:
+            self.raw_values = [None] * index
+        if self.raw_values is not None:
+            self.raw_values.append(metric.raw_value)
+
+    def _suffix(self, path):
+        """
+        Returns the part of path after the prefix of the batch, or None if
+        path does not start with the prefix
+        """
+        try:
+            return self._intern[path]
+        except KeyError:
+            pass
+
+        if not path.startswith(self.prefix):
+            return None
+
+        name = path[len(self.prefix):]
+        self._intern[path] = name
+        return name
+
+    def __len__(self):
+        return len(self.flags)
+
+    def __iter__(self):
+        for index in xrange(len(self.flags)):
+            yield self[index]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.flags)
+        if index in self.extra:
+            return self.extra[index]
+
+        flags = self.flags[index]
+        value = self.values[index]
+        if flags & _INT_VALUE:
+            value = int(value)
+
+        # Skip the validation in Metric.__init__, everything in the batch was
+        # already validated when the Metric was first created
+        metric = Metric.__new__(Metric)
+        metric.path = self.prefix + self.names[self.paths[index]]
+        metric.value = value
+        if self.raw_values is None:
+            metric.raw_value = None
+        else:
+            metric.raw_value = self.raw_values[index]
+        metric.timestamp = self.timestamps[index]
+        if flags & _MILLISECONDS:
+            metric.timestamp_ms = (metric.timestamp * 1000 +
+                                   self.milliseconds[index])
+        else:
+            metric.timestamp_ms = None
+        metric.precision = self.precisions[index]
+        metric.host = self.host
+        metric.metric_type = Metric._METRIC_TYPES[flags & _TYPE_MASK]
+        metric.ttl = self.ttl
+        metric._split = None
+        return metric
+
+    def _encode_names(self):
+        """
+        Encode the path dictionary as segment indexes and segment counts
+        """
+        name_segments = []
+        name_lengths = array('B')
+        for name in self.names:
+            parts = name.split('.')
+            if len(parts) > 255:
+                parts[254:] = ['.'.join(parts[254:])]
+            for part in parts:
+                if part not in self._segment_index:
+                    self._segment_index[part] = len(self.segments)
+                    self.segments.append(part)
+                name_segments.append(self._segment_index[part])
+            name_lengths.append(len(parts))
+        return (array(_index_typecode(len(self.segments)), name_segments),
+                name_lengths)
+
+    def _decode_names(self, name_segments, name_lengths):
+        segments = self.segments
+        names = []
+        offset = 0
+        for length in name_lengths:
+            names.append('.'.join([segments[index] for index in
+                                   name_segments[offset:offset + length]]))
+            offset += length
+        return names
+
+    def __getstate__(self):
+        name_segments, name_lengths = self._encode_names()
+        paths = array(_index_typecode(len(self.names)), self.paths)
+
+        # Metrics from one collection run nearly always share a timestamp
+        if self.timestamps and min(self.timestamps) == max(self.timestamps):
+            timestamps = self.timestamps[0]
+        else:
+            timestamps = self.timestamps.tostring()
+        milliseconds = self.milliseconds
+        if milliseconds is not None:
+            if min(milliseconds) == max(milliseconds):
+                milliseconds = milliseconds[0]
+            else:
+                milliseconds = milliseconds.tostring()
+
+        return (self.host, self.ttl, self.prefix, self.segments,
+                name_segments.typecode, name_segments.tostring(),
+                name_lengths.tostring(), paths.typecode, paths.tostring(),
+                self.values.tostring(), timestamps, milliseconds,
+                self.precisions.tostring(), self.flags.tostring(),
+                self.raw_values, self.extra)
+
+    def __setstate__(self, state):
+        (self.host, self.ttl, self.prefix, self.segments, segments_typecode,
+         name_segments, name_lengths, paths_typecode, paths, values,
+         timestamps, milliseconds, precisions, flags, self.raw_values,
+         self.extra) = state
+        segment_indexes = array(segments_typecode)
+        segment_indexes.fromstring(name_segments)
+        segment_counts = array('B')
+        segment_counts.fromstring(name_lengths)
+        self.names = self._decode_names(segment_indexes, segment_counts)
+        self.paths = array(paths_typecode)
+        self.paths.fromstring(paths)
+        self.values = array('d')
+        self.values.fromstring(values)
+        if isinstance(timestamps, str):
+            self.timestamps = array('l')
+            self.timestamps.fromstring(timestamps)
+        else:
+            self.timestamps = array('l', [timestamps]) * len(self.values)
+        if milliseconds is None:
+            self.milliseconds = None
+        elif isinstance(milliseconds, str):
+            self.milliseconds = array('H')
+            self.milliseconds.fromstring(milliseconds)
+        else:
+            self.milliseconds = array('H', [milliseconds]) * len(self.values)
+        self.precisions = array('B')
+        self.precisions.fromstring(precisions)
+        self.flags = array('B')
+        self.flags.fromstring(flags)
+        self._index = {}
+        self._segment_index = {}
+        self._intern = {}
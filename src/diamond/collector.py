@@ -4,6 +4,7 @@
 The Collector class is a base class for all metric collectors.
 """
 
+import itertools
 import os
 import socket
 import platform
@@ -13,8 +14,16 @@ import time
 import re
 import subprocess
 
+from diamond.counters import CounterStore
+from diamond.dedup import ChangeFilter
+from diamond.filter import MetricFilter
 from diamond.metric import Metric
+from diamond.utils.config import copy_config
+from diamond.utils.config import get_collector_config
 from diamond.utils.config import load_config
+from diamond.utils.lru import LRUCache
+from diamond.utils.telemetry import create_telemetry
+from diamond.utils.telemetry import telemetry_name
 from error import DiamondException
 
 # Detect the architecture of the system and set the counters for MAX_VALUES
@@ -26,6 +35,10 @@ if platform.architecture()[0] == '64bit':
 else:
     MAX_COUNTER = (2 ** 32) - 1
 
+# Bounds of the per collector caches of metric paths
+MAX_METRIC_PATHS = 10000
+MAX_METRIC_PATH_PREFIXES = 1000
+
 
 def get_hostname(config, method=None):
     """
@@ -173,17 +186,33 @@ class Collector(object):
             self.name = name
 
         self.handlers = handlers
-        self.last_values = {}
+        self.counters = CounterStore()
+        self.metric_filter = None
+        self.change_filter = None
+        self._metric_path_prefixes = LRUCache(MAX_METRIC_PATH_PREFIXES)
+        self._metric_paths = LRUCache(MAX_METRIC_PATHS)
+        self.metrics_published = 0
+        self.telemetry = None
+        # Timestamp of the metrics published by the current run
+        self.timestamp = None
 
         self.configfile = None
         self.load_config(configfile, config)
+        self.restore_counters()
 
-    def load_config(self, configfile=None, override_config=None):
+    def load_config(self, configfile=None, override_config=None,
+                    collector_config=None):
         """
         Process a configfile, or reload if previously given one.
+
+        The server reloads a collector with collector_config, its section
+        already merged over the default section, rather than every collector
+        reading the config files again.
         """
 
         self.config = configobj.ConfigObj()
+        self._metric_path_prefixes.clear()
+        self._metric_paths.clear()
 
         # Load in the collector's defaults
         if self.get_default_config() is not None:
@@ -192,15 +221,15 @@ class Collector(object):
         if configfile is not None:
             self.configfile = os.path.abspath(configfile)
 
-        if self.configfile is not None:
+        if collector_config is not None:
+            self.config.merge(copy_config(collector_config))
+        elif self.configfile is not None:
             config = load_config(self.configfile)
+            self.config.merge(get_collector_config(config, self.name))
 
-            if 'collectors' in config:
-                if 'default' in config['collectors']:
-                    self.config.merge(config['collectors']['default'])
-
-                if self.name in config['collectors']:
-                    self.config.merge(config['collectors'][self.name])
+            telemetry = create_telemetry(config, self.get_hostname())
+            if telemetry is None or self.telemetry is None:
+                self.telemetry = telemetry
 
         if override_config is not None:
             if 'collectors' in override_config:
@@ -217,6 +246,10 @@ class Collector(object):
         Intended to put any code that should be run after any config reload
         event
         """
+        # Metric paths are built from the config
+        self._metric_path_prefixes.clear()
+        self._metric_paths.clear()
+
         if 'byte_unit' in self.config:
             if isinstance(self.config['byte_unit'], basestring):
                 self.config['byte_unit'] = self.config['byte_unit'].split()
@@ -228,6 +261,14 @@ class Collector(object):
             self.config['measure_collector_time'] = str_to_bool(
                 self.config['measure_collector_time'])
 
+        if 'process_isolation' in self.config:
+            self.config['process_isolation'] = str_to_bool(
+                self.config['process_isolation'])
+
+        if 'align_timestamps' in self.config:
+            self.config['align_timestamps'] = str_to_bool(
+                self.config['align_timestamps'])
+
         # Raise an error if both whitelist and blacklist are specified
         if (self.config.get('metrics_whitelist', None)
                 and self.config.get('metrics_blacklist', None)):
@@ -242,6 +283,18 @@ class Collector(object):
             self.config['metrics_blacklist'] = re.compile(
                 self.config['metrics_blacklist'])
 
+        self.metric_filter = MetricFilter.from_config(
+            self.config.get('metrics_filter', None),
+            self.config.get('metrics_whitelist', None),
+            self.config.get('metrics_blacklist', None))
+
+        self.change_filter = ChangeFilter.from_config(
+            self.config.get('dedup', False),
+            self.config.get('dedup_heartbeat', None))
+
+        self.counters.max_size = int(self.config.get('counters_max_size', 0))
+        self.counters.period = float(self.config['interval'])
+
     def get_default_config_help(self):
         """
         Returns the help text for the configuration options for this collector
@@ -250,10 +303,34 @@ class Collector(object):
             'enabled': 'Enable collecting these metrics',
             'byte_unit': 'Default numeric output(s)',
             'measure_collector_time': 'Collect the collector run time in ms',
+            'process_isolation': 'Always run this collector in its own ' +
+                                 'process, even when collector_pool is ' +
+                                 'enabled',
+            'align_timestamps': 'Timestamp the metrics of a run with the ' +
+                                'time the run was scheduled for instead of ' +
+                                'the time it started',
             'metrics_whitelist': 'Regex to match metrics to transmit. ' +
                                  'Mutually exclusive with metrics_blacklist',
             'metrics_blacklist': 'Regex to match metrics to block. ' +
                                  'Mutually exclusive with metrics_whitelist',
+            'metrics_filter': 'Ordered list of "include <pattern>" and ' +
+                              '"exclude <pattern>" rules, the first ' +
+                              'matching rule decides. Patterns are globs, ' +
+                              'or regexes when prefixed with re:',
+            'dedup': 'Only publish a metric when its value changed, or ' +
+                     'once every dedup_heartbeat intervals',
+            'dedup_heartbeat': 'Intervals between two publications of a ' +
+                               'metric that does not change, when dedup ' +
+                               'is enabled',
+            'counters_ttl': 'Forget the last value of a counter that was ' +
+                            'not published for this many intervals',
+            'counters_max_size': 'Maximum number of counters to keep the ' +
+                                 'last value of, the least recently ' +
+                                 'published are forgotten first. 0 for no ' +
+                                 'limit',
+            'counters_state_dir': 'Directory to save the last values of ' +
+                                  'counters in, so rates continue after a ' +
+                                  'restart',
         }
 
     def get_default_config(self):
@@ -301,11 +378,36 @@ class Collector(object):
             # Collect the collector run time in ms
             'measure_collector_time': False,
 
+            # Don't share a worker process with other collectors
+            'process_isolation': False,
+
+            # Timestamp metrics with the scheduled time of the run
+            'align_timestamps': False,
+
             # Whitelist of metrics to let through
             'metrics_whitelist': None,
 
             # Blacklist of metrics to let through
             'metrics_blacklist': None,
+
+            # Include/exclude rules for metrics
+            'metrics_filter': None,
+
+            # Don't publish values that did not change
+            'dedup': False,
+
+            # Publish unchanged values every so many intervals anyway
+            'dedup_heartbeat': 10,
+
+            # Intervals after which the last value of an unpublished counter
+            # is forgotten
+            'counters_ttl': 10,
+
+            # Maximum number of counter values kept
+            'counters_max_size': 100000,
+
+            # Directory to save counter values in across restarts
+            'counters_state_dir': None,
         }
 
     def get_metric_path(self, name, instance=None):
@@ -315,6 +417,21 @@ class Collector(object):
             virtual machine and should have a different
             root prefix.
         """
+        key = (name, instance)
+        path = self._metric_paths.get(key)
+        if path is None:
+            prefix = self._metric_path_prefixes.get(instance)
+            if prefix is None:
+                prefix = self._build_metric_path(instance)
+                self._metric_path_prefixes[instance] = prefix
+            path = self._metric_paths[key] = prefix + name
+        return path
+
+    def _build_metric_path(self, instance=None):
+        """
+        Build the part of the metric path that comes before the name,
+        including the trailing dot
+        """
         if 'path' in self.config:
             path = self.config['path']
         else:
@@ -326,9 +443,9 @@ class Collector(object):
             else:
                 prefix = 'instances'
             if path == '.':
-                return '.'.join([prefix, instance, name])
+                return '.'.join([prefix, instance, ''])
             else:
-                return '.'.join([prefix, instance, path, name])
+                return '.'.join([prefix, instance, path, ''])
 
         if 'path_prefix' in self.config:
             prefix = self.config['path_prefix']
@@ -352,9 +469,9 @@ class Collector(object):
             prefix = '.'.join((prefix, suffix))
 
         if path == '.':
-            return '.'.join([prefix, name])
+            return '.'.join([prefix, ''])
         else:
-            return '.'.join([prefix, path, name])
+            return '.'.join([prefix, path, ''])
 
     def get_hostname(self):
         return get_hostname(self.config)
@@ -370,12 +487,9 @@ class Collector(object):
         """
         Publish a metric with the given name
         """
-        # Check whitelist/blacklist
-        if self.config['metrics_whitelist']:
-            if not self.config['metrics_whitelist'].match(name):
-                return
-        elif self.config['metrics_blacklist']:
-            if self.config['metrics_blacklist'].match(name):
+        # Check the metrics filter
+        if self.metric_filter is not None:
+            if not self.metric_filter.accept(name):
                 return
 
         # Get metric Path
@@ -387,7 +501,8 @@ class Collector(object):
 
         # Create Metric
         try:
-            metric = Metric(path, value, raw_value=raw_value, timestamp=None,
+            metric = Metric(path, value, raw_value=raw_value,
+                            timestamp=self.timestamp,
                             precision=precision, host=self.get_hostname(),
                             metric_type=metric_type, ttl=ttl)
         except DiamondException:
@@ -398,10 +513,64 @@ class Collector(object):
         # Publish Metric
         self.publish_metric(metric)
 
+    def publish_many(self, names, values, raw_values=None, precision=0,
+                     metric_type='GAUGE', instance=None):
+        """
+        Publish a metric for each name and value in the names and values
+        sequences. raw_values may be a sequence of the same length, precision
+        a single precision or a sequence.
+
+        The path prefix, hostname, ttl and timestamp are worked out once for
+        all of the metrics instead of once per metric like publish() does.
+        """
+        if raw_values is None:
+            raw_values = itertools.repeat(None)
+        if isinstance(precision, (int, long)):
+            precisions = itertools.repeat(precision)
+        else:
+            precisions = precision
+
+        metric_filter = self.metric_filter
+
+        # Everything up to the name is the same for all of the metrics
+        prefix = self.get_metric_path('', instance=instance)
+        host = self.get_hostname()
+        ttl = float(self.config['interval']) * float(
+            self.config['ttl_multiplier'])
+        timestamp = self.timestamp
+        if timestamp is None:
+            # Outside of a run, stamp it the way publish() does
+            timestamp = int(time.time())
+
+        for name, value, raw_value, precision in itertools.izip(
+                names, values, raw_values, precisions):
+            # Check the metrics filter
+            if metric_filter is not None:
+                if not metric_filter.accept(name):
+                    continue
+
+            path = prefix + name
+            try:
+                metric = Metric(path, value, raw_value=raw_value,
+                                timestamp=timestamp, precision=precision,
+                                host=host, metric_type=metric_type, ttl=ttl)
+            except DiamondException:
+                self.log.error(('Error when creating new Metric: path=%r, '
+                                'value=%r'), path, value)
+                raise
+
+            self.publish_metric(metric)
+
     def publish_metric(self, metric):
         """
         Publish a Metric object
         """
+        if self.change_filter is not None:
+            if not self.change_filter.accept(metric.path, metric.value):
+                return
+
+        self.metrics_published += 1
+
         # Process Metric
         for handler in self.handlers:
             handler._process(metric)
@@ -422,6 +591,24 @@ class Collector(object):
                             precision=precision, metric_type='COUNTER',
                             instance=instance)
 
+    def publish_counters_many(self, names, values, precision=0, max_value=0,
+                              time_delta=True, interval=None,
+                              allow_negative=False, instance=None):
+        """
+        Publish the rate of change of each of the counters in the names and
+        values sequences, like publish_counter() does for a single counter
+        """
+        names = list(names)
+        values = list(values)
+        rates = self.derivatives(names, values, max_value=max_value,
+                                 time_delta=time_delta, interval=interval,
+                                 allow_negative=allow_negative,
+                                 instance=instance)
+
+        return self.publish_many(names, rates, raw_values=values,
+                                 precision=precision, metric_type='COUNTER',
+                                 instance=instance)
+
     def derivative(self, name, new, max_value=0,
                    time_delta=True, interval=None,
                    allow_negative=False, instance=None):
@@ -431,46 +618,122 @@ class Collector(object):
         # Format Metric Path
         path = self.get_metric_path(name, instance=instance)
 
-        if path in self.last_values:
-            old = self.last_values[path]
-            # Check for rollover
-            if new < old:
-                old = old - max_value
-            # Get Change in X (value)
-            derivative_x = new - old
-
-            # If we pass in a interval, use it rather then the configured one
-            if interval is None:
-                interval = int(self.config['interval'])
-
-            # Get Change in Y (time)
-            if time_delta:
-                derivative_y = interval
-            else:
-                derivative_y = 1
+        return self._path_derivative(
+            path, new, max_value,
+            self._derivative_interval(time_delta, interval), allow_negative)
 
-            result = float(derivative_x) / float(derivative_y)
-            if result < 0 and not allow_negative:
-                result = 0
+    def _derivative_interval(self, time_delta, interval):
+        """
+        Returns the change in time to divide the change of a counter by
+        """
+        if not time_delta:
+            return 1
+
+        # If we pass in a interval, use it rather then the configured one
+        if interval is None:
+            interval = int(self.config['interval'])
+        return interval
+
+    def derivatives(self, names, values, max_value=0, time_delta=True,
+                    interval=None, allow_negative=False, instance=None,
+                    timestamps=None):
+        """
+        Calculate the derivatives of a table of counters in one go. names and
+        values are sequences, timestamps may be a sequence of the times the
+        values were sampled at. With timestamps and time_delta set, the rates
+        are per second between the samples instead of per interval.
+        """
+        prefix = self.get_metric_path('', instance=instance)
+        if timestamps is not None and time_delta and interval is None:
+            derivative_y = None
         else:
-            result = 0
+            derivative_y = self._derivative_interval(time_delta, interval)
 
-        # Store Old Value
-        self.last_values[path] = new
+        return self.counters.rates([prefix + name for name in names], values,
+                                   max_value=max_value, interval=derivative_y,
+                                   timestamps=timestamps,
+                                   allow_negative=allow_negative)
 
-        # Return result
-        return result
+    def _path_derivative(self, path, new, max_value, derivative_y,
+                         allow_negative):
+        """
+        Calculate the derivative of the metric with the given path
+        """
+        return self.counters.rate(path, new, max_value=max_value,
+                                  interval=derivative_y,
+                                  allow_negative=allow_negative)
+
+    def get_counters_state_path(self):
+        """
+        Returns the path of the file the counter values are saved to, or
+        None if they are not saved
+        """
+        directory = self.config.get('counters_state_dir', None)
+        if not directory:
+            return None
+        return os.path.join(directory,
+                            '%s.counters' % self.name.replace(os.sep, '_'))
 
-    def _run(self):
+    def save_counters(self):
+        """
+        Save the last values of the counters
+        """
+        path = self.get_counters_state_path()
+        if path is None:
+            return
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            self.counters.save(path)
+        except (IOError, OSError), e:
+            self.log.error('%s: Failed to save counters to %s: %s',
+                           self.name, path, e)
+
+    def restore_counters(self):
+        """
+        Load the counter values saved by save_counters(), unless they are
+        older than counters_ttl intervals
+        """
+        path = self.get_counters_state_path()
+        if path is None or not os.path.exists(path):
+            return
+        max_age = (float(self.config['interval']) *
+                   int(self.config.get('counters_ttl', 10)))
+        try:
+            count = self.counters.load(path, max_age)
+        except Exception, e:
+            self.log.error('%s: Failed to load counters from %s: %s',
+                           self.name, path, e)
+            return
+        self.log.debug('%s: Restored %d counters', self.name, count)
+
+    def get_cycle_timestamp(self, start_time, scheduled=None):
+        """
+        Returns the timestamp for the metrics of a run started at
+        start_time, which is the time it was scheduled for if
+        align_timestamps is set and the run is not a whole interval late
+        """
+        if scheduled is not None and self.config.get('align_timestamps'):
+            if 0 <= start_time - scheduled < float(self.config['interval']):
+                return float(scheduled)
+        return start_time
+
+    def _run(self, scheduled=None):
         """
         Run the collector unless it's already running
         """
         try:
             start_time = time.time()
+            # All metrics of this run get the same timestamp
+            self.timestamp = self.get_cycle_timestamp(start_time, scheduled)
+            self.counters.tick(start_time)
 
             # Collect Data
             self.collect()
 
+            # Forget the counters of things that went away
+            self.counters.expire(int(self.config.get('counters_ttl', 10)))
+
             end_time = time.time()
             collector_time = int((end_time - start_time) * 1000)
 
@@ -481,12 +744,49 @@ class Collector(object):
                     metric_name = 'collector_time_ms'
                     metric_value = collector_time
                     self.publish(metric_name, metric_value)
+
+            if self.telemetry is not None:
+                self.telemetry.timing(
+                    telemetry_name('collectors', self.name, 'run_time_ms'),
+                    collector_time)
         finally:
+            self.timestamp = None
+
+            if self.telemetry is not None:
+                self.publish_telemetry()
+
             # After collector run, invoke a flush
             # method on each handler.
             for handler in self.handlers:
                 handler._flush()
 
+            self.save_counters()
+
+    def publish_telemetry(self):
+        """
+        Publish the telemetry of this collector once per telemetry interval
+        """
+        self.telemetry.total(
+            telemetry_name('collectors', self.name, 'metrics'),
+            self.metrics_published)
+        self.telemetry.gauge(
+            telemetry_name('collectors', self.name, 'counters'),
+            len(self.counters))
+        self.telemetry.total(
+            telemetry_name('collectors', self.name, 'counters_evicted'),
+            self.counters.evicted)
+        if self.change_filter is not None:
+            self.telemetry.total(
+                telemetry_name('collectors', self.name, 'metrics_suppressed'),
+                self.change_filter.suppressed)
+
+        if not self.telemetry.due():
+            return
+
+        for metric in self.telemetry.collect():
+            for handler in self.handlers:
+                handler._process(metric)
+
     def find_binary(self, binary):
         """
         Scan and return the first path to a binary that we can find
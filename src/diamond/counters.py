@@ -0,0 +1,487 @@
+# coding=utf-8
+
+"""
+Keeps the previous sample of the counters a collector turns into rates.
+
+A dict maps every counter to its slot. The last values are kept in a list
+just as the collector passed them, so integer counters stay exact however
+large they get. The sample times and cycles live in arrays, NumPy arrays when
+NumPy is installed. CounterStore.rates() works out the rates of a whole table
+of counters in one call, vectorized with NumPy or in a plain loop without it.
+The rates the 64 bit floats of NumPy would get wrong, of counters beyond
+2 ** 53 or that wrapped at a large max_value, are worked out again exactly.
+
+Every counter remembers the cycle it was last seen in. Counters that have not
+been seen for a number of cycles are dropped by expire(), and once the store
+holds max_size counters the least recently seen ones are dropped to make room
+for new ones, so counters of containers, processes or interfaces that have
+gone away do not pile up.
+
+The counters can be saved to a file and loaded again after a restart, so the
+first sample after the restart has a rate instead of 0. The rate of that
+sample is taken over the time since the saved sample.
+"""
+
+import array
+import cPickle
+import heapq
+import os
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Number of slots allocated up front, the arrays double when they are full
+INITIAL_SIZE = 64
+
+# Part of max_size evicted at once when the store is full
+EVICT_FRACTION = 0.05
+
+# Marks free slots in the seen array so they are never evicted
+FREE = float('inf')
+
+# Version of the format of saved counters
+SAVE_VERSION = 2
+
+# Integers up to this size are exact as 64 bit floats
+MAX_EXACT_INT = 2 ** 53
+
+
+class CounterStore(object):
+    """
+    The last value, and the time it was sampled, of every counter by key
+    """
+
+    def __init__(self, use_numpy=None, max_size=0):
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        self.use_numpy = use_numpy and numpy is not None
+        # 0 for no limit
+        self.max_size = max_size
+        self.cycle = 0
+        # Time the current cycle started, the sample time of counters
+        # sampled without a timestamp
+        self.now = time.time()
+        # Seconds between cycles, used to scale the rates of restored
+        # counters. 0 if unknown.
+        self.period = 0
+        # Number of counters dropped by expire() or to make room
+        self.evicted = 0
+
+        # key -> slot
+        self.slots = {}
+        # slot -> key, None for free slots
+        self.keys = []
+        self.free = []
+        # slot -> last value
+        self.values = []
+        self.times = self._new_array(INITIAL_SIZE)
+        self.seen = self._new_array(INITIAL_SIZE)
+        # Slots loaded from a file that were not sampled since
+        self.restored = set()
+
+    def _new_array(self, size):
+        if self.use_numpy:
+            return numpy.zeros(size, dtype=numpy.float64)
+        return array.array('d', [0.0]) * size
+
+    def _grow(self, size):
+        capacity = len(self.times)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in ('times', 'seen'):
+            old = getattr(self, name)
+            new = self._new_array(capacity)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _slot(self, key, keep_current=False):
+        """
+        Allocates a slot for a new counter, evicting the least recently seen
+        counters if the store is full. With keep_current set, counters seen
+        in the current cycle are kept even if that overflows max_size.
+        """
+        if self.max_size and len(self.slots) >= self.max_size:
+            self._evict(len(self.slots) - self.max_size +
+                        max(1, int(self.max_size * EVICT_FRACTION)),
+                        keep_current)
+
+        if self.free:
+            slot = self.free.pop()
+            self.keys[slot] = key
+        else:
+            slot = len(self.keys)
+            self._grow(slot + 1)
+            self.keys.append(key)
+            self.values.append(0)
+        self.slots[key] = slot
+        self.seen[slot] = self.cycle
+        return slot
+
+    def _release(self, slot):
+        del self.slots[self.keys[slot]]
+        self.keys[slot] = None
+        self.seen[slot] = FREE
+        self.restored.discard(slot)
+        self.free.append(slot)
+        self.evicted += 1
+
+    def _evict(self, count, keep_current=False):
+        """
+        Drop the count least recently seen counters
+        """
+        if self.use_numpy:
+            seen = self.seen[:len(self.keys)]
+            count = min(count, len(seen))
+            slots = numpy.argpartition(seen, count - 1)[:count]
+            slots = slots[numpy.argsort(seen[slots])].tolist()
+        else:
+            seen = self.seen
+            slots = heapq.nsmallest(count, self.slots.itervalues(),
+                                    key=seen.__getitem__)
+
+        for slot in slots:
+            if seen[slot] == FREE:
+                continue
+            if keep_current and seen[slot] >= self.cycle:
+                break
+            self._release(slot)
+
+    def tick(self, now=None):
+        """
+        Start a new cycle
+        """
+        if now is None:
+            now = time.time()
+        self.cycle += 1
+        self.now = now
+
+    def expire(self, cycles):
+        """
+        Drop the counters that were not seen in the last cycles cycles
+        """
+        limit = self.cycle - cycles
+        if self.use_numpy:
+            slots = numpy.nonzero(self.seen[:len(self.keys)] < limit)[0]
+            slots = slots.tolist()
+        else:
+            seen = self.seen
+            slots = [slot for slot in self.slots.itervalues()
+                     if seen[slot] < limit]
+        for slot in slots:
+            self._release(slot)
+        return len(slots)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, key):
+        return key in self.slots
+
+    def get(self, key, default=None):
+        """
+        Returns the last value of a counter
+        """
+        slot = self.slots.get(key)
+        if slot is None:
+            return default
+        return self.values[slot]
+
+    def save(self, path):
+        """
+        Write the counters to a file, replacing it atomically
+        """
+        keys = []
+        slots = []
+        for slot, key in enumerate(self.keys):
+            if key is not None:
+                keys.append(key)
+                slots.append(slot)
+        values = [self.values[slot] for slot in slots]
+        if self.use_numpy:
+            times = self.times[numpy.array(slots, dtype=numpy.intp)]
+            times = times.tostring()
+        else:
+            times = array.array('d', [self.times[slot] for slot in slots])
+            times = times.tostring()
+
+        state = {
+            'version': SAVE_VERSION,
+            'time': time.time(),
+            'keys': keys,
+            'values': values,
+            'times': times,
+        }
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        f = open(temp_path, 'wb')
+        try:
+            cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(temp_path, path)
+
+    def load(self, path, max_age=None):
+        """
+        Load the counters saved by save(), skipping those sampled more than
+        max_age seconds ago. Counters already in the store are kept. Returns
+        the number of counters loaded.
+        """
+        f = open(path, 'rb')
+        try:
+            state = cPickle.load(f)
+        finally:
+            f.close()
+        if state.get('version') != SAVE_VERSION:
+            return 0
+
+        values = state['values']
+        times = array.array('d')
+        times.fromstring(state['times'])
+        if not len(values) == len(times) == len(state['keys']):
+            return 0
+
+        oldest = None
+        if max_age is not None:
+            oldest = time.time() - max_age
+
+        count = 0
+        for key, value, sampled in zip(state['keys'], values, times):
+            if key in self.slots or (oldest is not None and sampled < oldest):
+                continue
+            slot = self._slot(key)
+            self.values[slot] = value
+            self.times[slot] = sampled
+            self.restored.add(slot)
+            count += 1
+        return count
+
+    def rate(self, key, value, max_value=0, interval=None, timestamp=None,
+             allow_negative=False):
+        """
+        Store a new sample of a counter and return its rate of change since
+        the last one, per interval or, without an interval, per second
+        between the timestamps of the samples. The first sample of a counter
+        has a rate of 0. A counter that went down is taken to have wrapped
+        at max_value. Negative rates are returned as 0 unless
+        allow_negative is set.
+        """
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self._slot(key)
+            result = 0
+        else:
+            self.seen[slot] = self.cycle
+            old = self.values[slot]
+            # Check for rollover
+            if value < old:
+                old = old - max_value
+
+            if interval is not None:
+                derivative_y = interval
+                if self.restored and slot in self.restored:
+                    derivative_y = self._catch_up(slot, interval, timestamp)
+            elif timestamp is not None:
+                derivative_y = timestamp - self.times[slot]
+            else:
+                derivative_y = 1
+
+            if derivative_y <= 0:
+                result = 0
+            else:
+                result = float(value - old) / float(derivative_y)
+                if result < 0 and not allow_negative:
+                    result = 0
+
+        self.values[slot] = value
+        if timestamp is None:
+            timestamp = self.now
+        self.times[slot] = timestamp
+        self.restored.discard(slot)
+        return result
+
+    def _catch_up(self, slot, interval, timestamp=None):
+        """
+        Returns the interval to use for the first sample of a restored
+        counter, stretched by the time that passed since the saved sample
+        """
+        if not self.period:
+            return interval
+        if timestamp is None:
+            timestamp = self.now
+        elapsed = timestamp - self.times[slot]
+        if elapsed <= 0:
+            return interval
+        return interval * elapsed / self.period
+
+    def rates(self, keys, values, max_value=0, interval=None, timestamps=None,
+              allow_negative=False):
+        """
+        Like rate(), for sequences of keys and values at once. timestamps
+        may be a single timestamp for all of the samples or a sequence.
+        Returns a list of rates. A key that is repeated gets all of its rates
+        against the sample before the call, the last value is kept.
+        """
+        if not isinstance(keys, (list, tuple)):
+            keys = list(keys)
+        if not isinstance(values, (list, tuple)):
+            values = list(values)
+
+        get = self.slots.get
+        slots = [get(key) for key in keys]
+        new = []
+        if None in slots:
+            # Mark the known counters as seen first so making room for the
+            # new ones does not evict them
+            for slot in slots:
+                if slot is not None:
+                    self.seen[slot] = self.cycle
+            added = {}
+            for index, slot in enumerate(slots):
+                if slot is None:
+                    key = keys[index]
+                    slot = added.get(key)
+                    if slot is None:
+                        slot = self._slot(key, keep_current=True)
+                        added[key] = slot
+                    slots[index] = slot
+                    new.append(index)
+
+        if timestamps is None or not hasattr(timestamps, '__iter__'):
+            timestamps = [timestamps] * len(slots)
+        elif not isinstance(timestamps, (list, tuple)):
+            timestamps = list(timestamps)
+
+        # index -> interval of the first samples of restored counters
+        catch_up = None
+        if self.restored:
+            if interval is not None:
+                catch_up = {}
+                for index, slot in enumerate(slots):
+                    if slot in self.restored:
+                        catch_up[index] = self._catch_up(slot, interval,
+                                                         timestamps[index])
+            self.restored.difference_update(slots)
+
+        if self.use_numpy:
+            return self._numpy_rates(slots, values, new, max_value, interval,
+                                     timestamps, allow_negative, catch_up)
+
+        new = set(new)
+        seen = self.seen
+        cycle = self.cycle
+        last = self.values
+        times = self.times
+        result = []
+        for index, slot in enumerate(slots):
+            value = values[index]
+            timestamp = timestamps[index]
+            seen[slot] = cycle
+            if index in new:
+                rate = 0.0
+            else:
+                old = last[slot]
+                if value < old:
+                    old = old - max_value
+
+                if interval is not None:
+                    derivative_y = interval
+                    if catch_up and index in catch_up:
+                        derivative_y = catch_up[index]
+                elif timestamp is not None:
+                    derivative_y = timestamp - times[slot]
+                else:
+                    derivative_y = 1
+
+                if derivative_y <= 0:
+                    rate = 0.0
+                else:
+                    rate = float(value - old) / float(derivative_y)
+                    if rate < 0 and not allow_negative:
+                        rate = 0.0
+            result.append(rate)
+
+        # Only store the samples once all of the rates are worked out, like
+        # NumPy does
+        now = self.now
+        for index, slot in enumerate(slots):
+            last[slot] = values[index]
+            timestamp = timestamps[index]
+            if timestamp is None:
+                timestamp = now
+            times[slot] = timestamp
+        return result
+
+    def _numpy_rates(self, slots, values, new_indexes, max_value, interval,
+                     timestamps, allow_negative, catch_up=None):
+        last = self.values
+        old_values = [last[slot] for slot in slots]
+        for index, slot in enumerate(slots):
+            last[slot] = values[index]
+
+        slots = numpy.array(slots, dtype=numpy.intp)
+        self.seen[slots] = self.cycle
+        new = numpy.array(values, dtype=numpy.float64)
+        old = numpy.array(old_values, dtype=numpy.float64)
+
+        # Floats can't tell these apart from their neighbours, their rates
+        # are worked out exactly below
+        inexact = numpy.abs(new) >= MAX_EXACT_INT
+        inexact |= numpy.abs(old) >= MAX_EXACT_INT
+
+        # Check for rollover
+        rolled = new < old
+        old = numpy.where(rolled, old - max_value, old)
+        if abs(max_value) >= MAX_EXACT_INT:
+            inexact |= rolled
+
+        if None in timestamps:
+            timestamps = [self.now if timestamp is None else timestamp
+                          for timestamp in timestamps]
+            sampled = False
+        else:
+            sampled = True
+        timestamps = numpy.array(timestamps, dtype=numpy.float64)
+
+        if interval is not None:
+            derivative_y = numpy.float64(interval)
+            if catch_up:
+                derivative_y = numpy.repeat(derivative_y, len(slots))
+                derivative_y[catch_up.keys()] = catch_up.values()
+        elif sampled:
+            derivative_y = timestamps - self.times[slots]
+        else:
+            derivative_y = numpy.float64(1)
+        self.times[slots] = timestamps
+
+        errors = numpy.seterr(divide='ignore', invalid='ignore')
+        try:
+            result = (new - old) / derivative_y
+        finally:
+            numpy.seterr(**errors)
+
+        zero = numpy.zeros(len(slots), dtype=bool)
+        if new_indexes:
+            zero[new_indexes] = True
+        zero |= derivative_y <= 0
+        inexact &= ~zero
+        if not allow_negative:
+            zero |= result < 0
+        result[zero] = 0
+        result = result.tolist()
+
+        if inexact.any():
+            derivative_y = numpy.broadcast_to(derivative_y, (len(slots),))
+            for index in numpy.nonzero(inexact)[0].tolist():
+                value = values[index]
+                old_value = old_values[index]
+                if value < old_value:
+                    old_value = old_value - max_value
+                rate = float(value - old_value) / float(derivative_y[index])
+                if rate < 0 and not allow_negative:
+                    rate = 0.0
+                result[index] = rate
+        return result
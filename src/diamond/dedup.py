@@ -0,0 +1,62 @@
+# coding=utf-8
+
+"""
+Suppression of metrics whose value did not change.
+
+Many series, like the size of a filesystem or the total memory, hardly ever
+change, yet are sent every interval. With dedup enabled for a collector or a
+handler, a value equal to the last one passed on for the same path is
+dropped. To show the series is still alive it is passed on anyway once every
+dedup_heartbeat samples.
+
+The last value of every path is kept in a bounded cache, a path that was
+evicted simply has its next value passed on.
+"""
+
+from diamond.utils.config import str_to_bool
+from diamond.utils.lru import LRUCache
+
+# Number of paths whose last value is remembered
+DEFAULT_CACHE_SIZE = 100000
+
+# Samples between two values passed on for a series that does not change
+DEFAULT_HEARTBEAT = 10
+
+
+class ChangeFilter(object):
+    """
+    Passes a value when it differs from the last value passed for the same
+    path, or when heartbeat samples have gone by since then
+    """
+
+    def __init__(self, heartbeat=DEFAULT_HEARTBEAT,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        self.heartbeat = max(int(heartbeat), 1)
+        # path -> (last value passed, number of samples suppressed since)
+        self.last = LRUCache(cache_size)
+        self.suppressed = 0
+
+    @classmethod
+    def from_config(cls, dedup=False, heartbeat=None):
+        """
+        Returns a filter for the dedup and dedup_heartbeat options, or None
+        if dedup is not enabled
+        """
+        if not str_to_bool(dedup or False):
+            return None
+        if heartbeat is None:
+            heartbeat = DEFAULT_HEARTBEAT
+        return cls(heartbeat)
+
+    def accept(self, path, value):
+        """
+        Returns True if the value should be passed on
+        """
+        last = self.last.get(path)
+        if (last is not None and last[0] == value
+                and last[1] + 1 < self.heartbeat):
+            self.last[path] = (value, last[1] + 1)
+            self.suppressed += 1
+            return False
+        self.last[path] = (value, 0)
+        return True
@@ -0,0 +1,129 @@
+# coding=utf-8
+
+"""
+Include/exclude filtering of metric names and paths.
+
+A filter is an ordered list of rules. Each rule is written as
+
+    include <pattern>
+    exclude <pattern>
+
+where the pattern is a shell style glob, or a regular expression when it
+starts with re: (for example "exclude re:cpu\\d+\\.idle"). Regular expressions
+match at the start of the name, like metrics_whitelist/metrics_blacklist do,
+globs must match the whole name. The first rule that matches decides. A name
+that matches no rule is accepted, unless the filter has include rules, then it
+is rejected.
+
+Metric names hardly change from one collection to the next, so the decision
+for every name is remembered in a bounded cache.
+"""
+
+import fnmatch
+import re
+
+from diamond.error import DiamondException
+from diamond.utils.lru import LRUCache
+
+# Number of decisions remembered per filter
+DEFAULT_CACHE_SIZE = 20000
+
+ACTIONS = ['include', 'exclude']
+
+
+def compile_pattern(pattern):
+    """
+    Compile a glob, or a regex if prefixed with re:, into a regex
+    """
+    if isinstance(pattern, basestring):
+        if pattern.startswith('re:'):
+            return re.compile(pattern[3:])
+        if pattern.startswith('glob:'):
+            pattern = pattern[5:]
+        return re.compile(fnmatch.translate(pattern))
+    # Already compiled
+    return pattern
+
+
+def parse_rule(rule):
+    """
+    Parse a rule like "include cpu.*" into an (include, regex) tuple
+    """
+    try:
+        action, pattern = rule.strip().split(None, 1)
+    except ValueError:
+        raise DiamondException('Invalid metric filter rule %r' % rule)
+    action = action.lower()
+    if action not in ACTIONS:
+        raise DiamondException('Invalid metric filter action %r in %r'
+                               % (action, rule))
+    try:
+        return (action == 'include', compile_pattern(pattern.strip()))
+    except re.error, e:
+        raise DiamondException('Invalid metric filter pattern in %r: %s'
+                               % (rule, e))
+
+
+class MetricFilter(object):
+    """
+    Accepts or rejects names by an ordered list of include/exclude rules
+    """
+
+    def __init__(self, rules, cache_size=DEFAULT_CACHE_SIZE):
+        self.rules = []
+        for rule in rules:
+            if isinstance(rule, basestring):
+                rule = parse_rule(rule)
+            self.rules.append(rule)
+
+        # Without include rules everything not excluded is accepted
+        self.default = True
+        for include, regex in self.rules:
+            if include:
+                self.default = False
+                break
+
+        self.decisions = LRUCache(cache_size)
+
+    @classmethod
+    def from_config(cls, rules=None, whitelist=None, blacklist=None):
+        """
+        Returns a filter for a metrics_filter rule list and/or a
+        metrics_whitelist or metrics_blacklist regex, or None when there is
+        nothing to filter
+        """
+        if isinstance(rules, basestring):
+            rules = [rules]
+        rules = [rule for rule in rules or [] if rule]
+        if whitelist:
+            rules.append((True, re.compile(whitelist)))
+        elif blacklist:
+            rules.append((False, re.compile(blacklist)))
+
+        if not rules:
+            return None
+        return cls(rules)
+
+    def accept(self, name):
+        """
+        Returns True if the name passes the filter
+        """
+        # Look in the young generation of the cache directly, this is the
+        # common case and saves a method call per name
+        try:
+            return self.decisions.young[name]
+        except KeyError:
+            pass
+
+        decision = self.decisions.get(name)
+        if decision is None:
+            decision = self.default
+            for include, regex in self.rules:
+                if regex.match(name):
+                    decision = include
+                    break
+            self.decisions[name] = decision
+        return decision
+
+    def __call__(self, name):
+        return self.accept(name)
@@ -1,16 +1,31 @@
 # coding=utf-8
 
 import logging
+import os
 import threading
 import traceback
 from configobj import ConfigObj
 import time
 
+from diamond.dedup import ChangeFilter
+from diamond.filter import MetricFilter
+from diamond.handler.buffer import MetricBuffer
+from diamond.handler.spool import DEFAULT_MAX_BYTES as \
+    DEFAULT_SPOOL_MAX_BYTES
+from diamond.handler.spool import DEFAULT_SEGMENT_BYTES as \
+    DEFAULT_SPOOL_SEGMENT_BYTES
+from diamond.handler.spool import Spool
+
 
 class Handler(object):
     """
     Handlers process metrics that are collected by Collectors.
     """
+
+    # Buffered handlers only implement encode() and send(), the base class
+    # buffers the encoded metrics and sends them when a batch is due
+    buffered = False
+
     def __init__(self, config=None, log=None):
         """
         Create a new instance of the Handler class
@@ -38,6 +53,31 @@ class Handler(object):
         self.server_error_interval = float(self.config['server_error_interval'])
         self._errors = {}
 
+        # Counted for the telemetry
+        self.failures = 0
+        self.trimmed = 0
+
+        # Only handle the metrics whose path passes the filter
+        self.metric_filter = MetricFilter.from_config(
+            self.config.get('metrics_filter', None))
+
+        # Only handle the metrics whose value changed
+        self.change_filter = ChangeFilter.from_config(
+            self.config.get('dedup', False),
+            self.config.get('dedup_heartbeat', None))
+
+        # Encoded metrics waiting to be sent
+        self.buffer = None
+        if self.buffered:
+            self.buffer = self.create_buffer()
+
+        # Encoded metrics trimmed from the backlog, waiting to be replayed
+        self.spool = None
+        if self.buffered:
+            self.spool = self.create_spool()
+            self.spool_replay_rate = float(self.config['spool_replay_rate'])
+            self.spool_replayed = time.time()
+
         # Initialize Lock
         self.lock = threading.Lock()
 
@@ -45,32 +85,165 @@ class Handler(object):
         """
         Returns the help text for the configuration options for this handler
         """
-        return {
+        config = {
             'get_default_config_help': 'get_default_config_help',
             'server_error_interval': ('How frequently to send repeated server '
                                       'errors'),
+            'queue_size': ('How many metrics to queue for this handler '
+                           'before dropping some'),
+            'queue_overflow': ('Which metrics to drop when the queue is '
+                               'full, drop_oldest or drop_newest'),
+            'metrics_filter': ('Ordered list of "include <pattern>" and '
+                               '"exclude <pattern>" rules for the metric '
+                               'paths to handle. Patterns are globs, or '
+                               'regexes when prefixed with re:'),
+            'dedup': ('Only handle a metric when its value changed, or once '
+                      'every dedup_heartbeat samples'),
+            'dedup_heartbeat': ('Samples between two metrics handled for a '
+                                'series that does not change, when dedup is '
+                                'enabled'),
         }
 
+        if self.buffered:
+            config.update({
+                'batch': 'How many metrics to store before sending',
+                'batch_max_bytes': ('How many bytes of metrics to store '
+                                    'before sending, 0 for no limit'),
+                'batch_max_age': ('Most seconds to store a metric before '
+                                  'sending, 0 for no limit'),
+                'max_backlog_multiplier': ('How many batches to store while '
+                                           'sending fails before trimming'),
+                'trim_backlog_multiplier': ('How many batches to keep when '
+                                            'trimming'),
+                'spool_dir': ('Directory to spool the metrics trimmed from '
+                              'the backlog to, rather than dropping them'),
+                'spool_max_bytes': ('Most bytes to spool, the oldest metrics '
+                                    'are dropped beyond that'),
+                'spool_segment_bytes': 'Size of the spool files',
+                'spool_replay_rate': ('Most spooled metrics to send a second '
+                                      'once sending works again, 0 for no '
+                                      'limit'),
+            })
+
+        return config
+
     def get_default_config(self):
         """
         Return the default config for the handler
         """
-        return {
+        config = {
             'get_default_config': 'get_default_config',
             'server_error_interval': 120,
+            'queue_size': 100000,
+            'queue_overflow': 'drop_oldest',
+            'metrics_filter': None,
+            'dedup': False,
+            'dedup_heartbeat': 10,
         }
 
+        if self.buffered:
+            config.update({
+                'batch': 1,
+                'batch_max_bytes': 0,
+                'batch_max_age': 10,
+                'max_backlog_multiplier': 5,
+                'trim_backlog_multiplier': 4,
+                'spool_dir': None,
+                'spool_max_bytes': DEFAULT_SPOOL_MAX_BYTES,
+                'spool_segment_bytes': DEFAULT_SPOOL_SEGMENT_BYTES,
+                'spool_replay_rate': 1000,
+            })
+
+        return config
+
+    def create_buffer(self):
+        """
+        Returns the buffer for the encoded metrics of a buffered handler
+        """
+        return MetricBuffer.from_config(self.config)
+
+    def get_spool_path(self):
+        """
+        Returns the directory to spool metrics to, or None if they are not
+        spooled
+        """
+        directory = self.config.get('spool_dir', None)
+        if not directory:
+            return None
+        return os.path.join(directory, self.__class__.__name__)
+
+    def create_spool(self):
+        """
+        Returns the spool for the metrics trimmed from the backlog of a
+        buffered handler, or None if they are dropped
+        """
+        path = self.get_spool_path()
+        if path is None:
+            return None
+        try:
+            return Spool(path, int(self.config['spool_max_bytes']),
+                         int(self.config['spool_segment_bytes']))
+        except (IOError, OSError), e:
+            self.log.error('%s: Failed to open spool %s: %s',
+                           self.__class__.__name__, path, e)
+            return None
+
     def _process(self, metric):
         """
         Decorator for processing handlers with a lock, catching exceptions
         """
         if not self.enabled:
             return
+        if self.metric_filter is not None:
+            if not self.metric_filter.accept(metric.path):
+                return
+        if self.change_filter is not None:
+            if not self.change_filter.accept(metric.path, metric.value):
+                return
         try:
             try:
                 self.lock.acquire()
                 self.process(metric)
             except Exception:
+                self.failures += 1
+                self.log.error(traceback.format_exc())
+        finally:
+            if self.lock.locked():
+                self.lock.release()
+
+    def _process_batch(self, metrics):
+        """
+        Decorator for processing a batch of metrics with the lock taken once
+        for the whole batch, catching exceptions
+        """
+        if not self.enabled:
+            return
+        if type(self)._process.im_func is not Handler._process.im_func:
+            # The handler does its own thing in _process
+            for metric in metrics:
+                self._process(metric)
+            return
+
+        metric_filter = self.metric_filter
+        change_filter = self.change_filter
+        if metric_filter is not None or change_filter is not None:
+            accepted = []
+            for metric in metrics:
+                if metric_filter is not None:
+                    if not metric_filter.accept(metric.path):
+                        continue
+                if change_filter is not None:
+                    if not change_filter.accept(metric.path, metric.value):
+                        continue
+                accepted.append(metric)
+            metrics = accepted
+
+        try:
+            try:
+                self.lock.acquire()
+                self.process_batch(metrics)
+            except Exception:
+                self.failures += 1
                 self.log.error(traceback.format_exc())
         finally:
             if self.lock.locked():
@@ -80,33 +253,179 @@ class Handler(object):
         """
         Process a metric
 
-        Should be overridden in subclasses
+        Should be overridden in subclasses that are not buffered
+        """
+        if self.buffer is None:
+            raise NotImplementedError
+        item = self.encode(metric)
+        if item is not None:
+            self.buffer.add(item)
+        if self.buffer.due():
+            self._send_buffer()
+
+    def process_batch(self, metrics):
+        """
+        Process a batch of metrics, usually the metrics of one collector run
+
+        Calls process() for every metric, so a failing metric does not take
+        the rest of the batch with it. Handlers that can send a batch at once
+        should override this.
+        """
+        if self.buffer is not None:
+            items = []
+            for metric in metrics:
+                try:
+                    item = self.encode(metric)
+                except Exception:
+                    self.failures += 1
+                    self.log.error(traceback.format_exc())
+                    continue
+                if item is not None:
+                    items.append(item)
+            self.buffer.extend(items)
+            if self.buffer.due():
+                self._send_buffer()
+            return
+        for metric in metrics:
+            try:
+                self.process(metric)
+            except Exception:
+                self.failures += 1
+                self.log.error(traceback.format_exc())
+
+    def encode(self, metric):
+        """
+        Encode a metric for a buffered handler
+
+        Should be overridden in buffered subclasses. Metrics encoded as
+        strings count towards batch_max_bytes, a metric encoded as None is
+        not sent.
         """
         raise NotImplementedError
 
-    def _flush(self):
+    def send(self, metrics):
+        """
+        Send a list of encoded metrics for a buffered handler. Returns how
+        many of the oldest metrics were sent, or None if all of them were.
+        The metrics that were not sent are tried again later.
+
+        Should be overridden in buffered subclasses
+        """
+        raise NotImplementedError
+
+    def _send_buffer(self):
+        """
+        Send the buffered metrics, those that were not sent stay in the
+        buffer until the backlog is trimmed. Once everything was sent the
+        spooled metrics are replayed.
+        """
+        buffer = self.buffer
+        sent = 0
+        try:
+            sent = self.send(buffer.items)
+            if sent is None:
+                sent = len(buffer)
+        finally:
+            buffer.remove(sent)
+            trimmed = buffer.trim()
+            if trimmed:
+                self._trim(trimmed)
+
+        if self.spool is not None and not len(buffer) and len(self.spool):
+            self._replay_spool()
+
+    def _trim(self, metrics):
+        """
+        Spool the metrics trimmed from the backlog, or drop them if there is
+        no spool
+        """
+        name = self.__class__.__name__
+        if self.spool is not None:
+            try:
+                self.spool.write(metrics)
+                self.log.debug('%s: Spooled %d metrics', name, len(metrics))
+                return
+            except (IOError, OSError), e:
+                self._throttle_error('%s: Failed to spool metrics: %s',
+                                     name, e)
+        self.trimmed += len(metrics)
+        self.log.warn('%s: Trimming backlog. Removing oldest %d and '
+                      'keeping newest %d metrics',
+                      name, len(metrics), len(self.buffer))
+
+    def _replay_spool(self):
+        """
+        Send spooled metrics, oldest first and at most spool_replay_rate a
+        second
+        """
+        now = time.time()
+        if self.spool_replay_rate > 0:
+            budget = int(self.spool_replay_rate *
+                         min(now - self.spool_replayed, 60))
+            if budget < 1:
+                return
+        else:
+            budget = len(self.spool)
+        self.spool_replayed = now
+
+        while budget > 0 and len(self.spool):
+            metrics = self.spool.read(budget)
+            if not metrics:
+                break
+            sent = self.send(metrics)
+            if sent is not None and sent < len(metrics):
+                # Only what was not sent is replayed again
+                self.spool.commit(sent)
+                break
+            self.spool.commit()
+            budget -= len(metrics)
+
+    def _flush(self, force=False):
         """
         Decorator for flushing handlers with an lock, catching exceptions
+
+        A buffered handler only sends a batch that is due, unless forced
         """
         if not self.enabled:
             return
         try:
             try:
                 self.lock.acquire()
-                self.flush()
+                if self.buffer is not None and not force:
+                    if self.buffer.due():
+                        self._send_buffer()
+                else:
+                    self.flush()
             except Exception:
+                self.failures += 1
                 self.log.error(traceback.format_exc())
         finally:
             if self.lock.locked():
                 self.lock.release()
 
+    def _idle(self):
+        """
+        Called by the handler thread when no metrics came in for a while, a
+        buffered handler sends a batch that got too old
+        """
+        if self.buffer is not None:
+            self._flush()
+
     def flush(self):
         """
-        Flush metrics
+        Flush metrics, a buffered handler sends all it holds and spools
+        what it could not send
 
-        Optional: Should be overridden in subclasses
+        Optional: Should be overridden in subclasses that are not buffered
         """
-        pass
+        if self.buffer is not None and len(self.buffer):
+            try:
+                self._send_buffer()
+            finally:
+                if self.spool is not None and len(self.buffer):
+                    metrics = self.buffer.items
+                    self.buffer.remove(len(metrics))
+                    self._trim(metrics)
 
     def _throttle_error(self, msg, *args, **kwargs):
         """
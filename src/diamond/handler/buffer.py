@@ -0,0 +1,117 @@
+# coding=utf-8
+
+"""
+Buffering of encoded metrics for the handlers that send them in batches.
+
+A buffered handler only encodes metrics and sends lists of them, the buffer
+decides when to send. A batch goes out once the buffer holds batch metrics,
+batch_max_bytes bytes of metrics encoded as strings, or its oldest metric is
+batch_max_age seconds old. Metrics that could not be sent stay in the buffer,
+once it holds max_backlog_multiplier batches it is trimmed down to the newest
+trim_backlog_multiplier batches. With spool_dir set the trimmed metrics are
+spooled to disk rather than dropped, see diamond.handler.spool.
+"""
+
+import time
+
+
+def _size(items):
+    size = 0
+    for item in items:
+        if isinstance(item, basestring):
+            size += len(item)
+    return size
+
+
+class MetricBuffer(object):
+    """
+    Holds encoded metrics until they are due to be sent
+    """
+
+    def __init__(self, max_items=1, max_bytes=0, max_age=0, max_backlog=0,
+                 trim_backlog=0):
+        self.max_items = max(int(max_items), 1)
+        self.max_bytes = int(max_bytes)
+        self.max_age = float(max_age)
+        self.max_backlog = max(int(max_backlog), 1)
+        self.trim_backlog = max(min(int(trim_backlog), self.max_backlog - 1),
+                                0)
+        self.items = []
+        # Bytes held in items encoded as strings
+        self.size = 0
+        # When the oldest item was added
+        self.oldest = None
+        # Items dropped from a full backlog
+        self.trimmed = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Returns a buffer for the batch options of a handler config
+        """
+        max_items = int(config['batch'])
+        return cls(max_items, config['batch_max_bytes'],
+                   config['batch_max_age'],
+                   max_items * int(config['max_backlog_multiplier']),
+                   max_items * int(config['trim_backlog_multiplier']))
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item):
+        if not self.items:
+            self.oldest = time.time()
+        self.items.append(item)
+        if isinstance(item, basestring):
+            self.size += len(item)
+
+    def extend(self, items):
+        if not items:
+            return
+        if not self.items:
+            self.oldest = time.time()
+        self.items.extend(items)
+        self.size += _size(items)
+
+    def due(self, now=None):
+        """
+        Returns True if the items should be sent
+        """
+        count = len(self.items)
+        if not count:
+            return False
+        if count >= self.max_items:
+            return True
+        if self.max_bytes and self.size >= self.max_bytes:
+            return True
+        if self.max_age:
+            if now is None:
+                now = time.time()
+            return now - self.oldest >= self.max_age
+        return False
+
+    def remove(self, count):
+        """
+        Removes the oldest count items, once they were sent
+        """
+        if count <= 0:
+            return
+        if count >= len(self.items):
+            self.items = []
+            self.size = 0
+            self.oldest = None
+            return
+        self.size -= _size(self.items[:count])
+        del self.items[:count]
+
+    def trim(self):
+        """
+        Drops the oldest items if the backlog is full, returns them
+        """
+        count = len(self.items)
+        if count < self.max_backlog:
+            return []
+        dropped = self.items[:count - self.trim_backlog]
+        self.remove(len(dropped))
+        self.trimmed += len(dropped)
+        return dropped
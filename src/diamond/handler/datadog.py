@@ -16,13 +16,12 @@ Enable handler
 
   * api_key = DATADOG_API_KEY
 
-  * queue_size = [optional | 1]
+  * batch = [optional | 100] metrics to queue before sending them
 
 """
 
 from Handler import Handler
 import logging
-from collections import deque
 
 try:
     import dogapi
@@ -32,6 +31,8 @@ except ImportError:
 
 class DatadogHandler(Handler):
 
+    buffered = True
+
     def __init__(self, config=None):
         """
         New instance of DatadogHandler class
@@ -42,12 +43,11 @@ class DatadogHandler(Handler):
 
         if dogapi is None:
             logging.error("Failed to load dogapi module.")
+            self.enabled = False
             return
 
         self.api = dogapi.dog_http_api
         self.api.api_key = self.config.get('api_key', '')
-        self.queue_size = self.config.get('queue_size', 1)
-        self.queue = deque([])
 
     def get_default_config_help(self):
         """
@@ -57,7 +57,6 @@ class DatadogHandler(Handler):
 
         config.update({
             'api_key': '',
-            'queue_size': '',
         })
 
         return config
@@ -70,47 +69,42 @@ class DatadogHandler(Handler):
 
         config.update({
             'api_key': '',
-            'queue_size': '',
+            'batch': 100,
         })
 
         return config
 
-    def process(self, metric):
-        """
-        Process metric by sending it to datadog api
-        """
-
-        self.queue.append(metric)
-        if len(self.queue) >= self.queue_size:
-            self._send()
-
-    def flush(self):
+    def encode(self, metric):
         """
-        Flush metrics
+        Encode a metric as its path, point and host
         """
+        path = '%s.%s.%s' % (
+            metric.getPathPrefix(),
+            metric.getCollectorPath(),
+            metric.getMetricPath()
+        )
 
-        self._send()
+        topic, value, timestamp = str(metric).split()
+        return (path, (timestamp, value), metric.host)
 
-    def _send(self):
+    def send(self, metrics):
         """
-        Take metrics from queue and send it to Datadog API
+        Send metrics to the Datadog API, returns how many were sent
         """
-
-        while len(self.queue) > 0:
-            metric = self.queue.popleft()
-
-            path = '%s.%s.%s' % (
-                metric.getPathPrefix(),
-                metric.getCollectorPath(),
-                metric.getMetricPath()
-            )
-
-            topic, value, timestamp = str(metric).split()
+        sent = 0
+        for path, point, host in metrics:
             logging.debug(
                 "Sending.. topic[%s], value[%s], timestamp[%s]",
                 path,
-                value,
-                timestamp
+                point[1],
+                point[0]
             )
-
-            self.api.metric(path, (timestamp, value), host=metric.host)
+            try:
+                self.api.metric(path, point, host=host)
+            except Exception, e:
+                self.failures += 1
+                self._throttle_error(
+                    "DatadogHandler: Error sending metrics. %s", e)
+                break
+            sent += 1
+        return sent
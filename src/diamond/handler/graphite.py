@@ -14,10 +14,26 @@ the e-commerce monitoring system. Today many
 [large companies](http://graphite.readthedocs.org/en/latest/who-is-using.html)
 use it.
 
+Metrics are sent without blocking the handler. What the socket does not take
+right away stays buffered and is sent with the next batch. While the server
+can not be reached, reconnects are tried with an exponential backoff between
+reconnect_min_interval and reconnect_max_interval seconds.
+
 """
 
 from Handler import Handler
+import errno
+import os
+import random
+import select
 import socket
+import time
+
+# Errors of a non-blocking connect that is still in progress
+CONNECT_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY)
+
+# Errors of a non-blocking send when the socket buffer is full
+SEND_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS)
 
 
 class GraphiteHandler(Handler):
@@ -25,6 +41,8 @@ class GraphiteHandler(Handler):
     Implements the abstract Handler class, sending data to graphite
     """
 
+    buffered = True
+
     def __init__(self, config=None):
         """
         Create a new instance of the GraphiteHandler class
@@ -43,13 +61,24 @@ class GraphiteHandler(Handler):
         self.keepalive = bool(self.config['keepalive'])
         self.keepaliveinterval = int(self.config['keepaliveinterval'])
         self.batch_size = int(self.config['batch'])
-        self.max_backlog_multiplier = int(
-            self.config['max_backlog_multiplier'])
-        self.trim_backlog_multiplier = int(
-            self.config['trim_backlog_multiplier'])
-        self.flow_info = self.config['flow_info']
-        self.scope_id = self.config['scope_id']
-        self.metrics = []
+        self.flow_info = int(self.config['flow_info'])
+        self.scope_id = int(self.config['scope_id'])
+        self.dns_ttl = float(self.config['dns_ttl'])
+        self.reconnect_min_interval = float(
+            self.config['reconnect_min_interval'])
+        self.reconnect_max_interval = float(
+            self.config['reconnect_max_interval'])
+
+        # Resolved address of the server and when to resolve it again
+        self.address = None
+        self.address_expires = 0
+        # Seconds to wait before the next reconnect, and until when
+        self.backoff = 0
+        self.reconnect_at = 0
+        # When the connect in progress was started
+        self.connecting = None
+        # The rest of a message that was sent in part
+        self.partial = ''
 
         # Connect
         self._connect()
@@ -64,10 +93,13 @@ class GraphiteHandler(Handler):
             'host': 'Hostname',
             'port': 'Port',
             'proto': 'udp, udp4, udp6, tcp, tcp4, or tcp6',
-            'timeout': '',
-            'batch': 'How many to store before sending to the graphite server',
-            'max_backlog_multiplier': 'how many batches to store before trimming',  # NOQA
-            'trim_backlog_multiplier': 'Trim down how many batches',
+            'timeout': 'Seconds to wait for a connection',
+            'dns_ttl': 'Seconds to cache the address of the server',
+            'reconnect_min_interval': ('Seconds to wait before reconnecting '
+                                       'after a failure'),
+            'reconnect_max_interval': ('Most seconds to wait before '
+                                       'reconnecting, after repeated '
+                                       'failures'),
             'keepalive': 'Enable keepalives for tcp streams',
             'keepaliveinterval': 'How frequently to send keepalives',
             'flow_info': 'IPv6 Flow Info',
@@ -87,9 +119,9 @@ class GraphiteHandler(Handler):
             'port': 2003,
             'proto': 'tcp',
             'timeout': 15,
-            'batch': 1,
-            'max_backlog_multiplier': 5,
-            'trim_backlog_multiplier': 4,
+            'dns_ttl': 300,
+            'reconnect_min_interval': 1,
+            'reconnect_max_interval': 60,
             'keepalive': 0,
             'keepaliveinterval': 10,
             'flow_info': 0,
@@ -104,135 +136,217 @@ class GraphiteHandler(Handler):
         """
         self._close()
 
-    def process(self, metric):
+    def get_spool_path(self):
         """
-        Process a metric by sending it to graphite
+        Returns the directory to spool metrics to, one per graphite server
         """
-        # Append the data to the array as a string
-        self.metrics.append(str(metric))
-        if len(self.metrics) >= self.batch_size:
-            self._send()
+        path = super(GraphiteHandler, self).get_spool_path()
+        if path is None:
+            return None
+        return '%s_%s_%s' % (path, self.config['host'], self.config['port'])
 
-    def flush(self):
-        """Flush metrics in queue"""
-        self._send()
+    def is_down(self):
+        """
+        Returns True while the server can not be reached and no reconnect is
+        due yet
+        """
+        return self.socket is None and time.time() < self.reconnect_at
+
+    def encode(self, metric):
+        """
+        Encode a metric in the plaintext protocol
+        """
+        return str(metric)
+
+    def send(self, metrics):
+        """
+        Send as many encoded metrics as the socket takes without blocking,
+        returns how many were sent
+        """
+        return self._send_messages(metrics)
+
+    def _send_messages(self, messages, sizes=None):
+        """
+        Send messages holding sizes metrics each, one each by default, and
+        return how many metrics were sent. A message that is sent in part is
+        finished before anything else is sent.
+        """
+        if not self._ready():
+            return 0
+        if self.partial:
+            partial = self.partial
+            written = self._send_data(partial)
+            if self.socket is None:
+                return 0
+            self.partial = partial[written:]
+            if self.partial:
+                return 0
+
+        data = ''.join(messages)
+        written = self._send_data(data)
+        if written == len(data):
+            return None
+
+        sent = 0
+        offset = 0
+        for index, message in enumerate(messages):
+            end = offset + len(message)
+            if end > written:
+                if written > offset and self.socket is not None:
+                    self.partial = data[written:end]
+                    sent += 1 if sizes is None else sizes[index]
+                break
+            sent += 1 if sizes is None else sizes[index]
+            offset = end
+        return sent
 
     def _send_data(self, data):
         """
-        Try to send all data in buffer.
+        Write as much of data as the socket takes without blocking, returns
+        the number of bytes written
         """
+        written = 0
         try:
-            self.socket.sendall(data)
-            self._reset_errors()
-        except:
-            self._close()
-            self._throttle_error("GraphiteHandler: Socket error, "
-                                 "trying reconnect.")
-            self._connect()
-            try:
-                self.socket.sendall(data)
-            except:
-                return
+            while written < len(data):
+                written += self.socket.send(buffer(data, written))
+        except socket.error, ex:
+            if ex.errno not in SEND_WOULD_BLOCK:
+                self.failures += 1
+                self._close()
+                self._throttle_error("GraphiteHandler: Socket error, "
+                                     "trying reconnect. %s", ex)
+                self._reconnect_later()
+        if written and self.socket is not None:
             self._reset_errors()
+            # Only a connection that takes data ends the backoff
+            self.backoff = 0
+        return written
 
-    def _send(self):
+    def _ready(self):
         """
-        Send data to graphite. Data that can not be sent will be queued.
+        Returns True if the socket is connected. Starts a connect when the
+        backoff allows it and checks on a connect in progress, without
+        waiting for either.
         """
-        # Check to see if we have a valid socket. If not, try to connect.
+        if self.socket is None:
+            if time.time() < self.reconnect_at:
+                return False
+            self.log.debug("GraphiteHandler: Socket is not connected. "
+                           "Reconnecting.")
+            self._connect()
+            if self.socket is None:
+                self.log.debug("GraphiteHandler: Reconnect failed.")
+                return False
+        if self.connecting is None:
+            return True
+
         try:
-            try:
-                if self.socket is None:
-                    self.log.debug("GraphiteHandler: Socket is not connected. "
-                                   "Reconnecting.")
-                    self._connect()
-                if self.socket is None:
-                    self.log.debug("GraphiteHandler: Reconnect failed.")
-                else:
-                    # Send data to socket
-                    self._send_data(''.join(self.metrics))
-                    self.metrics = []
-            except Exception:
-                self._close()
-                self._throttle_error("GraphiteHandler: Error sending metrics.")
-                raise
-        finally:
-            if len(self.metrics) >= (
-                    self.batch_size * self.max_backlog_multiplier):
-                trim_offset = (self.batch_size
-                               * self.trim_backlog_multiplier * -1)
-                self.log.warn('GraphiteHandler: Trimming backlog. Removing'
-                              + ' oldest %d and keeping newest %d metrics',
-                              len(self.metrics) - abs(trim_offset),
-                              abs(trim_offset))
-                self.metrics = self.metrics[trim_offset:]
+            writable = select.select([], [self.socket], [], 0)[1]
+            error = 0
+            if writable:
+                error = self.socket.getsockopt(socket.SOL_SOCKET,
+                                               socket.SO_ERROR)
+        except (select.error, socket.error), ex:
+            writable = True
+            error = ex.args[0]
+        if not writable:
+            if time.time() - self.connecting >= self.timeout:
+                self._connect_failed('Timed out')
+            return False
+        if error:
+            self._connect_failed(os.strerror(error))
+            return False
+        self._connected()
+        return True
+
+    def _resolve(self, stream):
+        """
+        Returns the address family and address of the server, looked up at
+        most once every dns_ttl seconds
+        """
+        now = time.time()
+        if self.address is not None and now < self.address_expires:
+            return self.address
+
+        if self.proto[-1] == '4':
+            family = socket.AF_INET
+        elif self.proto[-1] == '6':
+            family = socket.AF_INET6
+        else:
+            family = socket.AF_UNSPEC
+        addrinfo = socket.getaddrinfo(self.host, self.port, family, stream)
+        family, address = addrinfo[0][0], addrinfo[0][4]
+        if family == socket.AF_INET6:
+            address = (address[0], address[1], self.flow_info, self.scope_id)
+
+        self.address = (family, address)
+        self.address_expires = now + self.dns_ttl
+        return self.address
 
     def _connect(self):
         """
-        Connect to the graphite server
+        Start connecting to the graphite server, without waiting for the
+        connection to be established
         """
-        if (self.proto == 'udp'):
+        if self.proto.startswith('udp'):
             stream = socket.SOCK_DGRAM
         else:
             stream = socket.SOCK_STREAM
 
-        if (self.proto[-1] == '4'):
-            family = socket.AF_INET
-            connection_struct = (self.host, self.port)
-        elif (self.proto[-1] == '6'):
-            family = socket.AF_INET6
-            connection_struct = (self.host, self.port,
-                                 self.flow_info, self.scope_id)
-        else:
-            connection_struct = (self.host, self.port)
-            try:
-                addrinfo = socket.getaddrinfo(self.host, self.port, 0, stream)
-            except socket.gaierror, ex:
-                self.log.error("GraphiteHandler: Error looking up graphite host"
-                               " '%s' - %s",
-                               self.host, ex)
-                return
-            if (len(addrinfo) > 0):
-                family = addrinfo[0][0]
-                if (family == socket.AF_INET6):
-                    connection_struct = (self.host, self.port,
-                                         self.flow_info, self.scope_id)
-            else:
-                family = socket.AF_INET
+        try:
+            family, address = self._resolve(stream)
+        except socket.error, ex:
+            self.failures += 1
+            self._throttle_error("GraphiteHandler: Error looking up graphite "
+                                 "host '%s' - %s", self.host, ex)
+            self._reconnect_later()
+            return
 
         # Create socket
         self.socket = socket.socket(family, stream)
-        if self.socket is None:
-            # Log Error
-            self.log.error("GraphiteHandler: Unable to create socket.")
-            # Close Socket
-            self._close()
-            return
         # Enable keepalives?
-        if self.proto != 'udp' and self.keepalive:
-            self.log.error("GraphiteHandler: Setting socket keepalives...")
+        if stream == socket.SOCK_STREAM and self.keepalive:
+            self.log.debug("GraphiteHandler: Setting socket keepalives...")
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
             self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE,
                                    self.keepaliveinterval)
             self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL,
                                    self.keepaliveinterval)
             self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
-        # Set socket timeout
-        self.socket.settimeout(self.timeout)
+        self.socket.setblocking(0)
+
         # Connect to graphite server
-        try:
-            self.socket.connect(connection_struct)
-            # Log
-            self.log.debug("GraphiteHandler: Established connection to "
-                           "graphite server %s:%d.",
-                           self.host, self.port)
-        except Exception, ex:
-            # Log Error
-            self._throttle_error("GraphiteHandler: Failed to connect to "
-                                 "%s:%i. %s.", self.host, self.port, ex)
-            # Close Socket
-            self._close()
-            return
+        error = self.socket.connect_ex(address)
+        if error in CONNECT_IN_PROGRESS:
+            self.connecting = time.time()
+        elif error and error != errno.EISCONN:
+            self._connect_failed(os.strerror(error))
+        else:
+            self._connected()
+
+    def _connected(self):
+        self.connecting = None
+        self.log.debug("GraphiteHandler: Established connection to "
+                       "graphite server %s:%d.", self.host, self.port)
+
+    def _connect_failed(self, reason):
+        self.failures += 1
+        self._throttle_error("GraphiteHandler: Failed to connect to "
+                             "%s:%i. %s.", self.host, self.port, reason)
+        self._close()
+        # Keep the address until dns_ttl expires, looking it up on every
+        # retry would block on getaddrinfo while the server is down
+        self._reconnect_later()
+
+    def _reconnect_later(self):
+        """
+        Wait twice as long as last time before reconnecting, with jitter so
+        many hosts do not reconnect at once once the server is back
+        """
+        self.backoff = min(max(self.backoff * 2, self.reconnect_min_interval),
+                           self.reconnect_max_interval)
+        self.reconnect_at = time.time() + random.uniform(self.backoff / 2,
+                                                         self.backoff)
 
     def _close(self):
         """
@@ -241,3 +355,5 @@ class GraphiteHandler(Handler):
         if self.socket is not None:
             self.socket.close()
         self.socket = None
+        self.connecting = None
+        self.partial = ''
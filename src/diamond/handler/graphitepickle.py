@@ -30,6 +30,9 @@ try:
 except ImportError:
     import pickle as pickle
 
+# Most metrics pickled into one message, carbon rejects messages over 1MB
+MAX_PICKLE_BATCH_SIZE = 2000
+
 
 class GraphitePickleHandler(GraphiteHandler):
     """
@@ -42,10 +45,6 @@ class GraphitePickleHandler(GraphiteHandler):
         """
         # Initialize GraphiteHandler
         GraphiteHandler.__init__(self, config)
-        # Initialize Data
-        self.batch = []
-        # Initialize Options
-        self.batch_size = int(self.config['batch'])
 
     def get_default_config_help(self):
         """
@@ -70,32 +69,33 @@ class GraphitePickleHandler(GraphiteHandler):
 
         return config
 
-    def process(self, metric):
-        # Convert metric to pickle format
-        m = (metric.path, (metric.timestamp, metric.value))
-        # Add the metric to the match
-        self.batch.append(m)
-        # If there are sufficient metrics, then pickle and send
-        if len(self.batch) >= self.batch_size:
-            # Log
-            self.log.debug("GraphitePickleHandler: Sending batch size: %d",
-                           self.batch_size)
-            # Pickle the batch of metrics
-            self.metrics = [self._pickle_batch()]
-            # Send pickled batch
-            self._send()
-            # Flush the metric pack down the wire
-            self.flush()
-            # Clear Batch
-            self.batch = []
-
-    def _pickle_batch(self):
+    def encode(self, metric):
+        """
+        Convert a metric to pickle format
+        """
+        return (metric.path, (metric.timestamp, metric.value))
+
+    def send(self, metrics):
+        """
+        Pickle and send the metrics, returns how many were sent
+        """
+        self.log.debug("GraphitePickleHandler: Sending batch size: %d",
+                       len(metrics))
+        # Carbon limits the size of a message, pickle large batches in parts
+        batches = [metrics[offset:offset + MAX_PICKLE_BATCH_SIZE]
+                   for offset in xrange(0, len(metrics),
+                                        MAX_PICKLE_BATCH_SIZE)]
+        return self._send_messages([self._pickle_batch(batch)
+                                    for batch in batches],
+                                   [len(batch) for batch in batches])
+
+    def _pickle_batch(self, batch):
         """
         Pickle the metrics into a form that can be understood
         by the graphite pickle connector.
         """
         # Pickle
-        payload = pickle.dumps(self.batch)
+        payload = pickle.dumps(batch)
 
         # Pack Message
         header = struct.pack("!L", len(payload))
@@ -32,6 +32,9 @@ class HostedGraphiteHandler(Handler):
         self.key = self.config['apikey'].lower().strip()
 
         self.graphite = GraphiteHandler(self.config)
+        # The metrics are filtered before they are handed to graphite
+        self.graphite.metric_filter = None
+        self.graphite.change_filter = None
 
     def get_default_config_help(self):
         """
@@ -82,11 +85,20 @@ class HostedGraphiteHandler(Handler):
         """
         Process a metric by sending it to graphite
         """
+        if self.metric_filter is not None:
+            if not self.metric_filter.accept(metric.path):
+                return
+        if self.change_filter is not None:
+            if not self.change_filter.accept(metric.path, metric.value):
+                return
         metric = self.key + '.' + str(metric)
         self.graphite._process(metric)
 
-    def _flush(self):
-        self.graphite._flush()
+    def _flush(self, force=False):
+        self.graphite._flush(force)
+
+    def _idle(self):
+        self.graphite._idle()
 
     def flush(self):
         self.graphite.flush()
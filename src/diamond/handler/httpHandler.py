@@ -19,16 +19,17 @@ Enable this handler
 """
 
 from Handler import Handler
+import socket
 import urllib2
 
 
 class HttpPostHandler(Handler):
 
-    # Inititalize Handler with url and batch size
+    buffered = True
+
+    # Inititalize Handler with url
     def __init__(self, config=None):
         Handler.__init__(self, config)
-        self.metrics = []
-        self.batch_size = int(self.config['batch'])
         self.url = self.config.get('url')
 
     def get_default_config_help(self):
@@ -39,7 +40,6 @@ class HttpPostHandler(Handler):
 
         config.update({
             'url': 'Fully qualified url to send metrics to',
-            'batch': 'How many to store before sending to the graphite server',
         })
 
         return config
@@ -57,18 +57,17 @@ class HttpPostHandler(Handler):
 
         return config
 
+    def encode(self, metric):
+        return str(metric)
+
     # Join batched metrics and push to url mentioned in config
-    def process(self, metric):
-        self.metrics.append(str(metric))
-        if len(self.metrics) >= self.batch_size:
-            self.post()
-
-    # Overriding flush to post metrics for every collector.
-    def flush(self):
-        """Flush metrics in queue"""
-        self.post()
-
-    def post(self):
-        req = urllib2.Request(self.url, "\n".join(self.metrics))
-        urllib2.urlopen(req)
-        self.metrics = []
+    def send(self, metrics):
+        req = urllib2.Request(self.url, "\n".join(metrics))
+        try:
+            urllib2.urlopen(req)
+        except (urllib2.URLError, socket.error), ex:
+            # Keep the metrics, they are sent with the next batch
+            self.failures += 1
+            self._throttle_error("HttpPostHandler: Unable to post metrics to "
+                                 "%s. %s", self.url, ex)
+            return 0
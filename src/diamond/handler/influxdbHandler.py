@@ -9,6 +9,8 @@ v1.1 : force influxdb driver with SSL
 v1.2 : added a timer to delay influxdb writing in case of failure
        this whill avoid the 100% cpu loop when influx in not responding
        Sebastien Prune THOMAS - prune@lecentre.net
+v1.3 : batching by the shared handler buffer, batch_size and cache_size
+       are now batch and max_backlog_multiplier but still understood
 
 - Dependency:
     - influxdb client (pip install influxdb)
@@ -23,8 +25,9 @@ handlers = diamond.handler.influxdbHandler.InfluxdbHandler
 [[InfluxdbHandler]]
 hostname = localhost
 port = 8086 #8084 for HTTPS
-batch_size = 100 # default to 1
-cache_size = 1000 # default to 20000
+batch = 100 # default to 1
+batch_max_age = 10 # seconds, default to 10
+max_backlog_multiplier = 10 # batches kept while influxdb is down
 username = root
 password = root
 database = graphite
@@ -44,6 +47,9 @@ class InfluxdbHandler(Handler):
     """
     Sending data to Influxdb using batched format
     """
+
+    buffered = True
+
     def __init__(self, config=None):
         """
         Create a new instance of the InfluxdbeHandler
@@ -67,15 +73,12 @@ class InfluxdbHandler(Handler):
         self.username = self.config['username']
         self.password = self.config['password']
         self.database = self.config['database']
-        self.batch_size = int(self.config['batch_size'])
-        self.metric_max_cache = int(self.config['cache_size'])
-        self.batch_count = 0
         self.time_precision = self.config['time_precision']
 
         # Initialize Data
-        self.batch = {}
         self.influx = None
-        self.batch_timestamp = time.time()
+        # No writes until then after a failure
+        self.retry_at = 0
         self.time_multiplier = 1
 
         # Connect
@@ -91,10 +94,6 @@ class InfluxdbHandler(Handler):
             'hostname': 'Hostname',
             'port': 'Port',
             'ssl': 'set to True to use HTTPS instead of http',
-            'batch_size': 'How many metrics to store before sending to the'
-            ' influxdb server',
-            'cache_size': 'How many values to store in cache in case of'
-            ' influxdb failure',
             'username': 'Username for connection',
             'password': 'Password for connection',
             'database': 'Database name',
@@ -117,8 +116,6 @@ class InfluxdbHandler(Handler):
             'username': 'root',
             'password': 'root',
             'database': 'graphite',
-            'batch_size': 1,
-            'cache_size': 20000,
             'time_precision': 's',
         })
 
@@ -130,70 +127,90 @@ class InfluxdbHandler(Handler):
         """
         self._close()
 
-    def process(self, metric):
-        if self.batch_count <= self.metric_max_cache:
-            # Add the data to the batch
-            self.batch.setdefault(metric.path, []).append([metric.timestamp,
-                                                           metric.value])
-            self.batch_count += 1
-        # If there are sufficient metrics, then pickle and send
-        if self.batch_count >= self.batch_size and (
-                time.time() - self.batch_timestamp) > 2**self.time_multiplier:
-            # Log
-            self.log.debug(
-                "InfluxdbHandler: Sending batch sizeof : %d/%d after %fs",
-                self.batch_count,
-                self.batch_size,
-                (time.time() - self.batch_timestamp))
-            # reset the batch timer
-            self.batch_timestamp = time.time()
-            # Send pickled batch
-            self._send()
-        else:
-            self.log.debug(
-                "InfluxdbHandler: not sending batch of %d as timestamp is %f",
-                self.batch_count,
-                (time.time() - self.batch_timestamp))
+    def create_buffer(self):
+        # batch_size and cache_size are the old names of batch and of the
+        # most metrics to hold while sending fails
+        if 'batch_size' in self.config:
+            self.config['batch'] = self.config['batch_size']
+        if 'cache_size' in self.config:
+            self.config['max_backlog_multiplier'] = max(
+                int(self.config['cache_size']) // int(self.config['batch']),
+                1)
+        return super(InfluxdbHandler, self).create_buffer()
+
+    def encode(self, metric):
+        """
+        Encode a metric as its series name and point
+        """
+        return (metric.path, [self._timestamp(metric), metric.value])
+
+    def _timestamp(self, metric):
+        """
+        Returns the timestamp of a metric in time_precision units
+        """
+        if self.time_precision == 'ms':
+            return metric.get_timestamp_ms()
+        if self.time_precision == 'u':
+            return metric.get_timestamp_ms() * 1000
+        return metric.timestamp
 
-    def _send(self):
+    def send(self, metrics):
         """
-        Send data to Influxdb. Data that can not be sent will be kept in queued.
+        Send data to Influxdb, one series per metric path. After a failure
+        nothing is sent for 2, 4, up to 32 seconds, the metrics stay in the
+        buffer meanwhile.
         """
+        if time.time() < self.retry_at:
+            return 0
+
         # Check to see if we have a valid socket. If not, try to connect.
+        if self.influx is None:
+            self.log.debug("InfluxdbHandler: Socket is not connected. "
+                           "Reconnecting.")
+            self._connect()
+        if self.influx is None:
+            self.log.debug("InfluxdbHandler: Reconnect failed.")
+            self._retry_later()
+            return 0
+
+        # build metrics data
+        series = {}
+        paths = []
+        for path, point in metrics:
+            if path not in series:
+                series[path] = []
+                paths.append(path)
+            series[path].append(point)
+        data = [{"points": series[path],
+                 "name": path,
+                 "columns": ["time", "value"]} for path in paths]
+
         try:
-                if self.influx is None:
-                    self.log.debug("InfluxdbHandler: Socket is not connected. "
-                                   "Reconnecting.")
-                    self._connect()
-                if self.influx is None:
-                    self.log.debug("InfluxdbHandler: Reconnect failed.")
-                else:
-                    # build metrics data
-                    metrics = []
-                    for path in self.batch:
-                        metrics.append({
-                            "points": self.batch[path],
-                            "name": path,
-                            "columns": ["time", "value"]})
-                    # Send data to influxdb
-                    self.log.debug("InfluxdbHandler: writing %d series of data",
-                                   len(metrics))
-                    self.influx.write_points(metrics,
-                                             time_precision=self.time_precision)
-
-                    # empty batch buffer
-                    self.batch = {}
-                    self.batch_count = 0
-                    self.time_multiplier = 1
-
-        except Exception:
-                self._close()
-                if self.time_multiplier < 5:
-                    self.time_multiplier += 1
-                self._throttle_error(
-                    "InfluxdbHandler: Error sending metrics, waiting for %ds.",
-                    2**self.time_multiplier)
-                raise
+            # Send data to influxdb
+            self.log.debug("InfluxdbHandler: writing %d series of data",
+                           len(data))
+            self.influx.write_points(data,
+                                     time_precision=self.time_precision)
+        except Exception, ex:
+            self._close()
+            self.failures += 1
+            self._retry_later()
+            self._throttle_error(
+                "InfluxdbHandler: Error sending metrics, waiting for %ds. %s",
+                2**self.time_multiplier, ex)
+            return 0
+
+        self.retry_at = 0
+        self.time_multiplier = 1
+        return None
+
+    def _retry_later(self):
+        """
+        Hold off sending, for twice as long as the last time
+        """
+        if self.retry_at and self.time_multiplier < 5:
+            self.time_multiplier += 1
+        self.retry_at = time.time() + 2**self.time_multiplier
 
     def _connect(self):
         """
@@ -18,10 +18,11 @@ Enable this handler
  * user = LIBRATO_USERNAME
  * apikey = LIBRATO_API_KEY
 
- * queue_max_size = [optional | 300] max measurements to queue before submitting
- * queue_max_interval [optional | 60] @max seconds to wait before submitting
+ * batch = [optional | 300] max measurements to queue before submitting
+ * batch_max_age [optional | 60] @max seconds to wait before submitting
      For best behavior, be sure your highest collector poll interval is lower
-     than or equal to the queue_max_interval setting.
+     than or equal to the batch_max_age setting. queue_max_size and
+     queue_max_interval are the old names of these and still work.
 
  * include_filters = [optional | '^.*'] A list of regex patterns.
      Only measurements whose path matches a filter will be submitted.
@@ -34,7 +35,6 @@ Enable this handler
 
 from Handler import Handler
 import logging
-import time
 import re
 
 try:
@@ -45,6 +45,8 @@ except ImportError:
 
 class LibratoHandler(Handler):
 
+    buffered = True
+
     def __init__(self, config=None):
         """
         Create a new instance of the LibratoHandler class
@@ -55,16 +57,12 @@ class LibratoHandler(Handler):
 
         if librato is None:
             logging.error("Failed to load librato module")
+            self.enabled = False
             return
 
         # Initialize Options
-        api = librato.connect(self.config['user'],
-                              self.config['apikey'])
-        self.queue = api.new_queue()
-        self.queue_max_size = int(self.config['queue_max_size'])
-        self.queue_max_interval = int(self.config['queue_max_interval'])
-        self.queue_max_timestamp = int(time.time() + self.queue_max_interval)
-        self.current_n_measurements = 0
+        self.api = librato.connect(self.config['user'],
+                                   self.config['apikey'])
 
         # If a user leaves off the ending comma, cast to a array for them
         include_filters = self.config['include_filters']
@@ -82,8 +80,6 @@ class LibratoHandler(Handler):
         config.update({
             'user': '',
             'apikey': '',
-            'queue_max_size': '',
-            'queue_max_interval': '',
             'include_filters': '',
         })
 
@@ -98,50 +94,53 @@ class LibratoHandler(Handler):
         config.update({
             'user': '',
             'apikey': '',
-            'queue_max_size': 300,
-            'queue_max_interval': 60,
+            'batch': 300,
+            'batch_max_age': 60,
             'include_filters': ['^.*'],
         })
 
         return config
 
-    def process(self, metric):
+    def create_buffer(self):
+        # queue_max_size and queue_max_interval are the old names of batch
+        # and batch_max_age
+        if 'queue_max_size' in self.config:
+            self.config['batch'] = self.config['queue_max_size']
+        if 'queue_max_interval' in self.config:
+            self.config['batch_max_age'] = self.config['queue_max_interval']
+        return super(LibratoHandler, self).create_buffer()
+
+    def encode(self, metric):
         """
-        Process a metric by sending it to Librato
+        Encode a metric as the arguments of a librato measurement, or None
+        if it does not match the include_filters
         """
         path = metric.getCollectorPath()
         path += '.'
         path += metric.getMetricPath()
 
-        if self.include_reg.match(path):
-            if metric.metric_type == 'GAUGE':
-                m_type = 'gauge'
-            else:
-                m_type = 'counter'
-            self.queue.add(path,                # name
-                           float(metric.value),  # value
-                           type=m_type,
-                           source=metric.host,
-                           measure_time=metric.timestamp)
-            self.current_n_measurements += 1
-        else:
+        if not self.include_reg.match(path):
             self.log.debug("LibratoHandler: Skip %s, no include_filters match",
                            path)
+            return None
 
-        if (self.current_n_measurements >= self.queue_max_size or
-                time.time() >= self.queue_max_timestamp):
-            self.log.debug("LibratoHandler: Sending batch size: %d",
-                           self.current_n_measurements)
-            self._send()
-
-    def flush(self):
-        """Flush metrics in queue"""
-        self._send()
+        if metric.metric_type == 'GAUGE':
+            m_type = 'gauge'
+        else:
+            m_type = 'counter'
+        return (path, float(metric.value), m_type, metric.host,
+                metric.timestamp)
 
-    def _send(self):
+    def send(self, metrics):
         """
         Send data to Librato.
         """
-        self.queue.submit()
-        self.queue_max_timestamp = int(time.time() + self.queue_max_interval)
-        self.current_n_measurements = 0
+        self.log.debug("LibratoHandler: Sending batch size: %d", len(metrics))
+        queue = self.api.new_queue()
+        for path, value, m_type, source, measure_time in metrics:
+            queue.add(path,                # name
+                      value,               # value
+                      type=m_type,
+                      source=source,
+                      measure_time=measure_time)
+        queue.submit()
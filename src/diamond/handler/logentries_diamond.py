@@ -15,7 +15,7 @@ Enable this handler
 
  * log_token = [Your Log Token](https://logentries.com/doc/input-token/)
 
- * queue_size = Integer value
+ * batch = Integer value, metrics to queue before sending them
 
 
 """
@@ -24,13 +24,15 @@ from Handler import Handler
 import logging
 import urllib2
 import json
-from collections import deque
 
 
 class LogentriesDiamondHandler(Handler):
     """
       Implements the abstract Handler class
     """
+
+    buffered = True
+
     def __init__(self, config=None):
         """
         New instance of LogentriesDiamondHandler class
@@ -38,8 +40,6 @@ class LogentriesDiamondHandler(Handler):
 
         Handler.__init__(self, config)
         self.log_token = self.config.get('log_token', None)
-        self.queue_size = int(self.config['queue_size'])
-        self.queue = deque([])
         if self.log_token is None:
             raise Exception
 
@@ -52,7 +52,6 @@ class LogentriesDiamondHandler(Handler):
 
         config.update({
             'log_token': '',
-            'queue_size': ''
         })
 
         return config
@@ -65,32 +64,31 @@ class LogentriesDiamondHandler(Handler):
 
         config.update({
             'log_token': '',
-            'queue_size': 100
+            'batch': 100,
         })
 
         return config
 
-    def process(self, metric):
+    def encode(self, metric):
         """
-        Process metric by sending it to datadog api
+        Convert metric to a json object
         """
+        topic, value, timestamp = str(metric).split()
+        return json.dumps({"event": {topic: value}})
 
-        self.queue.append(metric)
-        if len(self.queue) >= self.queue_size:
-            logging.debug("Queue is full, sending logs to Logentries")
-            self._send()
-
-    def _send(self):
+    def send(self, metrics):
         """
-        Convert message to a json object and send to Lognetries
+        Send messages to Lognetries, returns how many were sent
         """
-        while len(self.queue) > 0:
-            metric = self.queue.popleft()
-            topic, value, timestamp = str(metric).split()
-            msg = json.dumps({"event": {topic: value}})
+        logging.debug("Queue is full, sending logs to Logentries")
+        sent = 0
+        for msg in metrics:
             req = urllib2.Request("https://js.logentries.com/v1/logs/"
                                   + self.log_token, msg)
             try:
                 urllib2.urlopen(req)
             except urllib2.URLError, e:
                 logging.error("Can't send log message to Logentries %s", e)
+                break
+            sent += 1
+        return sent
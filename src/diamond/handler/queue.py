@@ -6,6 +6,12 @@ do not try to use it as a normal handler
 """
 
 from Handler import Handler
+from Queue import Full
+
+from diamond.batch import MetricBatch
+
+# Upper bound on the number of interned metric paths kept per collector
+MAX_INTERNED_PATHS = 100000
 
 
 class QueueHandler(Handler):
@@ -13,8 +19,9 @@ class QueueHandler(Handler):
         # Initialize Handler
         Handler.__init__(self, config=config, log=log)
 
-        self.metrics = []
+        self.metrics = None
         self.queue = queue
+        self.intern = {}
 
     def __del__(self):
         """
@@ -31,6 +38,8 @@ class QueueHandler(Handler):
         We skip any locking code due to the fact that this is now a single
         process per collector
         """
+        if self.metrics is None:
+            self.metrics = MetricBatch.for_metric(metric, self.intern)
         self.metrics.append(metric)
 
     def flush(self):
@@ -41,6 +50,15 @@ class QueueHandler(Handler):
         We skip any locking code due to the fact that this is now a single
         process per collector
         """
-        if len(self.metrics) > 0:
-            self.queue.put(self.metrics, block=False)
-            self.metrics = []
+        if self.metrics is not None:
+            try:
+                self.queue.put(self.metrics, block=False)
+            except Full:
+                # The queue is bounded, rather than blocking the collector
+                # drop this batch
+                self.log.error('Metric queue is full, dropping %d metrics',
+                               len(self.metrics))
+            self.metrics = None
+
+            if sum(map(len, self.intern.values())) > MAX_INTERNED_PATHS:
+                self.intern = {}
@@ -15,6 +15,9 @@ It has these options:
  * `host` - The Riemann host to connect to.
  * `port` - The port it's on.
  * `transport` - Either `tcp` or `udp`. (default: `tcp`)
+ * `time_precision` - `s`, or `ms` to also send the milliseconds of the
+   timestamp in the `time_micros` field of Riemann 0.2.13 and later.
+   (default: `s`)
 
 """
 
@@ -39,6 +42,7 @@ class RiemannHandler(Handler):
         self.host = self.config['host']
         self.port = int(self.config['port'])
         self.transport = self.config['transport']
+        self.time_precision = self.config['time_precision']
 
         # Initialize client
         if self.transport == 'tcp':
@@ -57,6 +61,7 @@ class RiemannHandler(Handler):
             'host': '',
             'port': '',
             'transport': 'tcp or udp',
+            'time_precision': 'Timestamps in seconds (s) or milliseconds (ms)',
         })
 
         return config
@@ -71,6 +76,7 @@ class RiemannHandler(Handler):
             'host': '',
             'port': 123,
             'transport': 'tcp',
+            'time_precision': 's',
         })
 
         return config
@@ -97,13 +103,16 @@ class RiemannHandler(Handler):
             metric.getMetricPath()
         )
 
-        return {
+        event = {
             'host': metric.host,
             'service': path,
             'time': metric.timestamp,
             'metric': float(metric.value),
             'ttl': metric.ttl,
         }
+        if self.time_precision == 'ms':
+            event['time_micros'] = metric.get_timestamp_ms() * 1000
+        return event
 
     def _close(self):
         """
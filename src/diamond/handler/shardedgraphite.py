@@ -0,0 +1,287 @@
+# coding=utf-8
+
+"""
+Send metrics to a cluster of [graphite](http://graphite.wikidot.com/) servers,
+each metric to the server picked by the consistent hashing of carbon-relay.
+Unlike MultiGraphiteHandler, which sends every metric to every server, this
+spreads the metrics over the servers without a relay in between and places
+them like a relay with RELAY_METHOD = consistent-hashing would.
+
+Destinations are given like carbon's DESTINATIONS, as server:port or
+server:port:instance, and have to be the same as those of the relays for the
+metrics to land on the same servers. hash_type is carbon_ch, the default of
+carbon, or fnv1a_ch. With a replication_factor of 2 or more each metric is
+sent to that many servers. While a server can not be reached, its metrics go
+to the next server on the ring.
+
+- enable it in `diamond.conf` :
+
+`    handlers = diamond.handler.shardedgraphite.ShardedGraphiteHandler
+`
+
+"""
+
+import bisect
+from copy import deepcopy
+from hashlib import md5
+
+from Handler import Handler
+from graphite import GraphiteHandler
+from graphitepickle import GraphitePickleHandler
+from diamond.utils.config import str_to_bool
+from diamond.utils.lru import LRUCache
+
+HASH_TYPES = ['carbon_ch', 'fnv1a_ch']
+
+# Number of metric paths whose servers are remembered
+DEFAULT_CACHE_SIZE = 100000
+
+
+def fnv32a(data, seed=0x811c9dc5):
+    """
+    Returns the 32 bit FNV-1a hash of a string
+    """
+    value = seed
+    for char in data:
+        value = ((value ^ ord(char)) * 0x01000193) & 0xffffffff
+    return value
+
+
+def carbon_hash(key, hash_type='carbon_ch'):
+    """
+    Returns the position of key on the ring, the way carbon computes it
+    """
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    if hash_type == 'fnv1a_ch':
+        value = fnv32a(key)
+        return (value >> 16) ^ (value & 0xffff)
+    return int(md5(key).hexdigest()[:4], 16)
+
+
+class ConsistentHashRing(object):
+    """
+    The consistent hash ring of carbon, its nodes are (server, instance)
+    tuples
+    """
+
+    def __init__(self, nodes, replica_count=100, hash_type='carbon_ch'):
+        self.ring = []
+        self.nodes = set()
+        self.replica_count = replica_count
+        self.hash_type = hash_type
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node):
+        self.nodes.add(node)
+        positions = set([entry[0] for entry in self.ring])
+        for i in range(self.replica_count):
+            if self.hash_type == 'fnv1a_ch':
+                replica_key = '%d-%s' % (i, node[1])
+            else:
+                replica_key = '%s:%d' % (node, i)
+            position = carbon_hash(replica_key, self.hash_type)
+            while position in positions:
+                position += 1
+            positions.add(position)
+            bisect.insort(self.ring, (position, node))
+
+    def get_node(self, key):
+        return self.get_nodes(key)[0]
+
+    def get_nodes(self, key):
+        """
+        Returns the nodes for key in the order carbon picks them, the
+        primary first
+        """
+        if not self.ring:
+            return []
+        if len(self.nodes) == 1:
+            return [self.ring[0][1]]
+
+        nodes = []
+        position = carbon_hash(key, self.hash_type)
+        index = bisect.bisect_left(self.ring, (position, ())) % len(self.ring)
+        last_index = (index - 1) % len(self.ring)
+        while len(nodes) < len(self.nodes) and index != last_index:
+            node = self.ring[index][1]
+            if node not in nodes:
+                nodes.append(node)
+            index = (index + 1) % len(self.ring)
+        return nodes
+
+
+class ShardedGraphiteHandler(Handler):
+    """
+    Sends every metric to replication_factor graphite servers, picked by
+    carbon's consistent hash ring, with a GraphiteHandler per server
+    """
+
+    def __init__(self, config=None):
+        """
+        Create a new instance of the ShardedGraphiteHandler class
+        """
+        # Initialize Handler
+        Handler.__init__(self, config)
+
+        self.handlers = []
+        self.replication_factor = max(int(self.config['replication_factor']),
+                                      1)
+        hash_type = self.config['hash_type'].lower().strip()
+        if hash_type not in HASH_TYPES:
+            self.log.error('ShardedGraphiteHandler: Unknown hash_type %s',
+                           hash_type)
+            self.enabled = False
+            return
+        self.ring = ConsistentHashRing([], hash_type=hash_type)
+        # path -> handlers of the servers in ring order
+        self.routes = LRUCache(DEFAULT_CACHE_SIZE)
+
+        if str_to_bool(self.config['pickle']):
+            cls = GraphitePickleHandler
+        else:
+            cls = GraphiteHandler
+
+        destinations = self.config['destinations']
+        if isinstance(destinations, basestring):
+            destinations = destinations.split(',')
+
+        # (server, instance) -> handler
+        self.nodes = {}
+        for destination in destinations:
+            parts = destination.strip().split(':')
+            if len(parts) == 2:
+                server, port = parts
+                instance = None
+            elif len(parts) == 3:
+                server, port, instance = parts
+            else:
+                self.log.error('ShardedGraphiteHandler: Invalid destination '
+                               '%r, expected server:port[:instance]',
+                               destination)
+                continue
+            node = (server, instance)
+            if node in self.nodes:
+                self.log.error('ShardedGraphiteHandler: Destination instance '
+                               '%s already configured', node)
+                continue
+
+            config = deepcopy(self.config)
+            config['host'] = server
+            config['port'] = port
+            handler = cls(config)
+            # The metrics are filtered before they are handed to the servers
+            handler.metric_filter = None
+            handler.change_filter = None
+            self.nodes[node] = handler
+            self.handlers.append(handler)
+            self.ring.add_node(node)
+
+        if not self.handlers:
+            self.log.error('ShardedGraphiteHandler: No destinations')
+            self.enabled = False
+
+    def get_default_config_help(self):
+        """
+        Returns the help text for the configuration options for this handler
+        """
+        config = super(ShardedGraphiteHandler, self).get_default_config_help()
+
+        config.update({
+            'destinations': ('server:port or server:port:instance of every '
+                             'graphite server, like carbon-relay '
+                             'DESTINATIONS'),
+            'replication_factor': 'How many servers to send each metric to',
+            'hash_type': 'carbon_ch or fnv1a_ch, like carbon-relay',
+            'pickle': 'Use the pickle protocol rather than plaintext',
+            'proto': 'udp, udp4, udp6, tcp, tcp4, or tcp6',
+            'timeout': 'Seconds to wait for a connection',
+            'batch': 'How many to store before sending to a graphite server',
+        })
+
+        return config
+
+    def get_default_config(self):
+        """
+        Return the default config for the handler
+        """
+        config = super(ShardedGraphiteHandler, self).get_default_config()
+
+        config.update({
+            'destinations': ['localhost:2003'],
+            'replication_factor': 1,
+            'hash_type': 'carbon_ch',
+            'pickle': False,
+            'proto': 'tcp',
+            'timeout': 15,
+            'batch': 1,
+        })
+
+        return config
+
+    def _route(self, path, down):
+        """
+        Returns the handlers to send the metric with path to, skipping the
+        handlers of servers that are down for the next ones on the ring
+        """
+        try:
+            handlers = self.routes.young[path]
+        except KeyError:
+            handlers = self.routes.get(path)
+            if handlers is None:
+                handlers = tuple([self.nodes[node]
+                                  for node in self.ring.get_nodes(path)])
+                self.routes[path] = handlers
+
+        if down:
+            handlers = ([handler for handler in handlers
+                         if handler not in down] +
+                        [handler for handler in handlers
+                         if handler in down])
+        return handlers[:self.replication_factor]
+
+    def _down(self):
+        return set([handler for handler in self.handlers
+                    if handler.is_down()])
+
+    def process(self, metric):
+        """
+        Process a metric by passing it to the GraphiteHandlers of its
+        servers
+        """
+        for handler in self._route(metric.path, self._down()):
+            handler._process(metric)
+
+    def process_batch(self, metrics):
+        """
+        Process a batch of metrics by passing every server its share
+        """
+        down = self._down()
+        batches = {}
+        for metric in metrics:
+            for handler in self._route(metric.path, down):
+                if handler in batches:
+                    batches[handler].append(metric)
+                else:
+                    batches[handler] = [metric]
+
+        for handler in self.handlers:
+            if handler in batches:
+                handler._process_batch(batches[handler])
+
+    def _flush(self, force=False):
+        for handler in self.handlers:
+            handler._flush(force)
+        # Account for the servers in the telemetry of this handler
+        self.failures = sum([handler.failures for handler in self.handlers])
+        self.trimmed = sum([handler.trimmed for handler in self.handlers])
+
+    def _idle(self):
+        for handler in self.handlers:
+            handler._idle()
+
+    def flush(self):
+        """Flush metrics in queue"""
+        for handler in self.handlers:
+            handler.flush()
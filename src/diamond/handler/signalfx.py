@@ -14,35 +14,38 @@ Enable this handler
  * handers = diamond.handler.httpHandler.SignalfxHandler
 
  * auth_token = SIGNALFX_AUTH_TOKEN
- * batch_size = [optional | 300 ] will wait for this many requests before
+ * batch = [optional | 300 ] will wait for this many requests before
      posting
+ * batch_max_age = [optional | 10 ] will not wait longer than this many
+     seconds before posting
 """
 
 from Handler import Handler
 from diamond.util import get_diamond_version
 import json
 import logging
-import time
+import socket
 import urllib2
 
 
 class SignalfxHandler(Handler):
 
-    # Inititalize Handler with url and batch size
+    buffered = True
+
+    # Inititalize Handler with url
     def __init__(self, config=None):
         Handler.__init__(self, config)
-        self.metrics = []
-        self.batch_size = int(self.config['batch'])
         self.url = self.config['url']
         self.auth_token = self.config['auth_token']
-        self.batch_max_interval = self.config['batch_max_interval']
-        self.resetBatchTimeout()
         if self.auth_token == "":
             logging.error("Failed to load Signalfx module")
             return
 
-    def resetBatchTimeout(self):
-        self.batch_max_timestamp = int(time.time() + self.batch_max_interval)
+    def create_buffer(self):
+        # batch_max_interval is the old name of batch_max_age
+        if 'batch_max_interval' in self.config:
+            self.config['batch_max_age'] = self.config['batch_max_interval']
+        return super(SignalfxHandler, self).create_buffer()
 
     def get_default_config_help(self):
         """
@@ -52,7 +55,6 @@ class SignalfxHandler(Handler):
 
         config.update({
             'url': 'Where to send metrics',
-            'batch': 'How many to store before sending',
             'auth_token': 'Org API token to use when sending metrics',
             })
 
@@ -68,23 +70,17 @@ class SignalfxHandler(Handler):
             'url': 'https://api.signalfuse.com/v2/datapoint',
             'batch': 300,
             # Don't wait more than 10 sec between pushes
-            'batch_max_interval': 10,
+            'batch_max_age': 10,
             'auth_token': '',
             })
 
         return config
 
-    def process(self, metric):
+    def encode(self, metric):
         """
-        Queue a metric.  Flushing queue if batch size reached
+        Convert a metric to its type and signalfx point
         """
-        self.metrics.append(metric)
-        if self.should_flush():
-            self._send()
-
-    def should_flush(self):
-        return len(self.metrics) >= self.batch_size or \
-            time.time() >= self.batch_max_timestamp
+        return (metric.metric_type.lower(), self.into_signalfx_point(metric))
 
     def into_signalfx_point(self, metric):
         """
@@ -105,35 +101,31 @@ class SignalfxHandler(Handler):
             "timestamp": metric.timestamp * 1000,
         }
 
-    def flush(self):
-        """Flush metrics in queue"""
-        self._send()
-
     def user_agent(self):
         """
         HTTP user agent
         """
         return "Diamond: %s" % get_diamond_version()
 
-    def _send(self):
+    def send(self, metrics):
         # Potentially use protobufs in the future
         postDictionary = {}
-        for metric in self.metrics:
-            t = metric.metric_type.lower()
+        for t, point in metrics:
             if t not in postDictionary:
                 postDictionary[t] = []
-            postDictionary[t].append(self.into_signalfx_point(metric))
+            postDictionary[t].append(point)
 
-        self.metrics = []
         postBody = json.dumps(postDictionary)
         logging.debug("Body is %s", postBody)
         req = urllib2.Request(self.url, postBody,
                               {"Content-type": "application/json",
                                "X-SF-TOKEN": self.auth_token,
                                "User-Agent": self.user_agent()})
-        self.resetBatchTimeout()
         try:
             urllib2.urlopen(req)
-        except urllib2.URLError:
-            logging.exception("Unable to post signalfx metrics")
-            return
+        except (urllib2.URLError, socket.error), ex:
+            # Keep the metrics, they are sent with the next batch
+            self.failures += 1
+            self._throttle_error("SignalfxHandler: Unable to post metrics. %s",
+                                 ex)
+            return 0
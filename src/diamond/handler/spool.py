@@ -0,0 +1,226 @@
+# coding=utf-8
+
+"""
+On-disk spool for the metrics a buffered handler could not send.
+
+When the backend is down the buffer of a handler fills up, instead of
+trimming the backlog the oldest metrics are appended to the spool. The spool
+is a directory of segment files, each a sequence of records holding a pickled
+list of encoded metrics. A new segment is started once the newest one holds
+spool_segment_bytes, and once all segments hold more than spool_max_bytes the
+oldest segment is dropped.
+
+Once sending works again the spooled metrics are replayed, oldest first, at
+most spool_replay_rate metrics a second so the backend is not flooded. A
+segment is removed once it has been replayed. Segments left by a previous run
+are replayed too, a record is replayed at least once but may be replayed
+twice if diamond stops while replaying its segment.
+"""
+
+import cPickle
+import os
+import re
+import struct
+
+# Length of the pickled metrics and how many there are
+HEADER = struct.Struct('!LL')
+
+SEGMENT_RE = re.compile(r'^(\d{10})\.spool$')
+
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+
+DEFAULT_SEGMENT_BYTES = 4 * 1024 * 1024
+
+
+class Spool(object):
+    """
+    A size capped, segmented append only log of lists of encoded metrics
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES,
+                 segment_bytes=DEFAULT_SEGMENT_BYTES):
+        self.path = path
+        self.max_bytes = max(int(max_bytes), 1)
+        self.segment_bytes = max(min(int(segment_bytes), self.max_bytes // 2),
+                                 1)
+        # [sequence number, bytes, metrics] of every segment, oldest first
+        self.segments = []
+        # Bytes and metrics of the oldest segment that were replayed
+        self.offset = 0
+        self.replayed = 0
+        # Metrics of the record at offset that were replayed
+        self.skip = 0
+        # Metrics dropped from a full spool
+        self.evicted = 0
+        # The newest segment, open for appending
+        self.file = None
+        # Where the last read() ended, for commit()
+        self._read = None
+        self._scan()
+
+    def __len__(self):
+        """
+        Number of metrics waiting to be replayed
+        """
+        return sum([segment[2] for segment in self.segments]) - self.replayed
+
+    def _segment_path(self, sequence):
+        return os.path.join(self.path, '%010d.spool' % sequence)
+
+    def _scan(self):
+        """
+        Find the segments left by a previous run, a record that was only
+        partly written is cut off
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        sequences = []
+        for name in os.listdir(self.path):
+            match = SEGMENT_RE.match(name)
+            if match is not None:
+                sequences.append(int(match.group(1)))
+
+        for sequence in sorted(sequences):
+            path = self._segment_path(sequence)
+            size = os.path.getsize(path)
+            offset = 0
+            count = 0
+            f = open(path, 'rb')
+            try:
+                while offset + HEADER.size <= size:
+                    f.seek(offset)
+                    length, items = HEADER.unpack(f.read(HEADER.size))
+                    if offset + HEADER.size + length > size:
+                        break
+                    offset += HEADER.size + length
+                    count += items
+            finally:
+                f.close()
+
+            if offset < size:
+                f = open(path, 'r+b')
+                try:
+                    f.truncate(offset)
+                finally:
+                    f.close()
+            if offset:
+                self.segments.append([sequence, offset, count])
+            else:
+                os.remove(path)
+
+    def size(self):
+        """
+        Bytes held on disk
+        """
+        return sum([segment[1] for segment in self.segments])
+
+    def write(self, metrics):
+        """
+        Append a list of encoded metrics
+        """
+        if not metrics:
+            return
+        payload = cPickle.dumps(list(metrics), cPickle.HIGHEST_PROTOCOL)
+        record = HEADER.pack(len(payload), len(metrics)) + payload
+
+        if not self.segments or self.segments[-1][1] >= self.segment_bytes:
+            self._close()
+            sequence = 0
+            if self.segments:
+                sequence = self.segments[-1][0] + 1
+            self.segments.append([sequence, 0, 0])
+        segment = self.segments[-1]
+        if self.file is None:
+            self.file = open(self._segment_path(segment[0]), 'ab')
+        self.file.write(record)
+        self.file.flush()
+        segment[1] += len(record)
+        segment[2] += len(metrics)
+
+        while self.size() > self.max_bytes and len(self.segments) > 1:
+            self.evicted += self.segments[0][2] - self.replayed
+            self._remove_oldest()
+
+    def read(self, max_items):
+        """
+        Returns the oldest records, holding at least one and at most
+        max_items metrics unless the oldest record holds more. They stay in
+        the spool until commit() is called.
+        """
+        if not self.segments:
+            return []
+        sequence, size, count = self.segments[0]
+        if self.file is not None and len(self.segments) == 1:
+            self.file.flush()
+
+        metrics = []
+        # Where each record ends and how many of its metrics were read
+        records = []
+        offset = self.offset
+        skip = self.skip
+        try:
+            f = open(self._segment_path(sequence), 'rb')
+            try:
+                f.seek(offset)
+                while offset < size:
+                    length, items = HEADER.unpack(f.read(HEADER.size))
+                    if metrics and len(metrics) + items - skip > max_items:
+                        break
+                    metrics.extend(cPickle.loads(f.read(length))[skip:])
+                    offset += HEADER.size + length
+                    records.append((offset, items - skip))
+                    skip = 0
+            finally:
+                f.close()
+        except Exception:
+            # A segment that can not be read is dropped, rather than
+            # holding up the replay forever
+            self.evicted += count - self.replayed
+            self._remove_oldest()
+            return self.read(max_items)
+
+        self._read = (sequence, records)
+        return metrics
+
+    def commit(self, count=None):
+        """
+        Remove the records returned by the last read(), or only their first
+        count metrics if not all of them were sent
+        """
+        if self._read is None:
+            return
+        sequence, records = self._read
+        self._read = None
+        if not self.segments or self.segments[0][0] != sequence:
+            # The segment was evicted in the meantime
+            return
+        if count is None:
+            count = sum([items for offset, items in records])
+        self.replayed += count
+        for offset, items in records:
+            if count < items:
+                self.skip += count
+                break
+            count -= items
+            self.offset = offset
+            self.skip = 0
+        if self.offset >= self.segments[0][1]:
+            self._remove_oldest()
+
+    def _remove_oldest(self):
+        if len(self.segments) == 1:
+            self._close()
+        sequence = self.segments.pop(0)[0]
+        self.offset = 0
+        self.replayed = 0
+        self.skip = 0
+        self._read = None
+        try:
+            os.remove(self._segment_path(sequence))
+        except OSError:
+            pass
+
+    def _close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
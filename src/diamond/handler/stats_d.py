@@ -37,6 +37,8 @@ except ImportError:
 
 class StatsdHandler(Handler):
 
+    buffered = True
+
     def __init__(self, config=None):
         """
         Create a new instance of the StatsdHandler class
@@ -53,8 +55,6 @@ class StatsdHandler(Handler):
         # Initialize Options
         self.host = self.config['host']
         self.port = int(self.config['port'])
-        self.batch_size = int(self.config['batch'])
-        self.metrics = []
         self.old_values = {}
 
         # Connect
@@ -69,7 +69,6 @@ class StatsdHandler(Handler):
         config.update({
             'host': '',
             'port': '',
-            'batch': '',
         })
 
         return config
@@ -88,23 +87,20 @@ class StatsdHandler(Handler):
 
         return config
 
-    def process(self, metric):
+    def encode(self, metric):
         """
-        Process a metric by sending it to statsd
+        Encode a metric as its path, type and values
         """
+        return (metric.path, metric.metric_type, metric.value,
+                metric.raw_value)
 
-        self.metrics.append(metric)
-
-        if len(self.metrics) >= self.batch_size:
-            self._send()
-
-    def _send(self):
+    def send(self, metrics):
         """
         Send data to statsd. Fire and forget.  Cross fingers and it'll arrive.
         """
         if not statsd:
             return
-        for metric in self.metrics:
+        for path, metric_type, metric_value, raw_value in metrics:
 
             # Split the path into a prefix and a name
             # to work with the statsd module's view of the world.
@@ -112,35 +108,29 @@ class StatsdHandler(Handler):
             #
             # For the statsd module, you specify prefix in the constructor
             # so we just use the full metric path.
-            (prefix, name) = metric.path.rsplit(".", 1)
-            logging.debug("Sending %s %s|g", name, metric.value)
+            (prefix, name) = path.rsplit(".", 1)
+            logging.debug("Sending %s %s|g", name, metric_value)
 
-            if metric.metric_type == 'GAUGE':
+            if metric_type == 'GAUGE':
                 if hasattr(statsd, 'StatsClient'):
-                    self.connection.gauge(metric.path, metric.value)
+                    self.connection.gauge(path, metric_value)
                 else:
                     statsd.Gauge(prefix, self.connection).send(
-                        name, metric.value)
+                        name, metric_value)
             else:
                 # To send a counter, we need to just send the delta
                 # but without any time delta changes
-                value = metric.raw_value
-                if metric.path in self.old_values:
-                    value = value - self.old_values[metric.path]
-                self.old_values[metric.path] = metric.raw_value
+                value = raw_value
+                if path in self.old_values:
+                    value = value - self.old_values[path]
+                self.old_values[path] = raw_value
 
                 if hasattr(statsd, 'StatsClient'):
-                    self.connection.incr(metric.path, value)
+                    self.connection.incr(path, value)
                 else:
                     statsd.Counter(prefix, self.connection).increment(
                         name, value)
 
-        self.metrics = []
-
-    def flush(self):
-        """Flush metrics in queue"""
-        self._send()
-
     def _connect(self):
         """
         Connect to the statsd server
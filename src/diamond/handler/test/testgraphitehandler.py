@@ -2,6 +2,8 @@
 # coding=utf-8
 ################################################################################
 
+import errno
+import socket
 import time
 
 from test import unittest
@@ -27,6 +29,31 @@ def fake_bad_connect(self):
     self.socket = None
 
 
+# The tests below swap _connect out, keep the real one for the tests that
+# connect to a local server
+real_connect = mod.GraphiteHandler.__dict__['_connect']
+
+
+class FakeSocket(object):
+    """
+    A socket that takes the given number of bytes per send, and then blocks
+    """
+
+    def __init__(self, limits):
+        self.limits = list(limits)
+        self.data = ''
+
+    def send(self, data):
+        if not self.limits:
+            raise socket.error(errno.EAGAIN, 'Resource temporarily unavailable')
+        count = min(self.limits.pop(0), len(data))
+        self.data += str(data[:count])
+        return count
+
+    def close(self):
+        pass
+
+
 class TestGraphiteHandler(unittest.TestCase):
 
     def setUp(self):
@@ -51,7 +78,7 @@ class TestGraphiteHandler(unittest.TestCase):
         handler = mod.GraphiteHandler(config)
 
         patch_sock = patch.object(handler, 'socket', True)
-        sendmock = Mock()
+        sendmock = Mock(side_effect=len)
         patch_send = patch.object(handler, '_send_data', sendmock)
 
         patch_sock.start()
@@ -84,7 +111,7 @@ class TestGraphiteHandler(unittest.TestCase):
         handler = mod.GraphiteHandler(config)
 
         patch_sock = patch.object(handler, 'socket', True)
-        sendmock = Mock()
+        sendmock = Mock(side_effect=len)
         patch_send = patch.object(handler, '_send_data', sendmock)
 
         patch_sock.start()
@@ -116,7 +143,7 @@ class TestGraphiteHandler(unittest.TestCase):
         handler = mod.GraphiteHandler(config)
 
         patch_sock = patch.object(handler, 'socket', True)
-        sendmock = Mock()
+        sendmock = Mock(side_effect=len)
         patch_send = patch.object(handler, '_send_data', sendmock)
 
         patch_sock.start()
@@ -129,6 +156,35 @@ class TestGraphiteHandler(unittest.TestCase):
         self.assertEqual(sendmock.call_count, len(expected_data))
         self.assertEqual(sendmock.call_args_list, expected_data)
 
+    def test_process_batch(self):
+        config = configobj.ConfigObj()
+        config['batch'] = 2
+
+        metrics = [
+            Metric('metricname1', 0, timestamp=123),
+            Metric('metricname2', 0, timestamp=123),
+            Metric('metricname3', 0, timestamp=123),
+        ]
+
+        handler = mod.GraphiteHandler(config)
+
+        patch_sock = patch.object(handler, 'socket', True)
+        sendmock = Mock(side_effect=len)
+        patch_send = patch.object(handler, '_send_data', sendmock)
+
+        patch_sock.start()
+        patch_send.start()
+        handler.process_batch(metrics[:1])
+        handler.process_batch(metrics[1:])
+        patch_send.stop()
+        patch_sock.stop()
+
+        # The whole batch goes out at once
+        self.assertEqual(sendmock.call_args_list, [
+            call("metricname1 0 123\nmetricname2 0 123\n"
+                 "metricname3 0 123\n"),
+        ])
+
     def test_backlog(self):
         config = configobj.ConfigObj()
         config['batch'] = 1
@@ -170,7 +226,111 @@ class TestGraphiteHandler(unittest.TestCase):
 
         # self.assertEqual(connect_mock.call_count, len(metrics))
         self.assertEqual(send_mock.call_count, 0)
-        self.assertEqual(handler.metrics, expected_data)
+        self.assertEqual(handler.buffer.items, expected_data)
+        self.assertEqual(handler.trimmed, 5)
+
+    def test_partial_write(self):
+        config = configobj.ConfigObj()
+        config['batch'] = 2
+
+        handler = mod.GraphiteHandler(config)
+        handler.socket = FakeSocket([5])
+        handler.process_batch([Metric('metricname1', 0, timestamp=123),
+                               Metric('metricname2', 0, timestamp=123)])
+
+        # The metric sent in part is finished first, the other one waits
+        self.assertEqual(handler.socket.data, 'metri')
+        self.assertEqual(handler.partial, 'cname1 0 123\n')
+        self.assertEqual(handler.buffer.items, ['metricname2 0 123\n'])
+
+        handler.socket.limits = [100, 100]
+        handler.flush()
+        self.assertEqual(handler.socket.data,
+                         'metricname1 0 123\nmetricname2 0 123\n')
+        self.assertEqual(handler.partial, '')
+        self.assertEqual(len(handler.buffer), 0)
+
+    def test_backoff(self):
+        config = configobj.ConfigObj()
+        config['reconnect_min_interval'] = 2
+        config['reconnect_max_interval'] = 10
+
+        handler = mod.GraphiteHandler(config)
+        handler.socket = None
+        backoffs = []
+        for i in range(5):
+            handler._reconnect_later()
+            backoffs.append(handler.backoff)
+            self.assertTrue(handler.reconnect_at >=
+                            time.time() + handler.backoff / 2 - 1)
+            self.assertTrue(handler.reconnect_at <=
+                            time.time() + handler.backoff)
+        self.assertEqual(backoffs, [2, 4, 8, 10, 10])
+
+        # No reconnect before the backoff is over
+        handler._connect = Mock()
+        self.assertEqual(handler.send(['metricname1 0 123\n']), 0)
+        self.assertEqual(handler._connect.call_count, 0)
+        handler.reconnect_at = 0
+        handler.send(['metricname1 0 123\n'])
+        self.assertEqual(handler._connect.call_count, 1)
+
+    @patch.object(mod.GraphiteHandler, '_connect', real_connect)
+    @patch.object(mod.socket, 'getaddrinfo')
+    def test_dns_cache(self, getaddrinfo_mock):
+        getaddrinfo_mock.return_value = [
+            (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', 2003))]
+        config = configobj.ConfigObj()
+        config['dns_ttl'] = 60
+
+        handler = mod.GraphiteHandler(config)
+        handler._resolve(socket.SOCK_STREAM)
+        self.assertEqual(handler._resolve(socket.SOCK_STREAM),
+                         (socket.AF_INET, ('127.0.0.1', 2003)))
+        self.assertEqual(getaddrinfo_mock.call_count, 1)
+
+        # Failing to connect does not look it up again
+        handler._connect_failed('Connection refused')
+        handler._resolve(socket.SOCK_STREAM)
+        self.assertEqual(getaddrinfo_mock.call_count, 1)
+
+        handler.address_expires = 0
+        handler._resolve(socket.SOCK_STREAM)
+        self.assertEqual(getaddrinfo_mock.call_count, 2)
+        handler._close()
+
+    @patch.object(mod.GraphiteHandler, '_connect', real_connect)
+    def test_connect(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        config = configobj.ConfigObj()
+        config['host'] = '127.0.0.1'
+        config['port'] = server.getsockname()[1]
+        config['proto'] = 'tcp4'
+
+        handler = mod.GraphiteHandler(config)
+        data = 'metricname1 0 123\n'
+        for i in range(100):
+            if handler.send([data]) is None:
+                break
+            time.sleep(0.01)
+        connection = server.accept()[0]
+        self.assertEqual(connection.recv(100), data)
+        connection.close()
+        handler._close()
+
+        # Nothing listens anymore
+        server.close()
+        handler.reconnect_at = 0
+        for i in range(100):
+            if handler.failures:
+                break
+            handler._ready()
+            time.sleep(0.01)
+        self.assertEqual(handler.socket, None)
+        self.assertEqual(handler.backoff, 1)
+        self.assertEqual(handler.send([data]), 0)
 
     def test_error_throttling(self):
         """
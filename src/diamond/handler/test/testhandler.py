@@ -0,0 +1,197 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+from test import unittest
+from test import BufferedHandler
+from test import metrics
+from mock import Mock
+from mock import patch
+
+import configobj
+import cPickle as pickle
+import struct
+
+from diamond.handler.Handler import Handler
+from diamond.handler.buffer import MetricBuffer
+from diamond.handler.graphitepickle import GraphitePickleHandler
+import diamond.handler.graphitepickle as graphitepickle
+
+
+class TestHandler(unittest.TestCase):
+
+    def test_process_batch(self):
+        handler = Handler(configobj.ConfigObj(
+            {'metrics_filter': 'exclude *.cpu1.*'}))
+        processed = []
+
+        def process(metric):
+            if metric.value == 2:
+                raise ValueError('Broken metric')
+            processed.append(metric.value)
+        handler.process = process
+        handler.log = Mock()
+
+        handler._process_batch(metrics(4))
+
+        # A failing metric does not take the rest of the batch with it
+        self.assertEqual(processed, [0, 3])
+        self.assertEqual(handler.failures, 1)
+        self.assertFalse(handler.lock.locked())
+
+    def test_process_batch_override(self):
+        handler = Handler(configobj.ConfigObj())
+        handler.process_batch = Mock(side_effect=ValueError('Broken batch'))
+        handler.log = Mock()
+
+        handler._process_batch(metrics(3))
+
+        self.assertEqual(len(handler.process_batch.call_args[0][0]), 3)
+        self.assertEqual(handler.failures, 1)
+        self.assertFalse(handler.lock.locked())
+
+    def test_process_batch_custom_process(self):
+        class CustomHandler(Handler):
+            def _process(self, metric):
+                self.seen.append(metric.value)
+
+        handler = CustomHandler(configobj.ConfigObj())
+        handler.seen = []
+        handler._process_batch(metrics(3))
+        self.assertEqual(handler.seen, [0, 1, 2])
+
+
+class TestMetricBuffer(unittest.TestCase):
+
+    def test_due(self):
+        buffer = MetricBuffer(max_items=3, max_bytes=4, max_age=10)
+        self.assertFalse(buffer.due())
+        buffer.add('a')
+        buffer.add('b')
+        self.assertFalse(buffer.due())
+        self.assertTrue(buffer.due(buffer.oldest + 10))
+        buffer.add('cc')
+        self.assertTrue(buffer.due())
+
+        buffer = MetricBuffer(max_items=10, max_bytes=4)
+        buffer.extend(['aa', 'bb'])
+        self.assertEqual(buffer.size, 4)
+        self.assertTrue(buffer.due())
+        buffer.remove(1)
+        self.assertEqual(buffer.items, ['bb'])
+        self.assertEqual(buffer.size, 2)
+        self.assertFalse(buffer.due())
+
+    def test_trim(self):
+        buffer = MetricBuffer(max_items=2, max_backlog=6, trim_backlog=4)
+        buffer.extend(['1', '2', '3', '4', '5'])
+        self.assertEqual(buffer.trim(), [])
+        buffer.add('6')
+        self.assertEqual(buffer.trim(), ['1', '2'])
+        self.assertEqual(buffer.items, ['3', '4', '5', '6'])
+        self.assertEqual(buffer.trimmed, 2)
+
+    def test_from_config(self):
+        buffer = BufferedHandler(configobj.ConfigObj({'batch': '10'})).buffer
+        self.assertEqual(buffer.max_items, 10)
+        self.assertEqual(buffer.max_bytes, 0)
+        self.assertEqual(buffer.max_age, 10)
+        self.assertEqual(buffer.max_backlog, 50)
+        self.assertEqual(buffer.trim_backlog, 40)
+
+
+class TestBufferedHandler(unittest.TestCase):
+
+    def test_sends_full_batches(self):
+        handler = BufferedHandler(configobj.ConfigObj({'batch': '3'}))
+        handler._process_batch(metrics(2))
+        self.assertEqual(handler.sent, [])
+        handler._process(metrics(3)[2])
+        self.assertEqual(handler.sent, [['0', '1', '2']])
+        self.assertEqual(len(handler.buffer), 0)
+
+    def test_flush_policy(self):
+        handler = BufferedHandler(configobj.ConfigObj({'batch': '3'}))
+        handler._process_batch(metrics(1))
+
+        # Only a batch that is due is sent, unless forced
+        handler._flush()
+        self.assertEqual(handler.sent, [])
+        handler.buffer.oldest -= 10
+        handler._flush()
+        self.assertEqual(handler.sent, [['0']])
+
+        handler._process_batch(metrics(1))
+        handler._flush(force=True)
+        self.assertEqual(handler.sent, [['0'], ['0']])
+
+    def test_backlog(self):
+        handler = BufferedHandler(configobj.ConfigObj({
+            'batch': '2', 'max_backlog_multiplier': '3',
+            'trim_backlog_multiplier': '1'}))
+        handler.log = Mock()
+        handler.fail = True
+
+        handler._process_batch(metrics(6))
+        self.assertEqual(handler.buffer.items, ['4', '5'])
+        self.assertEqual(handler.trimmed, 4)
+        self.assertEqual(handler.failures, 1)
+
+        handler.fail = False
+        handler._flush()
+        self.assertEqual(handler.sent, [['4', '5']])
+
+    def test_partial_send(self):
+        handler = BufferedHandler(configobj.ConfigObj({'batch': '3'}))
+        handler.send = Mock(return_value=2)
+        handler._process_batch(metrics(3))
+        self.assertEqual(handler.buffer.items, ['2'])
+
+    def test_encode_per_metric(self):
+        handler = BufferedHandler(configobj.ConfigObj({'batch': '10'}))
+        handler.log = Mock()
+
+        def encode(metric):
+            if metric.value == 1:
+                raise ValueError('Broken metric')
+            if metric.value == 2:
+                return None
+            return str(metric.value)
+        handler.encode = encode
+
+        # A failing metric is left out, one encoded as None is skipped
+        handler._process_batch(metrics(4))
+        self.assertEqual(handler.buffer.items, ['0', '3'])
+        self.assertEqual(handler.failures, 1)
+
+
+class TestGraphitePickleHandler(unittest.TestCase):
+
+    @patch.object(GraphitePickleHandler, '_connect')
+    def test_process_batch(self, connect_mock):
+        handler = GraphitePickleHandler(configobj.ConfigObj({'batch': 3}))
+        handler.socket = Mock()
+        handler._send_data = Mock(side_effect=len)
+
+        handler.process_batch(metrics(2))
+        self.assertEqual(handler._send_data.call_count, 0)
+
+        old_size = graphitepickle.MAX_PICKLE_BATCH_SIZE
+        graphitepickle.MAX_PICKLE_BATCH_SIZE = 2
+        try:
+            handler.process_batch(metrics(3))
+        finally:
+            graphitepickle.MAX_PICKLE_BATCH_SIZE = old_size
+
+        self.assertEqual(handler._send_data.call_count, 1)
+        # 5 metrics in messages of at most 2
+        data = handler._send_data.call_args[0][0]
+        batches = []
+        while data:
+            length = struct.unpack('!L', data[:4])[0]
+            batches.append(pickle.loads(data[4:4 + length]))
+            data = data[4 + length:]
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(batches[0][0],
+                         ('servers.host.cpu.cpu0.idle', (123, 0)))
+        self.assertEqual(len(handler.buffer), 0)
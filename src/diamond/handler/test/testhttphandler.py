@@ -0,0 +1,43 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import urllib2
+
+from test import unittest
+from test import metrics
+from mock import Mock
+from mock import patch
+
+import configobj
+
+from diamond.handler.httpHandler import HttpPostHandler
+
+
+@patch('urllib2.urlopen')
+class TestHttpPostHandler(unittest.TestCase):
+
+    def test_post(self, urlopen_mock):
+        handler = HttpPostHandler(configobj.ConfigObj({
+            'url': 'http://localhost:8888/', 'batch': '2'}))
+        handler._process_batch(metrics(2))
+
+        request = urlopen_mock.call_args[0][0]
+        self.assertEqual(request.get_full_url(), 'http://localhost:8888/')
+        self.assertEqual(request.get_data().split(),
+                         ['servers.host.cpu.cpu0.idle', '0', '123',
+                          'servers.host.cpu.cpu1.idle', '1', '123'])
+        self.assertEqual(len(handler.buffer), 0)
+
+    def test_server_down(self, urlopen_mock):
+        urlopen_mock.side_effect = urllib2.URLError('Connection refused')
+        handler = HttpPostHandler(configobj.ConfigObj({'batch': '2'}))
+        handler.log = Mock()
+
+        handler._process_batch(metrics(2))
+        handler._process_batch(metrics(2))
+
+        # The metrics are kept and the error is only logged once
+        self.assertEqual(len(handler.buffer), 4)
+        self.assertEqual(handler.failures, 2)
+        self.assertEqual(handler.log.error.call_count, 1)
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+from test import unittest
+from mock import Mock
+from mock import patch
+
+import configobj
+
+from diamond.handler.influxdbHandler import InfluxdbHandler
+from diamond.metric import Metric
+
+
+@patch('diamond.handler.influxdbHandler.InfluxDBClient')
+class TestInfluxdbHandler(unittest.TestCase):
+
+    def test_send_by_series(self, client_mock):
+        handler = InfluxdbHandler(configobj.ConfigObj({'batch': '3'}))
+        handler._process_batch([
+            Metric('servers.host.cpu.total.idle', 1, timestamp=10),
+            Metric('servers.host.cpu.total.user', 2, timestamp=10),
+            Metric('servers.host.cpu.total.idle', 3, timestamp=20),
+        ])
+
+        client_mock.return_value.write_points.assert_called_once_with([
+            {'points': [[10, 1], [20, 3]],
+             'name': 'servers.host.cpu.total.idle',
+             'columns': ['time', 'value']},
+            {'points': [[10, 2]],
+             'name': 'servers.host.cpu.total.user',
+             'columns': ['time', 'value']},
+        ], time_precision='s')
+        self.assertEqual(len(handler.buffer), 0)
+
+    def test_backoff(self, client_mock):
+        handler = InfluxdbHandler(configobj.ConfigObj({'batch': '1'}))
+        handler.log = Mock()
+        client_mock.return_value.write_points.side_effect = IOError('down')
+
+        handler._process(Metric('servers.host.cpu.total.idle', 1,
+                                timestamp=10))
+        self.assertEqual(handler.failures, 1)
+        self.assertEqual(len(handler.buffer), 1)
+
+        # Nothing is tried until the delay is over
+        handler._process(Metric('servers.host.cpu.total.idle', 2,
+                                timestamp=20))
+        self.assertEqual(client_mock.return_value.write_points.call_count, 1)
+        self.assertEqual(len(handler.buffer), 2)
+
+        client_mock.return_value.write_points.side_effect = None
+        handler.retry_at -= 60
+        handler._flush()
+        self.assertEqual(len(handler.buffer), 0)
+        self.assertEqual(handler.time_multiplier, 1)
+
+    def test_old_options(self, client_mock):
+        handler = InfluxdbHandler(configobj.ConfigObj({
+            'batch_size': '100', 'cache_size': '1000'}))
+        self.assertEqual(handler.buffer.max_items, 100)
+        self.assertEqual(handler.buffer.max_backlog, 1000)
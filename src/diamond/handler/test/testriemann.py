@@ -42,3 +42,21 @@ class TestRiemannHandler(unittest.TestCase):
             'metric': 0.0,
             'ttl': None
         })
+
+    @run_only_if_bernhard_is_available
+    def test_metric_to_riemann_event_milliseconds(self):
+        config = configobj.ConfigObj()
+        config['host'] = 'localhost'
+        config['port'] = 5555
+        config['time_precision'] = 'ms'
+
+        handler = RiemannHandler(config)
+        metric = Metric('servers.com.example.www.cpu.total.idle',
+                        0,
+                        timestamp=1234567.25,
+                        host='com.example.www')
+
+        event = handler._metric_to_riemann_event(metric)
+
+        self.assertEqual(event['time'], 1234567)
+        self.assertEqual(event['time_micros'], 1234567250000)
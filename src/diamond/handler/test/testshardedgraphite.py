@@ -0,0 +1,156 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import time
+
+from test import unittest
+from test import metrics
+from mock import Mock
+from mock import patch
+
+import configobj
+
+from diamond.handler.graphite import GraphiteHandler
+from diamond.handler.graphitepickle import GraphitePickleHandler
+from diamond.handler.shardedgraphite import ConsistentHashRing
+from diamond.handler.shardedgraphite import ShardedGraphiteHandler
+from diamond.handler.shardedgraphite import carbon_hash
+
+# One host per metric, so they spread over the servers
+PATH = 'servers.host%d.cpu.total.idle'
+
+
+class TestConsistentHashRing(unittest.TestCase):
+
+    # The expected values are those of carbon's own tests, so metrics are
+    # placed like carbon-relay places them
+
+    def test_carbon_hash(self):
+        self.assertEqual(carbon_hash('hosts.worker1.cpu'), 64833)
+        self.assertEqual(carbon_hash('hosts.worker2.cpu'), 38509)
+        self.assertEqual(carbon_hash('hosts.worker1.cpu', 'fnv1a_ch'), 59573)
+        self.assertEqual(carbon_hash('hosts.worker2.cpu', 'fnv1a_ch'), 35749)
+
+    def test_get_node(self):
+        ring = ConsistentHashRing([('127.0.0.1', 'cache0'),
+                                   ('127.0.0.1', 'cache1'),
+                                   ('127.0.0.1', 'cache2')])
+        self.assertEqual(ring.get_node('hosts.worker1.cpu'),
+                         ('127.0.0.1', 'cache2'))
+        self.assertEqual(len(ring.ring), 300)
+
+        self.assertEqual(ring.get_nodes('hosts.worker1.cpu'), [
+            ('127.0.0.1', 'cache2'),
+            ('127.0.0.1', 'cache0'),
+            ('127.0.0.1', 'cache1'),
+        ])
+
+    def test_get_node_fnv1a(self):
+        ring = ConsistentHashRing([
+            ('127.0.0.1', 'ba603c36342304ed77953f84ac4d357b'),
+            ('127.0.0.2', '5dd63865534f84899c6e5594dba6749a'),
+            ('127.0.0.3', '866a18b81f2dc4649517a1df13e26f28'),
+        ], hash_type='fnv1a_ch')
+        self.assertEqual(ring.get_node('hosts.worker1.cpu'),
+                         ('127.0.0.1', 'ba603c36342304ed77953f84ac4d357b'))
+        self.assertEqual(ring.get_node('hosts.worker2.cpu'),
+                         ('127.0.0.3', '866a18b81f2dc4649517a1df13e26f28'))
+
+    def test_single_node(self):
+        ring = ConsistentHashRing([('127.0.0.1', None)])
+        self.assertEqual(ring.get_nodes('a'), [('127.0.0.1', None)])
+        self.assertEqual(ConsistentHashRing([]).get_nodes('a'), [])
+
+
+class TestShardedGraphiteHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.connect = patch.object(GraphiteHandler, '_connect')
+        self.connect.start()
+
+    def tearDown(self):
+        self.connect.stop()
+
+    def handler(self, **config):
+        config.setdefault('destinations', ['10.0.0.1:2003:a', '10.0.0.2:2003',
+                                           '10.0.0.3:2004:c'])
+        config.setdefault('batch', '1000')
+        return ShardedGraphiteHandler(configobj.ConfigObj(config))
+
+    def buffered(self, handler):
+        return dict([(inner.host, [line.split()[0]
+                                   for line in inner.buffer.items])
+                     for inner in handler.handlers])
+
+    def test_routes_by_ring(self):
+        handler = self.handler()
+        self.assertEqual([(inner.host, inner.port)
+                          for inner in handler.handlers],
+                         [('10.0.0.1', 2003), ('10.0.0.2', 2003),
+                          ('10.0.0.3', 2004)])
+
+        handler._process_batch(metrics(30, PATH))
+
+        buffered = self.buffered(handler)
+        self.assertEqual(sum([len(paths) for paths in buffered.values()]), 30)
+        # The metrics are spread over the servers
+        self.assertTrue(min([len(paths) for paths in buffered.values()]) > 0)
+        for metric in metrics(30, PATH):
+            server = handler.ring.get_node(metric.path)[0]
+            self.assertTrue(metric.path in buffered[server])
+
+    def test_replication(self):
+        handler = self.handler(replication_factor='2')
+        handler._process_batch(metrics(30, PATH))
+
+        buffered = self.buffered(handler)
+        for metric in metrics(30, PATH):
+            servers = [node[0]
+                       for node in handler.ring.get_nodes(metric.path)]
+            self.assertEqual([server for server in sorted(buffered)
+                              if metric.path in buffered[server]],
+                             sorted(servers[:2]))
+
+    def test_failover(self):
+        handler = self.handler()
+        down = handler.nodes[('10.0.0.1', 'a')]
+        down.socket = None
+        down.reconnect_at = time.time() + 60
+
+        handler._process_batch(metrics(30, PATH))
+
+        buffered = self.buffered(handler)
+        self.assertEqual(buffered['10.0.0.1'], [])
+        for metric in metrics(30, PATH):
+            servers = [node[0]
+                       for node in handler.ring.get_nodes(metric.path)]
+            servers.remove('10.0.0.1')
+            self.assertTrue(metric.path in buffered[servers[0]])
+
+    def test_flush(self):
+        handler = self.handler(batch='1', max_backlog_multiplier='100')
+        for inner in handler.handlers:
+            inner.send = Mock(return_value=0)
+        handler._process_batch(metrics(10, PATH))
+        handler._flush()
+        self.assertEqual(sum([inner.send.call_count
+                              for inner in handler.handlers]), 6)
+        self.assertEqual(sum([len(inner.buffer)
+                              for inner in handler.handlers]), 10)
+
+    def test_pickle(self):
+        handler = self.handler(pickle='True')
+        self.assertTrue(isinstance(handler.handlers[0],
+                                   GraphitePickleHandler))
+
+    def test_invalid_destinations(self):
+        handler = self.handler(destinations=['10.0.0.1', '10.0.0.2:2003',
+                                             '10.0.0.2:2004'])
+        self.assertEqual([inner.host for inner in handler.handlers],
+                         ['10.0.0.2'])
+
+        handler = self.handler(destinations=['10.0.0.1'])
+        self.assertFalse(handler.enabled)
+        handler = self.handler(hash_type='md5')
+        self.assertFalse(handler.enabled)
@@ -0,0 +1,45 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import json
+import socket
+
+from test import unittest
+from test import metrics
+from mock import Mock
+from mock import patch
+
+import configobj
+
+from diamond.handler.signalfx import SignalfxHandler
+
+
+@patch('urllib2.urlopen')
+class TestSignalfxHandler(unittest.TestCase):
+
+    def handler(self):
+        handler = SignalfxHandler(configobj.ConfigObj({
+            'auth_token': 'token', 'batch': '2'}))
+        handler.log = Mock()
+        return handler
+
+    def test_post(self, urlopen_mock):
+        handler = self.handler()
+        handler._process_batch(metrics(2))
+
+        request = urlopen_mock.call_args[0][0]
+        self.assertEqual(len(json.loads(request.get_data())['counter']), 2)
+        self.assertEqual(len(handler.buffer), 0)
+
+    def test_server_down(self, urlopen_mock):
+        urlopen_mock.side_effect = socket.error('Connection reset')
+        handler = self.handler()
+
+        handler._process_batch(metrics(2))
+        handler._process_batch(metrics(2))
+
+        # The metrics are kept and the error is only logged once
+        self.assertEqual(len(handler.buffer), 4)
+        self.assertEqual(handler.failures, 2)
+        self.assertEqual(handler.log.error.call_count, 1)
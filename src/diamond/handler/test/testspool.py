@@ -0,0 +1,203 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import os
+import shutil
+import tempfile
+
+from test import unittest
+from test import BufferedHandler
+from test import metrics
+from mock import Mock
+
+import configobj
+
+from diamond.handler.spool import Spool
+
+
+class TestSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'handler')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_read(self):
+        spool = Spool(self.path)
+        spool.write(['a', 'b'])
+        spool.write(['c'])
+        spool.write([('d', (1, 2))])
+        self.assertEqual(len(spool), 4)
+
+        self.assertEqual(spool.read(2), ['a', 'b'])
+        # Without a commit the same records are read again
+        self.assertEqual(spool.read(3), ['a', 'b', 'c'])
+        spool.commit()
+        self.assertEqual(len(spool), 1)
+        # A record larger than max_items is still read
+        self.assertEqual(spool.read(0), [('d', (1, 2))])
+        spool.commit()
+        self.assertEqual(len(spool), 0)
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_commit_sent(self):
+        spool = Spool(self.path)
+        spool.write(['a', 'b'])
+        spool.write(['c', 'd'])
+        spool.write(['e'])
+
+        self.assertEqual(spool.read(4), ['a', 'b', 'c', 'd'])
+        # Only the metrics that were not sent are read again
+        spool.commit(3)
+        self.assertEqual(len(spool), 2)
+        self.assertEqual(spool.read(2), ['d', 'e'])
+        spool.commit(0)
+        self.assertEqual(spool.read(1), ['d'])
+        spool.commit(1)
+        self.assertEqual(spool.read(1), ['e'])
+        spool.commit()
+        self.assertEqual(len(spool), 0)
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_segments_and_eviction(self):
+        spool = Spool(self.path, max_bytes=300, segment_bytes=100)
+        for i in range(20):
+            spool.write(['metric%d' % i] * 2)
+
+        self.assertTrue(spool.size() <= 300)
+        self.assertTrue(len(spool.segments) > 1)
+        self.assertEqual(len(spool) + spool.evicted, 40)
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ['%010d.spool' % segment[0]
+                          for segment in spool.segments])
+        # The newest metrics are kept
+        metrics = []
+        while len(spool):
+            metrics.extend(spool.read(100))
+            spool.commit()
+        self.assertEqual(metrics[-1], 'metric19')
+        self.assertEqual(len(metrics), 40 - spool.evicted)
+
+    def test_restart(self):
+        spool = Spool(self.path, segment_bytes=50)
+        for i in range(5):
+            spool.write(['metric%d' % i])
+        self.assertEqual(spool.read(1), ['metric0'])
+        spool.commit()
+        spool.file.close()
+
+        # Cut off the last record halfway, as a crash while writing would
+        last = os.path.join(self.path, '%010d.spool' % spool.segments[-1][0])
+        f = open(last, 'r+b')
+        f.truncate(os.path.getsize(last) - 3)
+        f.close()
+
+        spool = Spool(self.path, segment_bytes=50)
+        metrics = []
+        while len(spool):
+            metrics.extend(spool.read(100))
+            spool.commit()
+        # The replayed position is not kept, the partial record is gone
+        self.assertEqual(metrics, ['metric0', 'metric1', 'metric2',
+                                   'metric3'])
+
+        # New records follow the replayed ones
+        spool.write(['metric5'])
+        self.assertEqual(spool.read(1), ['metric5'])
+
+
+class TestBufferedHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def handler(self, **config):
+        config.update({'batch': '2', 'max_backlog_multiplier': '2',
+                       'trim_backlog_multiplier': '1',
+                       'spool_dir': self.directory})
+        handler = BufferedHandler(configobj.ConfigObj(config))
+        handler.log = Mock()
+        return handler
+
+    def test_spools_and_replays(self):
+        handler = self.handler()
+        handler.fail = True
+        for metric in metrics(7):
+            handler._process(metric)
+
+        # Nothing is dropped, the trimmed metrics are on disk
+        self.assertEqual(handler.trimmed, 0)
+        self.assertEqual(handler.buffer.items, ['4', '5', '6'])
+        self.assertEqual(len(handler.spool), 4)
+        self.assertTrue(os.path.isdir(os.path.join(self.directory,
+                                                   'BufferedHandler')))
+
+        handler.fail = False
+        handler.spool_replayed -= 60
+        handler._process(metrics(8)[7])
+        self.assertEqual(sum(handler.sent, []),
+                         ['4', '5', '6', '7', '0', '1', '2', '3'])
+        self.assertEqual(len(handler.spool), 0)
+
+    def test_replay_rate(self):
+        handler = self.handler(spool_replay_rate='2')
+        handler.fail = True
+        handler._process_batch(metrics(10))
+        self.assertEqual(len(handler.spool), 8)
+
+        handler.fail = False
+        handler.spool_replayed -= 1
+        handler._process_batch(metrics(2))
+        # A record larger than a second's worth is still replayed
+        self.assertEqual(len(sum(handler.sent, [])), 4 + 8)
+
+        handler.fail = True
+        handler._process_batch(metrics(4))
+        handler._process_batch(metrics(4))
+        self.assertEqual(len(handler.spool), 6)
+
+        handler.fail = False
+        handler.spool_replayed -= 1
+        handler.sent = []
+        handler._process_batch(metrics(2))
+        self.assertEqual(sum(handler.sent, []), ['2', '3', '0', '1', '0', '1'])
+        self.assertEqual(len(handler.spool), 4)
+
+    def test_replay_partly_sent(self):
+        handler = self.handler()
+        handler.fail = True
+        handler._process_batch(metrics(6))
+        self.assertEqual(len(handler.spool), 4)
+
+        # The backend takes one metric of each batch
+        def send(batch):
+            handler.sent.append(list(batch))
+            return 1
+        handler.send = send
+        handler.fail = False
+        for i in range(4):
+            handler.spool_replayed -= 60
+            handler._replay_spool()
+        self.assertEqual([batch[0] for batch in handler.sent],
+                         ['0', '1', '2', '3'])
+        self.assertEqual(len(handler.spool), 0)
+
+    def test_flush_spools_the_rest(self):
+        handler = self.handler()
+        handler.fail = True
+        handler._process(metrics(1)[0])
+        handler._flush(force=True)
+
+        self.assertEqual(len(handler.buffer), 0)
+        handler = self.handler()
+        self.assertEqual(len(handler.spool), 1)
+
+    def test_without_spool(self):
+        handler = BufferedHandler(configobj.ConfigObj({'batch': '2'}))
+        self.assertEqual(handler.spool, None)
@@ -0,0 +1,34 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+from test import unittest
+from mock import Mock
+from mock import patch
+
+import configobj
+
+from diamond.handler.tsdb import TSDBHandler
+from diamond.metric import Metric
+
+
+class TestTSDBHandler(unittest.TestCase):
+
+    @patch('diamond.handler.tsdb.TSDBHandler._connect')
+    def test_process_batch_skips_bad_metric(self, connect_mock):
+        handler = TSDBHandler(configobj.ConfigObj({'host': 'localhost'}))
+        handler._send = Mock()
+        handler.log = Mock()
+
+        handler.process_batch([
+            Metric('servers.host.cpu.total.user', 2, timestamp=123),
+            # The host is not in the path, so there is no collector
+            Metric('servers.host.cpu.total.idle', 1, timestamp=123,
+                   host='elsewhere'),
+            Metric('servers.host.cpu.total.system', 3, timestamp=123),
+        ])
+
+        self.assertEqual(handler.failures, 1)
+        data = handler._send.call_args[0][0]
+        self.assertEqual(data.count('put '), 2)
+        self.assertTrue('user' in data and 'system' in data)
@@ -34,10 +34,14 @@ yourself.
 `    handlers = diamond.handler.tsdb.TSDBHandler
 `
 
+Set `time_precision = ms` to send timestamps in milliseconds, which OpenTSDB
+2.0 and later accept.
+
 """
 
 from Handler import Handler
 import socket
+import traceback
 
 
 class TSDBHandler(Handler):
@@ -62,6 +66,7 @@ class TSDBHandler(Handler):
         self.timeout = int(self.config['timeout'])
         self.metric_format = str(self.config['format'])
         self.tags = str(self.config['tags'])
+        self.time_precision = self.config['time_precision']
 
         # Connect
         self._connect()
@@ -78,6 +83,7 @@ class TSDBHandler(Handler):
             'timeout': '',
             'format': '',
             'tags': '',
+            'time_precision': 'Timestamps in seconds (s) or milliseconds (ms)',
         })
 
         return config
@@ -95,6 +101,7 @@ class TSDBHandler(Handler):
             'format': '{Collector}.{Metric} {timestamp} {value} hostname={host}'
                       '{tags}',
             'tags': '',
+            'time_precision': 's',
         })
 
         return config
@@ -109,18 +116,42 @@ class TSDBHandler(Handler):
         """
         Process a metric by sending it to TSDB
         """
+        self._send(self._format(metric))
+
+    def process_batch(self, metrics):
+        """
+        Process a batch of metrics by sending them to TSDB at once. A metric
+        that can not be formatted is left out, not the whole batch.
+        """
+        lines = []
+        for metric in metrics:
+            try:
+                lines.append(self._format(metric))
+            except Exception:
+                self.failures += 1
+                self.log.error(traceback.format_exc())
+        if lines:
+            self._send(''.join(lines))
+
+    def _format(self, metric):
+        """
+        Returns the put command for a metric
+        """
+        if self.time_precision == 'ms':
+            timestamp = metric.get_timestamp_ms()
+        else:
+            timestamp = metric.timestamp
 
         metric_str = self.metric_format.format(
             Collector=metric.getCollectorPath(),
             Path=metric.path,
             Metric=metric.getMetricPath(),
             host=metric.host,
-            timestamp=metric.timestamp,
+            timestamp=timestamp,
             value=metric.value,
             tags=self.tags
         )
-        # Just send the data as a string
-        self._send("put " + str(metric_str) + "\n")
+        return "put " + str(metric_str) + "\n"
 
     def _send(self, data):
         """
@@ -10,6 +10,11 @@ class Metric(object):
 
     _METRIC_TYPES = ['COUNTER', 'GAUGE']
 
+    # Handlers keep a lot of metrics around, so don't give each one a dict.
+    # _split caches the decomposition of the path, see _get_split()
+    __slots__ = ('path', 'value', 'raw_value', 'timestamp', 'timestamp_ms',
+                 'precision', 'host', 'metric_type', 'ttl', '_split')
+
     def __init__(self, path, value, raw_value=None, timestamp=None, precision=0,
                  host=None, metric_type='COUNTER', ttl=None):
         """
@@ -19,7 +24,9 @@ class Metric(object):
             path=string: string the specifies the path of the metric
             value=[float|int]: the value to be submitted
             timestamp=[float|int]: the timestamp, in seconds since the epoch
-            (as from time.time()) precision=int: the precision to apply.
+            (as from time.time()). The milliseconds of a float timestamp
+            are kept in timestamp_ms for handlers that can use them.
+            precision=int: the precision to apply.
             Generally the default (2) should work fine.
         """
 
@@ -31,8 +38,12 @@ class Metric(object):
                                    % (path, value, metric_type))
 
         # If no timestamp was passed in, set it to the current time
+        timestamp_ms = None
         if timestamp is None:
             timestamp = int(time.time())
+        elif isinstance(timestamp, float):
+            timestamp_ms = int(timestamp * 1000)
+            timestamp = int(timestamp)
         else:
             # If the timestamp isn't an int, then make it one
             if not isinstance(timestamp, int):
@@ -59,10 +70,33 @@ class Metric(object):
         self.value = value
         self.raw_value = raw_value
         self.timestamp = timestamp
+        self.timestamp_ms = timestamp_ms
         self.precision = precision
         self.host = host
         self.metric_type = metric_type
         self.ttl = ttl
+        self._split = None
+
+    def __getstate__(self):
+        return (self.path, self.value, self.raw_value, self.timestamp,
+                self.timestamp_ms, self.precision, self.host,
+                self.metric_type, self.ttl)
+
+    def __setstate__(self, state):
+        (self.path, self.value, self.raw_value, self.timestamp,
+         self.timestamp_ms, self.precision, self.host, self.metric_type,
+         self.ttl) = state
+        self._split = None
+
+    def get_timestamp_ms(self):
+        """
+        Returns the timestamp in milliseconds since the epoch
+        """
+        timestamp_ms = self.timestamp_ms
+        # Ignore the milliseconds if the timestamp was changed since
+        if timestamp_ms is not None and timestamp_ms // 1000 == self.timestamp:
+            return timestamp_ms
+        return self.timestamp * 1000
 
     def __repr__(self):
         """
@@ -98,19 +132,45 @@ class Metric(object):
             raise DiamondException(
                 "Metric could not be parsed from string: %s." % string)
 
+    def _get_split(self):
+        """
+        Returns the cached (path, host, path prefix, collector path,
+        metric path) of the metric. The parts are worked out together on
+        first use and again whenever the path or host is changed.
+        """
+        split = self._split
+        if split is None or split[0] is not self.path or (
+                split[1] is not self.host):
+            split = self._split = self._split_path()
+        return split
+
+    def _split_path(self):
+        path = self.path
+        host = self.host
+
+        # If we don't have a host name, assume the path is
+        # prefix.host.collector.metric
+        if host is None:
+            parts = path.split('.')
+            if len(parts) < 3:
+                return (path, host, parts[0], None, '')
+            return (path, host, parts[0], parts[2], '.'.join(parts[3:]))
+
+        offset = path.index(host)
+        start = offset + len(host) + 1
+        end = path.find('.', start)
+        if end < 0:
+            return (path, host, path[0:offset - 1], None, None)
+        return (path, host, path[0:offset - 1], path[start:end],
+                path[end + 1:])
+
     def getPathPrefix(self):
         """
             Returns the path prefix path
             servers.host.cpu.total.idle
             return "servers"
         """
-        # If we don't have a host name, assume it's just the first part of the
-        # metric path
-        if self.host is None:
-            return self.path.split('.')[0]
-
-        offset = self.path.index(self.host) - 1
-        return self.path[0:offset]
+        return self._get_split()[2]
 
     def getCollectorPath(self):
         """
@@ -118,15 +178,13 @@ class Metric(object):
             servers.host.cpu.total.idle
             return "cpu"
         """
-        # If we don't have a host name, assume it's just the third part of the
-        # metric path
-        if self.host is None:
-            return self.path.split('.')[2]
-
-        offset = self.path.index(self.host)
-        offset += len(self.host) + 1
-        endoffset = self.path.index('.', offset)
-        return self.path[offset:endoffset]
+        collector = self._get_split()[3]
+        if collector is None:
+            # There is no collector in the path, fail like a lookup would
+            if self.host is None:
+                raise IndexError('list index out of range')
+            raise ValueError('substring not found')
+        return collector
 
     def getMetricPath(self):
         """
@@ -134,14 +192,7 @@ class Metric(object):
             servers.host.cpu.total.idle
             return "total.idle"
         """
-        # If we don't have a host name, assume it's just the fourth+ part of the
-        # metric path
-        if self.host is None:
-            path = self.path.split('.')[3:]
-            return '.'.join(path)
-
-        prefix = '.'.join([self.getPathPrefix(), self.host,
-                           self.getCollectorPath()])
-
-        offset = len(prefix) + 1
-        return self.path[offset:]
+        metric = self._get_split()[4]
+        if metric is None:
+            self.getCollectorPath()
+        return metric
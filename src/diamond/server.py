@@ -7,32 +7,40 @@ import signal
 import sys
 import time
 
-try:
-    from setproctitle import getproctitle, setproctitle
-except ImportError:
-    setproctitle = None
-
 # Path Fix
 sys.path.append(
     os.path.abspath(
         os.path.join(
             os.path.dirname(__file__), "../")))
 
+from diamond.utils.classes import get_handler_config
 from diamond.utils.classes import initialize_collector
-from diamond.utils.classes import load_collectors
+from diamond.utils.classes import load_collectors_from_manifest
 from diamond.utils.classes import load_dynamic_class
 from diamond.utils.classes import load_handlers
 from diamond.utils.classes import load_include_path
 
+from diamond.utils.config import get_collector_config
 from diamond.utils.config import load_config
+from diamond.utils.config import str_to_bool
 
 from diamond.utils.scheduler import collector_process
+from diamond.utils.scheduler import collector_worker_process
 from diamond.utils.scheduler import handler_process
 
+from diamond.utils.telemetry import create_telemetry
+from diamond.utils.telemetry import process_stats
+from diamond.utils.telemetry import telemetry_name
+
+from diamond.utils.transport import create_metric_queue
+
+from diamond.collector import get_hostname
+
 from diamond.handler.Handler import Handler
 
 from diamond.utils.signals import signal_to_exception
 from diamond.utils.signals import SIGHUPException
+from diamond.utils.signals import SIGUSR2Exception
 
 
 class Server(object):
@@ -49,16 +57,176 @@ class Server(object):
         self.handlers = []
         self.handler_queue = []
         self.modules = {}
+        self.collectors = {}
+        self.collector_control = {}
+        self.workers = []
+        self.manager = None
+        self.metric_queue = None
+        self.handler_process = None
+        self.telemetry = None
+        self.cpu_times = {}
+
+    def load_collectors(self):
+        """
+        Load the classes of the enabled collectors
+        """
+        names = set()
+        for collector, config in self.config['collectors'].iteritems():
+            if config.get('enabled', False) is not True:
+                continue
+            names.add(collector.split()[0])
+
+        return load_collectors_from_manifest(
+            self.config['server']['collectors_path'],
+            names,
+            self.config['server'].get('collectors_manifest'))
+
+    def get_handler_names(self, config):
+        """
+        Returns the handlers configured in the server section
+        """
+        # The config is shared, so work on a copy of the handler list
+        handlers = config['server'].get('handlers')
+        if isinstance(handlers, basestring):
+            handlers = [handlers]
+        else:
+            handlers = list(handlers)
+
+        # Prevent the Queue Handler from being a normal handler
+        if 'diamond.handler.queue.QueueHandler' in handlers:
+            handlers.remove('diamond.handler.queue.QueueHandler')
+
+        return handlers
 
-        # We do this weird process title swap around to get the sync manager
-        # title correct for ps
-        if setproctitle:
-            oldproctitle = getproctitle()
-            setproctitle('%s - SyncManager' % getproctitle())
-        self.manager = multiprocessing.Manager()
-        if setproctitle:
-            setproctitle(oldproctitle)
-        self.metric_queue = self.manager.Queue()
+    def send_to_worker(self, worker, message):
+        """
+        Send a control message to a running collector worker. Workers that
+        are not running pick up their collectors when they are started.
+        """
+        process = worker['process']
+        if process is None or not process.is_alive():
+            return
+        try:
+            worker['control'].send(message)
+        except (IOError, OSError):
+            self.log.error('Failed to send %s to %s, restarting it',
+                           message[0], worker['name'])
+            process.terminate()
+            worker['process'] = None
+
+    def reload(self, old_config):
+        """
+        Apply a changed config to the running collectors and handlers. Only
+        collectors and handlers whose own config changed are reloaded, the
+        others keep running undisturbed.
+        """
+        def changed(process_name):
+            """
+            Returns the new config of the collector if it changed, else None
+            """
+            config = get_collector_config(self.config, process_name)
+            # Disabled collectors are stopped by the main loop
+            if (str_to_bool(config.get('enabled', False)) and
+                    get_collector_config(old_config, process_name) != config):
+                return config
+            return None
+
+        # The collectors get their merged config from us instead of parsing
+        # the config files again
+        for process_name, process in self.collectors.iteritems():
+            config = changed(process_name)
+            if config is None:
+                continue
+            if not process.is_alive():
+                # The main loop starts it again
+                continue
+            self.log.info('Reloading collector %s', process_name)
+            try:
+                self.collector_control[process_name].send(('reload', config))
+                os.kill(process.pid, signal.SIGHUP)
+            except (IOError, OSError):
+                # It died, the main loop starts it again
+                self.log.error('Failed to reload %s', process_name)
+
+        for worker in self.workers:
+            for process_name, collector in worker['collectors'].iteritems():
+                config = changed(process_name)
+                if config is None:
+                    continue
+                self.log.info('Reloading collector %s', process_name)
+                # Keep our copy current for when the worker is restarted
+                collector.load_config(collector_config=config)
+                self.send_to_worker(worker, ('reload', process_name, config))
+
+        old_handlers = self.get_handler_names(old_config)
+        handlers = self.get_handler_names(self.config)
+        changed = []
+        for handler in handlers:
+            cls_name = handler.split('.')[-1]
+            if (get_handler_config(old_config, cls_name)
+                    != get_handler_config(self.config, cls_name)):
+                changed.append(cls_name)
+
+        # The handler process also applies the aggregations
+        if (changed or handlers != old_handlers or
+                old_config.get('aggregations') !=
+                self.config.get('aggregations')):
+            self.log.info('Reloading handlers')
+            handler_configs = {}
+            for handler in handlers:
+                cls_name = handler.split('.')[-1]
+                handler_configs[cls_name] = get_handler_config(self.config,
+                                                               cls_name)
+            aggregations = self.config.get('aggregations')
+            if aggregations is not None:
+                aggregations = aggregations.dict()
+            self.handler_control.send(
+                ('reload', handlers, changed, handler_configs, aggregations))
+
+    def get_child_pids(self):
+        """
+        Returns the pids of the handler and collector processes by name
+        """
+        processes = {}
+        if self.handler_process is not None:
+            processes['Handlers'] = self.handler_process.pid
+        for process_name, process in self.collectors.iteritems():
+            processes[process_name] = process.pid
+        for worker in self.workers:
+            if worker['process'] is not None:
+                processes[worker['name']] = worker['process'].pid
+        # Processes a signal kept from being started have no pid
+        return dict([(name, pid) for name, pid in processes.iteritems()
+                     if pid is not None])
+
+    def publish_telemetry(self):
+        """
+        Publish the memory and CPU use of the server and its children
+        """
+        processes = self.get_child_pids()
+        processes['Server'] = os.getpid()
+
+        now = time.time()
+        cpu_times = {}
+        for process_name, pid in processes.iteritems():
+            stats = process_stats(pid)
+            if stats is None:
+                continue
+            rss, cpu = stats
+            self.telemetry.gauge(
+                telemetry_name('processes', process_name, 'rss_bytes'), rss)
+
+            cpu_times[pid] = (now, cpu)
+            if pid in self.cpu_times:
+                then, last_cpu = self.cpu_times[pid]
+                self.telemetry.gauge(
+                    telemetry_name('processes', process_name, 'cpu_percent'),
+                    (cpu - last_cpu) * 100.0 / max(now - then, 1))
+        self.cpu_times = cpu_times
+
+        for metric in self.telemetry.collect():
+            self.handler_queue._process(metric)
+        self.handler_queue._flush()
 
     def run(self):
         """
@@ -70,12 +238,21 @@ class Server(object):
         ########################################################################
         self.config = load_config(self.configfile)
 
-        collectors = load_collectors(self.config['server']['collectors_path'])
+        self.telemetry = create_telemetry(
+            self.config,
+            get_hostname(get_collector_config(self.config, 'default')))
+
+        ########################################################################
+        # Metric Queue
+        ########################################################################
+
+        self.metric_queue, self.manager = create_metric_queue(
+            self.config['server'])
+
+        collectors = self.load_collectors()
 
         ########################################################################
         # Handlers
-        #
-        # TODO: Eventually move each handler to it's own process space?
         ########################################################################
 
         if 'handlers_path' in self.config['server']:
@@ -85,7 +262,6 @@ class Server(object):
             if isinstance(handlers_path, basestring):
                 handlers_path = handlers_path.split(',')
                 handlers_path = map(str.strip, handlers_path)
-                self.config['server']['handlers_path'] = handlers_path
 
             load_include_path(handlers_path)
 
@@ -93,15 +269,8 @@ class Server(object):
             self.log.critical('handlers missing from server section in config')
             sys.exit(1)
 
-        handlers = self.config['server'].get('handlers')
-        if isinstance(handlers, basestring):
-            handlers = [handlers]
-
-        # Prevent the Queue Handler from being a normal handler
-        if 'diamond.handler.queue.QueueHandler' in handlers:
-            handlers.remove('diamond.handler.queue.QueueHandler')
-
-        self.handlers = load_handlers(self.config, handlers)
+        self.handlers = load_handlers(self.config,
+                                      self.get_handler_names(self.config))
 
         QueueHandler = load_dynamic_class(
             'diamond.handler.queue.QueueHandler',
@@ -111,31 +280,49 @@ class Server(object):
         self.handler_queue = QueueHandler(
             config=self.config, queue=self.metric_queue, log=self.log)
 
+        control, self.handler_control = multiprocessing.Pipe(duplex=False)
+
         process = multiprocessing.Process(
             name="Handlers",
             target=handler_process,
-            args=(self.handlers, self.metric_queue, self.log),
+            args=(self.handlers, self.metric_queue, self.log, control,
+                  self.configfile),
         )
 
         process.daemon = True
         process.start()
+        control.close()
+        self.handler_process = process
 
         ########################################################################
         # Signals
         ########################################################################
 
         signal.signal(signal.SIGHUP, signal_to_exception)
+        signal.signal(signal.SIGUSR2, signal_to_exception)
+
+        ########################################################################
+        # Collector workers
+        #
+        # With collector_pool enabled, collectors share a fixed number of
+        # worker processes unless they ask for process_isolation
+        ########################################################################
+
+        if str_to_bool(self.config['server'].get('collector_pool', False)):
+            pool_size = int(self.config['server'].get(
+                'collector_pool_size', multiprocessing.cpu_count()))
+            for index in range(max(pool_size, 1)):
+                self.workers.append({
+                    'name': 'CollectorWorker-%d' % index,
+                    'process': None,
+                    'control': None,
+                    'collectors': {},
+                })
 
         ########################################################################
 
         while True:
             try:
-                active_children = multiprocessing.active_children()
-                running_processes = []
-                for process in active_children:
-                    running_processes.append(process.name)
-                running_processes = set(running_processes)
-
                 ##############################################################
                 # Collectors
                 ##############################################################
@@ -148,14 +335,26 @@ class Server(object):
                 running_collectors = set(running_collectors)
 
                 # Collectors that are running but shouldn't be
-                for process_name in running_processes - running_collectors:
-                    if 'Collector' not in process_name:
-                        continue
-                    for process in active_children:
-                        if process.name == process_name:
+                for process_name, process in self.collectors.items():
+                    if (process_name not in running_collectors
+                            or not process.is_alive()):
+                        if process.is_alive():
                             process.terminate()
+                        del self.collectors[process_name]
+                        self.collector_control.pop(process_name).close()
+
+                for worker in self.workers:
+                    for process_name in worker['collectors'].keys():
+                        if process_name not in running_collectors:
+                            del worker['collectors'][process_name]
+                            self.send_to_worker(
+                                worker, ('remove', process_name, None))
+
+                started_collectors = set(self.collectors)
+                for worker in self.workers:
+                    started_collectors.update(worker['collectors'])
 
-                for process_name in running_collectors - running_processes:
+                for process_name in running_collectors - started_collectors:
                     # To handle running multiple collectors concurrently, we
                     # split on white space and use the first word as the
                     # collector name to spin
@@ -185,16 +384,70 @@ class Server(object):
                                        process_name)
                         continue
 
-                    # Splay the loads
-                    time.sleep(1)
+                    if (self.workers
+                            and not collector.config['process_isolation']):
+                        # Hand it to the least loaded worker
+                        worker = min(self.workers,
+                                     key=lambda w: len(w['collectors']))
+                        worker['collectors'][process_name] = collector
+                        self.send_to_worker(worker,
+                                            ('add', process_name, None))
+                        continue
+
+                    control, self.collector_control[process_name] = (
+                        multiprocessing.Pipe(duplex=False))
 
                     process = multiprocessing.Process(
                         name=process_name,
                         target=collector_process,
-                        args=(collector, self.metric_queue, self.log)
+                        args=(collector, self.metric_queue, self.log, control)
                         )
                     process.daemon = True
+                    # Track it before starting it, a HUP or USR2 while it
+                    # starts would leave it running untracked and get a
+                    # second one started
+                    self.collectors[process_name] = process
                     process.start()
+                    control.close()
+
+                ##############################################################
+                # Collector workers
+                ##############################################################
+
+                for worker in self.workers:
+                    process = worker['process']
+                    if process is not None and process.is_alive():
+                        if not worker['collectors']:
+                            # Nothing left to run
+                            process.terminate()
+                            worker['process'] = None
+                        continue
+
+                    worker['process'] = None
+                    if not worker['collectors']:
+                        continue
+
+                    control, worker['control'] = multiprocessing.Pipe(
+                        duplex=False)
+
+                    process = multiprocessing.Process(
+                        name=worker['name'],
+                        target=collector_worker_process,
+                        args=(worker['collectors'], self.metric_queue,
+                              self.log, control, self.configfile,
+                              [self.handler_queue])
+                        )
+                    process.daemon = True
+                    worker['process'] = process
+                    process.start()
+                    control.close()
+
+                ##############################################################
+                # Telemetry
+                ##############################################################
+
+                if self.telemetry is not None and self.telemetry.due():
+                    self.publish_telemetry()
 
                 ##############################################################
 
@@ -202,6 +455,15 @@ class Server(object):
 
             except SIGHUPException:
                 self.log.info('Reloading state due to HUP')
+                old_config = self.config
                 self.config = load_config(self.configfile)
-                collectors = load_collectors(
-                    self.config['server']['collectors_path'])
+                collectors = self.load_collectors()
+                self.reload(old_config)
+
+            except SIGUSR2Exception:
+                self.log.info('Profiling the collectors and handlers')
+                for pid in self.get_child_pids().itervalues():
+                    try:
+                        os.kill(pid, signal.SIGUSR2)
+                    except OSError:
+                        pass
@@ -0,0 +1,111 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+from test import unittest
+
+import configobj
+
+from diamond.aggregator import AggregationRule
+from diamond.aggregator import Aggregator
+from diamond.aggregator import percentile
+from diamond.batch import MetricBatch
+from diamond.error import DiamondException
+from diamond.metric import Metric
+
+
+def cpu_metrics(host='host'):
+    metrics = []
+    for cpu in range(4):
+        for name, value in (('user', cpu * 10), ('idle', 100 - cpu * 10)):
+            metrics.append(Metric('servers.%s.cpu.cpu%d.%s' % (host, cpu, name),
+                                  value, timestamp=1234567, host=host,
+                                  metric_type='GAUGE', ttl=20))
+    return metrics
+
+
+class TestAggregator(unittest.TestCase):
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([7], 99), 7)
+
+    def test_functions(self):
+        rule = AggregationRule('cpu.all.user', 'cpu.cpu*.user',
+                               'sum, avg, min, max, count, p50')
+        aggregates = rule.aggregate('servers.host.', [
+            metric for metric in cpu_metrics() if 'user' in metric.path])
+
+        self.assertEqual([(metric.path, metric.value, metric.precision)
+                          for metric in aggregates], [
+            ('servers.host.cpu.all.user.sum', 60, 0),
+            ('servers.host.cpu.all.user.avg', 15.0, 2),
+            ('servers.host.cpu.all.user.min', 0, 0),
+            ('servers.host.cpu.all.user.max', 30, 0),
+            ('servers.host.cpu.all.user.count', 4, 0),
+            ('servers.host.cpu.all.user.p50', 10, 2),
+        ])
+        self.assertEqual(aggregates[0].host, 'host')
+        self.assertEqual(aggregates[0].timestamp, 1234567)
+        self.assertEqual(aggregates[0].ttl, 20)
+
+    def test_invalid_function(self):
+        self.assertRaises(DiamondException, AggregationRule,
+                          'a', 'a.*', 'median')
+        self.assertRaises(DiamondException, AggregationRule,
+                          'a', 'a.*', 'p101')
+        self.assertRaises(DiamondException, AggregationRule, 'a', 'a.*', '')
+
+    def test_process(self):
+        aggregator = Aggregator([
+            AggregationRule('cpu.all.user', 'cpu.cpu*.user', 'sum'),
+            AggregationRule('cpu.all.idle', 're:cpu\\.cpu\\d+\\.idle$', 'max',
+                            drop_inputs=True),
+        ])
+        metrics = cpu_metrics() + cpu_metrics('other')
+        result = aggregator.process(MetricBatch.from_metrics(metrics))
+
+        self.assertEqual(sorted([(metric.path, metric.value)
+                                 for metric in result
+                                 if 'all' in metric.path]), [
+            ('servers.host.cpu.all.idle.max', 100),
+            ('servers.host.cpu.all.user.sum', 60),
+            ('servers.other.cpu.all.idle.max', 100),
+            ('servers.other.cpu.all.user.sum', 60),
+        ])
+        # The idle series are dropped, the user series are kept
+        self.assertEqual(len(result), 8 + 4)
+        self.assertFalse([metric for metric in result
+                          if metric.path.endswith('.idle')])
+
+    def test_process_no_match(self):
+        aggregator = Aggregator([
+            AggregationRule('memory.all', 'memory.*', 'sum')])
+        metrics = cpu_metrics()
+        self.assertTrue(aggregator.process(metrics) is metrics)
+
+    def test_from_config(self):
+        config = configobj.ConfigObj()
+        self.assertEqual(Aggregator.from_config(config.get('aggregations')),
+                         None)
+
+        config['aggregations'] = {
+            'drop_inputs': 'True',
+            'cpu.all.user': {'match': 'cpu.cpu*.user'},
+            'cpu.all.idle': {'match': 'cpu.cpu*.idle',
+                             'functions': ['min', 'max'],
+                             'drop_inputs': 'False'},
+        }
+        aggregator = Aggregator.from_config(config['aggregations'])
+        rules = dict([(rule.name, rule) for rule in aggregator.rules])
+        self.assertEqual(rules['cpu.all.user'].functions, ['sum'])
+        self.assertTrue(rules['cpu.all.user'].drop_inputs)
+        self.assertEqual(rules['cpu.all.idle'].functions, ['min', 'max'])
+        self.assertFalse(rules['cpu.all.idle'].drop_inputs)
+
+        config['aggregations']['broken'] = {'functions': 'sum'}
+        self.assertRaises(DiamondException, Aggregator.from_config,
+                          config['aggregations'])
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle as pickle
+
+from test import unittest
+
+from diamond.batch import MetricBatch
+from diamond.metric import Metric
+
+
+def metric_attributes(metric):
+    return (metric.path, metric.value, type(metric.value), metric.raw_value,
+            metric.timestamp, metric.timestamp_ms, metric.precision,
+            metric.host, metric.metric_type, metric.ttl)
+
+
+class TestMetricBatch(unittest.TestCase):
+
+    def assertRoundTrip(self, metrics):
+        batch = pickle.loads(pickle.dumps(MetricBatch.from_metrics(metrics),
+                                          pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(len(batch), len(metrics))
+        self.assertEqual(map(metric_attributes, batch),
+                         map(metric_attributes, metrics))
+        return batch
+
+    def test_shared_attributes(self):
+        metrics = []
+        for cpu in range(4):
+            for name in ['user', 'system', 'idle']:
+                metrics.append(Metric('servers.host.cpu.cpu%d.%s' % (cpu, name),
+                                      cpu * 1.5, timestamp=1234567,
+                                      precision=2, host='host', ttl=600,
+                                      metric_type='GAUGE'))
+        batch = self.assertRoundTrip(metrics)
+
+        self.assertEqual(batch.prefix, 'servers.host.')
+        self.assertEqual(len(batch.names), 12)
+        self.assertEqual(sorted(batch.segments),
+                         ['cpu', 'cpu0', 'cpu1', 'cpu2', 'cpu3', 'idle',
+                          'system', 'user'])
+        self.assertEqual(batch.extra, {})
+
+    def test_mixed_values(self):
+        metrics = [
+            Metric('servers.host.a.int', 5, timestamp=1, host='host'),
+            Metric('servers.host.a.float', 5.0, timestamp=1, host='host'),
+            Metric('servers.host.a.counter', 2 ** 60, raw_value=12,
+                   timestamp=2, host='host', metric_type='COUNTER', ttl=60),
+            Metric('servers.host.a.raw', 7, raw_value=1, timestamp=2,
+                   host='host'),
+        ]
+        batch = self.assertRoundTrip(metrics)
+
+        # The counter does not share the ttl of the batch
+        self.assertEqual(batch.extra.keys(), [2])
+
+    def test_milliseconds(self):
+        metrics = [
+            Metric('servers.host.a.b', 1, timestamp=1, host='host'),
+            Metric('servers.host.a.c', 2, timestamp=1.25, host='host'),
+            Metric('servers.host.a.d', 3, timestamp=1.5, host='host'),
+        ]
+        self.assertRoundTrip(metrics)
+        self.assertRoundTrip(metrics[1:2] * 3)
+
+    def test_different_hosts(self):
+        metrics = [
+            Metric('servers.host1.a.b', 1, timestamp=1, host='host1'),
+            Metric('servers.host2.a.b', 2, timestamp=1, host='host2'),
+            Metric('a.b.c.d', 3, timestamp=1),
+        ]
+        self.assertRoundTrip(metrics)
+
+    def test_empty(self):
+        batch = MetricBatch.from_metrics([])
+        self.assertEqual(len(batch), 0)
+        self.assertEqual(list(pickle.loads(pickle.dumps(batch))), [])
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import os
+import shutil
+import sys
+import tempfile
+
+from test import unittest
+
+from diamond.utils import classes
+
+COLLECTOR_MODULE = '''
+from diamond.collector import Collector
+import this_module_does_not_exist
+
+
+class ManifestTestCollector(Collector):
+    pass
+'''
+
+
+class TestCollectorManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.path, 'manifesttest'))
+        self.module = os.path.join(self.path, 'manifesttest',
+                                   'manifesttest.py')
+        f = open(self.module, 'w')
+        f.write(COLLECTOR_MODULE)
+        f.close()
+
+    def tearDown(self):
+        classes._collector_manifest.pop(self.module, None)
+        for path in list(sys.path):
+            if path.startswith(self.path):
+                sys.path.remove(path)
+        shutil.rmtree(self.path)
+
+    def test_scan_does_not_import(self):
+        manifest = classes.get_collector_manifest([self.path])
+
+        self.assertEqual(manifest, {'ManifestTestCollector': ['manifesttest']})
+        self.assertFalse('manifesttest' in sys.modules)
+
+    def test_scan_is_cached_by_mtime(self):
+        classes.get_collector_manifest([self.path])
+        mtime, names = classes._collector_manifest[self.module]
+
+        classes._collector_manifest[self.module] = (mtime, ['Cached'])
+        manifest = classes.get_collector_manifest([self.path])
+        self.assertEqual(manifest, {'Cached': ['manifesttest']})
+
+        os.utime(self.module, (mtime + 10, mtime + 10))
+        manifest = classes.get_collector_manifest([self.path])
+        self.assertEqual(manifest, {'ManifestTestCollector': ['manifesttest']})
+
+    def test_manifest_file(self):
+        manifest_file = os.path.join(self.path, 'collectors.manifest')
+        classes.get_collector_manifest([self.path], manifest_file)
+        self.assertTrue(os.path.exists(manifest_file))
+
+        classes._collector_manifest.clear()
+        classes._read_collector_manifest(manifest_file)
+        self.assertEqual(classes._collector_manifest[self.module][1],
+                         ['ManifestTestCollector'])
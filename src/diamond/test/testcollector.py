@@ -3,13 +3,37 @@
 ################################################################################
 
 from test import unittest
+from mock import Mock
 import configobj
+import shutil
+import tempfile
+import time
 
 from diamond.collector import Collector
 
 
 class BaseCollectorTest(unittest.TestCase):
 
+    def get_collector(self, **collector_config):
+        config = configobj.ConfigObj()
+        config['server'] = {}
+        config['server']['collectors_config_path'] = ''
+        config['collectors'] = {}
+        config['collectors']['default'] = {
+            'hostname': 'host',
+            'interval': 10,
+        }
+        config['collectors']['Collector'] = collector_config
+        handler = Mock()
+        return Collector(config, [handler]), handler
+
+    def published(self, handler):
+        return [(metric.path, metric.value, metric.raw_value,
+                 metric.precision, metric.metric_type, metric.host,
+                 metric.ttl)
+                for metric in [call[0][0]
+                               for call in handler._process.call_args_list]]
+
     def test_SetCustomHostname(self):
         config = configobj.ConfigObj()
         config['server'] = {}
@@ -32,3 +56,104 @@ class BaseCollectorTest(unittest.TestCase):
         }
         c = Collector(config, [])
         self.assertEquals('custom.localhost', c.get_hostname())
+
+    def test_publish_many(self):
+        c, handler = self.get_collector()
+        c.publish('a.b', 1, precision=2)
+        c.publish('c', 2.5, raw_value=5, precision=2)
+        c.publish('d', 3, instance='vm1')
+        expected = self.published(handler)
+
+        c, handler = self.get_collector()
+        c.publish_many(['a.b', 'c'], [1, 2.5], raw_values=[None, 5],
+                       precision=2)
+        c.publish_many(['d'], [3], instance='vm1')
+        self.assertEqual(self.published(handler), expected)
+        self.assertEqual(expected[0][0], 'servers.host.Collector.a.b')
+
+    def test_publish_many_timestamp(self):
+        c, handler = self.get_collector()
+        c.publish('a', 1)
+        c.publish_many(['b'], [2])
+        metrics = [call[0][0] for call in handler._process.call_args_list]
+        self.assertEqual([type(metric.timestamp) for metric in metrics],
+                         [int, int])
+        self.assertEqual([metric.timestamp_ms for metric in metrics],
+                         [None, None])
+
+    def test_publish_many_filters(self):
+        c, handler = self.get_collector(metrics_whitelist='cpu')
+        c.publish_many(['cpu0', 'mem', 'cpu1'], [1, 2, 3],
+                       precision=[0, 1, 2])
+        self.assertEqual([(p[0], p[3]) for p in self.published(handler)],
+                         [('servers.host.Collector.cpu0', 0),
+                          ('servers.host.Collector.cpu1', 2)])
+
+    def test_publish_counters_many(self):
+        c, handler = self.get_collector()
+        for values in ([10, 100], [30, 50]):
+            c.publish_counter('a', values[0])
+            c.publish_counter('b', values[1], max_value=200)
+        expected = self.published(handler)
+
+        c, handler = self.get_collector()
+        for values in ([10, 100], [30, 50]):
+            c.publish_counters_many(iter(['a', 'b']), iter(values),
+                                    max_value=200)
+        self.assertEqual(self.published(handler), expected)
+        self.assertEqual([p[1] for p in expected], [0, 0, 2.0, 15.0])
+
+    def test_metric_path_cache(self):
+        c, handler = self.get_collector()
+        self.assertEqual(c.get_metric_path('a'), 'servers.host.Collector.a')
+        self.assertEqual(c.get_metric_path('a', instance='vm1'),
+                         'instances.vm1.Collector.a')
+
+        c.config['path_prefix'] = 'hosts'
+        c.config['path'] = '.'
+        c.process_config()
+        self.assertEqual(c.get_metric_path('a'), 'hosts.host.a')
+        self.assertEqual(c.get_metric_path('a', instance='vm1'),
+                         'instances.vm1.a')
+
+    def test_cycle_timestamp(self):
+        c, handler = self.get_collector()
+        c.collect = lambda: c.publish_many(['a', 'b'], [1, 2])
+        c._run(scheduled=time.time() - 1.5)
+        timestamps = [metric.timestamp_ms for metric in
+                      [call[0][0] for call in handler._process.call_args_list]]
+        self.assertEqual(len(set(timestamps)), 1)
+        self.assertEqual(c.timestamp, None)
+
+        self.assertEqual(c.get_cycle_timestamp(100.5, scheduled=100.0),
+                         100.5)
+        c.config['align_timestamps'] = True
+        self.assertEqual(c.get_cycle_timestamp(100.5, scheduled=100.0),
+                         100.0)
+        # A whole interval late
+        self.assertEqual(c.get_cycle_timestamp(110.5, scheduled=100.0),
+                         110.5)
+
+    def test_counters_survive_restart(self):
+        directory = tempfile.mkdtemp()
+        try:
+            now = time.time()
+            c, handler = self.get_collector(counters_state_dir=directory)
+            c.counters.tick(now - 10)
+            c.publish_counter('a', 10)
+            c.save_counters()
+
+            c, handler = self.get_collector(counters_state_dir=directory)
+            c.counters.tick(now)
+            c.publish_counter('a', 30)
+            self.assertEqual(self.published(handler)[0][1], 2.0)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_reload_with_collector_config(self):
+        c, handler = self.get_collector()
+        c.configfile = '/nonexistent/diamond.conf'
+        c.load_config(collector_config=configobj.ConfigObj(
+            {'hostname': 'other', 'interval': 20}))
+        self.assertEqual(c.config['hostname'], 'other')
+        self.assertEqual(c.config['interval'], 20)
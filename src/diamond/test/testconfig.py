@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import os
+import shutil
+import tempfile
+
+from test import unittest
+from mock import patch
+
+from diamond.utils.classes import get_handler_config
+from diamond.utils.config import _parse_config
+from diamond.utils.config import get_collector_config
+from diamond.utils.config import load_config
+
+CONFIG = '''
+[server]
+collectors_config_path = %s
+
+[handlers]
+[[default]]
+hosts = a, b
+
+[formatter_default]
+format = [%%(asctime)s] %%(message)s
+
+[collectors]
+[[default]]
+interval = 10
+
+[[CPUCollector]]
+enabled = True
+'''
+
+
+class TestLoadConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.collectors_path = os.path.join(self.path, 'collectors')
+        os.mkdir(self.collectors_path)
+        self.configfile = os.path.join(self.path, 'diamond.conf')
+        self.write(self.configfile, CONFIG % self.collectors_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, path, content):
+        f = open(path, 'w')
+        f.write(content)
+        f.close()
+
+    def touch(self, path, offset):
+        mtime = os.stat(path).st_mtime + offset
+        os.utime(path, (mtime, mtime))
+
+    def test_parsed_once(self):
+        with patch('diamond.utils.config._parse_config',
+                   side_effect=_parse_config) as parse:
+            load_config(self.configfile)
+            load_config(self.configfile)
+        self.assertEqual(parse.call_count, 1)
+
+    def test_copied(self):
+        config = load_config(self.configfile)
+        config['collectors']['CPUCollector']['enabled'] = False
+        config['handlers']['default']['hosts'].append('c')
+
+        config = load_config(self.configfile)
+        self.assertEqual(config['collectors']['CPUCollector']['enabled'],
+                         True)
+        self.assertEqual(config['handlers']['default']['hosts'], ['a', 'b'])
+        self.assertEqual(dict.__getitem__(config['formatter_default'],
+                                          'format'),
+                         '[%(asctime)s] %(message)s')
+
+    def test_reparsed_on_change(self):
+        config = load_config(self.configfile)
+
+        self.write(os.path.join(self.collectors_path, 'MemoryCollector.conf'),
+                   'enabled = True\n')
+        self.touch(self.collectors_path, 10)
+
+        config = load_config(self.configfile)
+        self.assertEqual(config['collectors']['MemoryCollector']['enabled'],
+                         True)
+
+        self.write(os.path.join(self.collectors_path, 'MemoryCollector.conf'),
+                   'enabled = False\n')
+        self.touch(os.path.join(self.collectors_path, 'MemoryCollector.conf'),
+                   10)
+
+        config = load_config(self.configfile)
+        self.assertEqual(config['collectors']['MemoryCollector']['enabled'],
+                         False)
+
+    def test_collector_config(self):
+        config = load_config(self.configfile)
+        config['collectors']['CPUCollector']['hosts'] = ['a', 'b']
+
+        collector_config = get_collector_config(config, 'CPUCollector')
+        self.assertEqual(collector_config['interval'], '10')
+        self.assertEqual(collector_config['enabled'], True)
+
+        collector_config['hosts'].append('c')
+        self.assertEqual(config['collectors']['CPUCollector']['hosts'],
+                         ['a', 'b'])
+
+    def test_handler_config(self):
+        config = load_config(self.configfile)
+
+        handler_config = get_handler_config(config, 'GraphiteHandler')
+        self.assertEqual(handler_config['hosts'], ['a', 'b'])
+
+        handler_config['hosts'].append('c')
+        self.assertEqual(config['handlers']['default']['hosts'], ['a', 'b'])
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import os
+import shutil
+import tempfile
+import time
+
+from test import unittest
+
+from diamond import counters
+from diamond.counters import CounterStore
+
+
+class CounterStoreTests(object):
+
+    use_numpy = False
+
+    def setUp(self):
+        if self.use_numpy and counters.numpy is None:
+            self.skipTest('numpy is not installed')
+        self.store = CounterStore(use_numpy=self.use_numpy)
+
+    def test_rate(self):
+        self.assertEqual(self.store.rate('a', 10, interval=10), 0)
+        self.assertEqual(self.store.rate('a', 30, interval=10), 2.0)
+        self.assertEqual(self.store.get('a'), 30)
+        self.assertEqual(len(self.store), 1)
+
+    def test_rate_rollover(self):
+        self.store.rate('a', 250, max_value=256)
+        self.assertEqual(self.store.rate('a', 4, max_value=256), 10.0)
+
+    def test_rate_large(self):
+        # Beyond 2 ** 53 and wrapping at 2 ** 64 - 1, like a 64 bit counter
+        max_value = 2 ** 64 - 1
+        self.store.rate('a', 2 ** 60 + 1, max_value=max_value)
+        self.assertEqual(self.store.rate('a', 2 ** 60 + 4,
+                                         max_value=max_value), 3.0)
+        self.assertEqual(self.store.get('a'), 2 ** 60 + 4)
+        self.store.rate('a', max_value - 2, max_value=max_value)
+        self.assertEqual(self.store.rate('a', 7, max_value=max_value), 9.0)
+
+    def test_rates_large(self):
+        max_value = 2 ** 64 - 1
+        self.store.rates(['a', 'b', 'c'], [2 ** 60 + 1, max_value - 2, 1],
+                         interval=2, max_value=max_value)
+        self.assertEqual(self.store.rates(['a', 'b', 'c'],
+                                          [2 ** 60 + 5, 7, 5],
+                                          interval=2, max_value=max_value),
+                         [2.0, 4.5, 2.0])
+
+    def test_rate_negative(self):
+        self.store.rate('a', 10)
+        self.assertEqual(self.store.rate('a', 4), 0)
+        self.assertEqual(self.store.rate('a', 2, allow_negative=True), -2.0)
+
+    def test_rate_timestamps(self):
+        self.store.rate('a', 10, timestamp=100)
+        self.assertEqual(self.store.rate('a', 40, timestamp=115), 2.0)
+        # No time passed
+        self.assertEqual(self.store.rate('a', 50, timestamp=115), 0)
+
+    def test_rates(self):
+        self.assertEqual(self.store.rates(['a', 'b'], [10, 250], interval=2,
+                                          max_value=256),
+                         [0, 0])
+        self.assertEqual(self.store.rates(['a', 'b', 'c'], [14, 6, 1],
+                                          interval=2, max_value=256),
+                         [2.0, 6.0, 0])
+        self.assertEqual(self.store.rates(['a', 'b'], [10, 8], interval=2,
+                                          allow_negative=True),
+                         [-2.0, 1.0])
+        self.assertEqual(self.store.rates(['a', 'b'], [10, 7], interval=2),
+                         [0, 0])
+
+    def test_rates_timestamps(self):
+        self.store.rates(['a', 'b'], [0, 0], timestamps=[100, 100])
+        self.assertEqual(self.store.rates(['a', 'b'], [10, 10],
+                                          timestamps=[105, 110]),
+                         [2.0, 1.0])
+        self.assertEqual(self.store.rates(iter(['a', 'b']), iter([20, 20]),
+                                          timestamps=120),
+                         [0.66666666666666663, 1.0])
+
+    def test_rates_match_rate(self):
+        scalar = CounterStore(use_numpy=False)
+        keys = ['k%d' % i for i in range(200)]
+        for cycle in range(3):
+            values = [(i * 7 + cycle * i * 3) % 256 for i in range(200)]
+            expected = [scalar.rate(key, value, max_value=256, interval=3)
+                        for key, value in zip(keys, values)]
+            self.assertEqual(self.store.rates(keys, values, max_value=256,
+                                              interval=3),
+                             expected)
+        self.assertEqual(len(self.store), 200)
+
+    def test_rates_repeated_keys(self):
+        self.assertEqual(self.store.rates(['a', 'b', 'a'], [1, 2, 3]),
+                         [0, 0, 0])
+        self.assertEqual(len(self.store.keys), 2)
+        # Rates against the sample before the call, the last value is kept
+        self.assertEqual(self.store.rates(['a', 'b', 'a'], [5, 6, 9]),
+                         [2.0, 4.0, 6.0])
+        self.assertEqual(self.store.get('a'), 9)
+
+        self.store.tick()
+        self.store.rate('b', 7)
+        self.store.tick()
+        self.assertEqual(self.store.expire(1), 1)
+        self.assertEqual(sorted(self.store.slots), ['b'])
+        self.assertEqual(self.store.rates(['a', 'a'], [1, 2]), [0, 0])
+
+    def test_expire(self):
+        self.store.rates(['a', 'b'], [1, 1])
+        self.store.tick()
+        self.store.rate('a', 2)
+        self.store.tick()
+        self.assertEqual(self.store.expire(1), 1)
+        self.assertEqual(sorted(self.store.slots), ['a'])
+        self.assertEqual(self.store.evicted, 1)
+
+        # A forgotten counter starts over, reusing the free slot
+        self.assertEqual(self.store.rates(['b', 'a'], [5, 5]), [0, 3.0])
+        self.assertEqual(len(self.store.keys), 2)
+
+    def test_max_size(self):
+        self.store.max_size = 40
+        for cycle in range(40):
+            self.store.tick()
+            self.store.rate('k%d' % cycle, cycle)
+        self.store.rate('k0', 1)
+        self.store.tick()
+        # Evicts the two least recently seen, k1 and k2
+        self.store.rate('new', 1)
+        self.assertEqual(len(self.store), 39)
+        self.assertTrue('k0' in self.store)
+        self.assertFalse('k1' in self.store)
+        self.assertFalse('k2' in self.store)
+        self.assertTrue('k3' in self.store)
+
+    def test_max_size_keeps_batch(self):
+        self.store.max_size = 10
+        keys = ['k%d' % i for i in range(15)]
+        self.store.rates(keys, range(15))
+        # Nothing seen in the current cycle can be evicted
+        self.assertEqual(len(self.store), 15)
+        self.assertEqual(self.store.rates(keys, range(1, 16)), [1.0] * 15)
+
+        self.store.tick()
+        self.store.rates(['a', 'b'], [1, 1])
+        self.assertEqual(len(self.store), 10)
+
+    def test_save_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'counters')
+            now = time.time()
+            self.store.tick(now - 20)
+            self.store.rates(['a', 'b', 'c'], [10, 20, 30])
+            self.store.tick(now - 10)
+            self.store.rates(['a', 'b'], [20, 30])
+            self.store.save(path)
+
+            store = CounterStore(use_numpy=self.use_numpy)
+            store.period = 10
+            self.assertEqual(store.load(path, max_age=15), 2)
+            self.assertEqual(sorted(store.slots), ['a', 'b'])
+            self.assertEqual(store.get('a'), 20)
+
+            # 30 seconds since the saved sample at a 10 second interval
+            store.tick(now + 20)
+            self.assertEqual(store.rate('a', 80, interval=10), 2.0)
+            self.assertEqual(store.rates(['b'], [90], interval=10), [2.0])
+            store.tick(now + 30)
+            self.assertEqual(store.rates(['a', 'b'], [90, 100], interval=10),
+                             [1.0, 1.0])
+            self.assertFalse(store.restored)
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestCounterStore(CounterStoreTests, unittest.TestCase):
+    use_numpy = False
+
+
+class TestNumpyCounterStore(CounterStoreTests, unittest.TestCase):
+    use_numpy = True
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+from test import unittest
+from mock import Mock
+
+import configobj
+
+from diamond.collector import Collector
+from diamond.dedup import ChangeFilter
+from diamond.handler.Handler import Handler
+from diamond.metric import Metric
+
+
+class TestChangeFilter(unittest.TestCase):
+
+    def test_suppresses_unchanged(self):
+        change_filter = ChangeFilter(heartbeat=3)
+        passed = [change_filter.accept('a', value)
+                  for value in [1, 1, 1, 1, 2, 2, 1]]
+        self.assertEqual(passed, [True, False, False, True, True, False,
+                                  True])
+        self.assertEqual(change_filter.suppressed, 3)
+
+    def test_paths_are_separate(self):
+        change_filter = ChangeFilter()
+        self.assertTrue(change_filter.accept('a', 1))
+        self.assertTrue(change_filter.accept('b', 1))
+        self.assertFalse(change_filter.accept('a', 1))
+
+    def test_evicted_paths_pass(self):
+        change_filter = ChangeFilter(cache_size=2)
+        change_filter.accept('a', 1)
+        change_filter.accept('b', 1)
+        change_filter.accept('c', 1)
+        self.assertTrue(change_filter.accept('a', 1))
+
+    def test_from_config(self):
+        self.assertEqual(ChangeFilter.from_config(), None)
+        self.assertEqual(ChangeFilter.from_config('False', '5'), None)
+        self.assertEqual(ChangeFilter.from_config('True', '5').heartbeat, 5)
+        self.assertEqual(ChangeFilter.from_config('True').heartbeat, 10)
+
+
+class TestDedup(unittest.TestCase):
+
+    def test_collector(self):
+        config = configobj.ConfigObj()
+        config['server'] = {}
+        config['server']['collectors_config_path'] = ''
+        config['collectors'] = {}
+        config['collectors']['default'] = {'hostname': 'host'}
+        config['collectors']['Collector'] = {'dedup': 'True',
+                                             'dedup_heartbeat': '2'}
+        handler = Mock()
+        collector = Collector(config, [handler])
+
+        for value in [5, 5, 5, 6]:
+            collector.publish('a', value)
+        self.assertEqual([call[0][0].value
+                          for call in handler._process.call_args_list],
+                         [5, 5, 6])
+        self.assertEqual(collector.metrics_published, 3)
+
+    def test_handler(self):
+        handler = Handler(configobj.ConfigObj({'dedup': 'True'}))
+        handler.process = Mock()
+
+        for value in [1, 1, 2]:
+            handler._process(Metric('servers.host.cpu.total.idle', value))
+
+        self.assertEqual([call[0][0].value
+                          for call in handler.process.call_args_list],
+                         [1, 2])
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import time
+
+from test import unittest
+from mock import Mock
+
+import configobj
+
+from diamond.handler.Handler import Handler
+from diamond.utils.dispatch import BoundedQueue
+from diamond.utils.dispatch import HandlerThread
+
+
+class TestBoundedQueue(unittest.TestCase):
+
+    def test_get_in_order(self):
+        queue = BoundedQueue(10)
+        queue.put([1, 2])
+        queue.put([3])
+
+        self.assertEqual(queue.qsize(), 3)
+        self.assertEqual(queue.get(), [1, 2])
+        self.assertEqual(queue.get(), [3])
+        self.assertEqual(queue.get(timeout=0.01), None)
+
+    def test_drop_oldest(self):
+        queue = BoundedQueue(5, 'drop_oldest')
+        self.assertEqual(queue.put([1, 2]), 0)
+        self.assertEqual(queue.put([3, 4]), 0)
+        self.assertEqual(queue.put([5, 6, 7]), 2)
+
+        self.assertEqual(queue.dropped, 2)
+        self.assertEqual(queue.get(), [3, 4])
+        self.assertEqual(queue.get(), [5, 6, 7])
+
+    def test_drop_newest(self):
+        queue = BoundedQueue(5, 'drop_newest')
+        self.assertEqual(queue.put([1, 2]), 0)
+        self.assertEqual(queue.put([3, 4]), 0)
+        self.assertEqual(queue.put([5, 6, 7]), 3)
+
+        self.assertEqual(queue.dropped, 3)
+        self.assertEqual(queue.get(), [1, 2])
+        self.assertEqual(queue.get(), [3, 4])
+
+    def test_unknown_policy(self):
+        self.assertRaises(NotImplementedError, BoundedQueue, 5, 'drop_all')
+
+
+class TestHandlerThread(unittest.TestCase):
+
+    def test_processes_and_flushes(self):
+        handler = Handler(configobj.ConfigObj())
+        handler.process = Mock()
+        handler.flush = Mock()
+
+        thread = HandlerThread(handler)
+        thread.start()
+        thread.put(['metric1', 'metric2'])
+
+        for i in range(100):
+            if handler.flush.call_count:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(handler.process.call_count, 2)
+        self.assertEqual(handler.flush.call_count, 1)
+
+    def test_take_over(self):
+        old = HandlerThread(Handler(configobj.ConfigObj()))
+        old.put(['metric1'])
+        old.put(['metric2', 'metric3'])
+
+        handler = Handler(configobj.ConfigObj())
+        handler.process = Mock()
+        thread = HandlerThread(handler)
+        thread.take_over(old)
+
+        self.assertEqual(old.queue.qsize(), 0)
+        self.assertEqual(thread.queue.qsize(), 3)
+
+        thread.start()
+        for i in range(100):
+            if handler.process.call_count == 3:
+                break
+            time.sleep(0.01)
+
+        thread.stop()
+        self.assertFalse(thread.isAlive())
+        self.assertEqual(handler.process.call_count, 3)
+
+    def test_stop_drains(self):
+        handler = Handler(configobj.ConfigObj())
+        handler.process = Mock()
+        handler.flush = Mock()
+        thread = HandlerThread(handler)
+        thread.put(['metric1'])
+        thread.put(['metric2', 'metric3'])
+
+        thread.running = False
+        thread.start()
+        thread.join()
+        # Without drain the batches are left for the next thread
+        self.assertEqual(handler.process.call_count, 0)
+        self.assertEqual(thread.queue.qsize(), 3)
+
+        thread = HandlerThread(handler)
+        thread.put(['metric1'])
+        thread.put(['metric2', 'metric3'])
+        thread.start()
+        thread.stop(drain=True)
+        self.assertEqual(handler.process.call_count, 3)
+        self.assertEqual(thread.queue.qsize(), 0)
+        self.assertTrue(handler.flush.called)
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+from test import unittest
+from mock import Mock
+
+import configobj
+
+from diamond.error import DiamondException
+from diamond.filter import MetricFilter
+from diamond.handler.Handler import Handler
+from diamond.metric import Metric
+
+
+class TestMetricFilter(unittest.TestCase):
+
+    def test_first_match_wins(self):
+        metric_filter = MetricFilter(['exclude cpu.total.*',
+                                      'include cpu.*',
+                                      'include re:memory\\.(free|used)'])
+
+        self.assertFalse(metric_filter.accept('cpu.total.idle'))
+        self.assertTrue(metric_filter.accept('cpu.cpu0.idle'))
+        self.assertTrue(metric_filter.accept('memory.free'))
+        # Not included by any rule
+        self.assertFalse(metric_filter.accept('memory.cached'))
+
+    def test_exclude_only(self):
+        metric_filter = MetricFilter(['exclude *.idle'])
+        self.assertFalse(metric_filter.accept('cpu.idle'))
+        self.assertTrue(metric_filter.accept('cpu.user'))
+
+    def test_glob_matches_whole_name(self):
+        metric_filter = MetricFilter(['include glob:cpu'])
+        self.assertTrue(metric_filter.accept('cpu'))
+        self.assertFalse(metric_filter.accept('cpu.user'))
+
+    def test_decisions_are_cached(self):
+        metric_filter = MetricFilter(['exclude cpu.*'])
+        self.assertFalse(metric_filter.accept('cpu.user'))
+
+        metric_filter.rules = []
+        self.assertFalse(metric_filter.accept('cpu.user'))
+        self.assertTrue(metric_filter.accept('cpu.idle'))
+
+    def test_from_config(self):
+        self.assertEqual(MetricFilter.from_config(None, None, None), None)
+
+        metric_filter = MetricFilter.from_config(None, whitelist='cpu')
+        self.assertTrue(metric_filter.accept('cpu.user'))
+        self.assertFalse(metric_filter.accept('memory.free'))
+
+        metric_filter = MetricFilter.from_config('include cpu.*',
+                                                 blacklist='cpu')
+        self.assertTrue(metric_filter.accept('cpu.user'))
+        self.assertFalse(metric_filter.accept('cpu'))
+        # The include rule rejects everything else
+        self.assertFalse(metric_filter.accept('memory'))
+
+    def test_invalid_rules(self):
+        self.assertRaises(DiamondException, MetricFilter, ['include'])
+        self.assertRaises(DiamondException, MetricFilter, ['keep cpu.*'])
+        self.assertRaises(DiamondException, MetricFilter, ['include re:('])
+
+
+class TestHandlerFilter(unittest.TestCase):
+
+    def test_handler_filters_paths(self):
+        handler = Handler(configobj.ConfigObj(
+            {'metrics_filter': ['exclude servers.*.cpu.*.idle']}))
+        handler.process = Mock()
+
+        handler._process(Metric('servers.host.cpu.total.idle', 1))
+        handler._process(Metric('servers.host.cpu.total.user', 1))
+
+        self.assertEqual(handler.process.call_count, 1)
+        self.assertEqual(handler.process.call_args[0][0].path,
+                         'servers.host.cpu.total.user')
@@ -0,0 +1,44 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+from test import unittest
+
+from diamond.utils.lru import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_get_set(self):
+        cache = LRUCache(4)
+        cache['a'] = 1
+        self.assertEqual(cache['a'], 1)
+        self.assertEqual(cache.get('b'), None)
+        self.assertRaises(KeyError, cache.__getitem__, 'b')
+        self.assertTrue('a' in cache)
+
+        del cache['a']
+        self.assertFalse('a' in cache)
+        self.assertEqual(len(cache), 0)
+
+    def test_bounded(self):
+        cache = LRUCache(10)
+        for i in range(100):
+            cache[i] = i
+            self.assertTrue(len(cache) <= 10)
+        self.assertTrue(99 in cache)
+        self.assertFalse(0 in cache)
+
+    def test_keeps_recently_used(self):
+        cache = LRUCache(4)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache['c'] = 3
+        # 'a' and 'b' are old now, using 'a' keeps it around
+        self.assertEqual(cache['a'], 1)
+        cache['d'] = 4
+        cache['e'] = 5
+
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertEqual(len(cache), 4)
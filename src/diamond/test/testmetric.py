@@ -2,6 +2,11 @@
 # coding=utf-8
 ################################################################################
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle as pickle
+
 from test import unittest
 
 from diamond.metric import Metric
@@ -84,6 +89,58 @@ class TestMetric(unittest.TestCase):
         message = 'Actual %s, expected %s' % (actual_value, expected_value)
         self.assertEqual(actual_value, expected_value, message)
 
+    def testPathSplitFollowsChanges(self):
+        metric = Metric('servers.host.cpu.total.idle', 0, host='host')
+        self.assertEqual(metric.getMetricPath(), 'total.idle')
+
+        metric.path = 'servers.host.memory.free'
+        self.assertEqual(metric.getCollectorPath(), 'memory')
+        self.assertEqual(metric.getMetricPath(), 'free')
+
+        metric.host = None
+        metric.path = 'a.b.c.d.e'
+        self.assertEqual(metric.getPathPrefix(), 'a')
+        self.assertEqual(metric.getCollectorPath(), 'c')
+        self.assertEqual(metric.getMetricPath(), 'd.e')
+
+    def testPathSplitWithoutCollector(self):
+        metric = Metric('servers.host', 0, host='host')
+        self.assertEqual(metric.getPathPrefix(), 'servers')
+        self.assertRaises(ValueError, metric.getCollectorPath)
+        self.assertRaises(ValueError, metric.getMetricPath)
+
+        metric = Metric('servers.host', 0)
+        self.assertRaises(IndexError, metric.getCollectorPath)
+        self.assertEqual(metric.getMetricPath(), '')
+
+    def testPickle(self):
+        metric = Metric('servers.host.cpu.total.idle', 1.5, raw_value=3,
+                        timestamp=10, precision=2, host='host',
+                        metric_type='GAUGE', ttl=120)
+        metric.getMetricPath()
+
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(metric, protocol))
+            self.assertEqual(copy.__getstate__(), metric.__getstate__())
+            self.assertEqual(copy.getCollectorPath(), 'cpu')
+
+    def testTimestampMilliseconds(self):
+        metric = Metric('servers.host.cpu.total.idle', 0, timestamp=12.3456)
+        self.assertEqual(metric.timestamp, 12)
+        self.assertEqual(metric.get_timestamp_ms(), 12345)
+        self.assertEqual(str(metric), 'servers.host.cpu.total.idle 0 12\n')
+
+        metric.timestamp = 13
+        self.assertEqual(metric.get_timestamp_ms(), 13000)
+
+        metric = Metric('servers.host.cpu.total.idle', 0, timestamp=12)
+        self.assertEqual(metric.timestamp_ms, None)
+        self.assertEqual(metric.get_timestamp_ms(), 12000)
+
+    def testNoDict(self):
+        metric = Metric('servers.host.cpu.total.idle', 0)
+        self.assertFalse(hasattr(metric, '__dict__'))
+
     def test_parse(self):
         metric = Metric('test.parse', 0)
 
@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+#
+# Compares Metric with the implementation before it got __slots__ and cached
+# the split of its path. Skipped unless DIAMOND_BENCHMARK is set:
+#
+#   DIAMOND_BENCHMARK=1 PYTHONPATH=.:src:src/diamond/test \
+#       python -m unittest testmetricbenchmark
+#
+################################################################################
+
+import os
+import sys
+import time
+
+from test import unittest
+
+from diamond.error import DiamondException
+from diamond.metric import Metric
+
+COUNT = 100000
+
+
+class LegacyMetric(object):
+    """
+    Metric as it was, a plain object that splits its path on every call
+    """
+
+    _METRIC_TYPES = ['COUNTER', 'GAUGE']
+
+    def __init__(self, path, value, raw_value=None, timestamp=None, precision=0,
+                 host=None, metric_type='COUNTER', ttl=None):
+        if (None in [path, value] or metric_type not in self._METRIC_TYPES):
+            raise DiamondException(("Invalid parameter when creating new "
+                                    "Metric with path: %r value: %r "
+                                    "metric_type: %r")
+                                   % (path, value, metric_type))
+
+        if timestamp is None:
+            timestamp = int(time.time())
+        else:
+            if not isinstance(timestamp, int):
+                try:
+                    timestamp = int(timestamp)
+                except ValueError, e:
+                    raise DiamondException(("Invalid timestamp when "
+                                            "creating new Metric %r: %s")
+                                           % (path, e))
+
+        if not isinstance(value, (int, float)):
+            try:
+                if precision == 0:
+                    value = round(float(value))
+                else:
+                    value = float(value)
+            except ValueError, e:
+                raise DiamondException(("Invalid value when creating new "
+                                        "Metric %r: %s") % (path, e))
+
+        self.path = path
+        self.value = value
+        self.raw_value = raw_value
+        self.timestamp = timestamp
+        self.precision = precision
+        self.host = host
+        self.metric_type = metric_type
+        self.ttl = ttl
+
+    def getPathPrefix(self):
+        if self.host is None:
+            return self.path.split('.')[0]
+
+        offset = self.path.index(self.host) - 1
+        return self.path[0:offset]
+
+    def getCollectorPath(self):
+        if self.host is None:
+            return self.path.split('.')[2]
+
+        offset = self.path.index(self.host)
+        offset += len(self.host) + 1
+        endoffset = self.path.index('.', offset)
+        return self.path[offset:endoffset]
+
+    def getMetricPath(self):
+        if self.host is None:
+            path = self.path.split('.')[3:]
+            return '.'.join(path)
+
+        prefix = '.'.join([self.getPathPrefix(), self.host,
+                           self.getCollectorPath()])
+
+        offset = len(prefix) + 1
+        return self.path[offset:]
+
+
+def instance_size(metric):
+    size = sys.getsizeof(metric)
+    if hasattr(metric, '__dict__'):
+        size += sys.getsizeof(metric.__dict__)
+    return size
+
+
+def split(metrics):
+    for metric in metrics:
+        metric.getPathPrefix()
+        metric.getCollectorPath()
+        metric.getMetricPath()
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def construct(cls):
+    return [cls('servers.host%d.cpu.cpu%d.user' % (i % 100, i % 8), i,
+                timestamp=1, host='host%d' % (i % 100))
+            for i in xrange(COUNT)]
+
+
+@unittest.skipUnless(os.environ.get('DIAMOND_BENCHMARK'),
+                     'set DIAMOND_BENCHMARK to run the benchmarks')
+class TestMetricBenchmark(unittest.TestCase):
+
+    def test_benchmark(self):
+        rows = []
+        results = {}
+        for cls in (LegacyMetric, Metric):
+            construct_time, metrics = timed(construct, cls)
+            first_time, _ = timed(split, metrics)
+            repeat_time, _ = timed(split, metrics)
+            results[cls] = metrics
+            rows.append((cls.__name__, instance_size(metrics[0]),
+                         construct_time, first_time, repeat_time))
+
+        sys.stderr.write('\n%-14s %8s %12s %12s %12s\n' % (
+            '', 'bytes', 'construct', 'first split', 'repeat split'))
+        for row in rows:
+            sys.stderr.write('%-14s %8d %11.3fs %11.3fs %11.3fs\n' % row)
+
+        # Both split the paths the same way
+        for old, new in zip(results[LegacyMetric][:1000],
+                            results[Metric][:1000]):
+            self.assertEqual(
+                (old.getPathPrefix(), old.getCollectorPath(),
+                 old.getMetricPath()),
+                (new.getPathPrefix(), new.getCollectorPath(),
+                 new.getMetricPath()))
+        self.assertTrue(rows[1][1] < rows[0][1])
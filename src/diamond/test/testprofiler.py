@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import os
+import pstats
+import shutil
+import tempfile
+
+from test import unittest
+
+from diamond.utils.profiler import CollectorProfiler
+from diamond.utils.profiler import StackSampler
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.config = {'profile_dir': os.path.join(self.path, 'profiles'),
+                       'profile_cycles': '2',
+                       'profile_seconds': '0.05'}
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def profiles(self):
+        if not os.path.isdir(self.config['profile_dir']):
+            return []
+        return [os.path.join(self.config['profile_dir'], name)
+                for name in os.listdir(self.config['profile_dir'])]
+
+    def test_collector_runs(self):
+        profiler = CollectorProfiler(self.config)
+        calls = []
+
+        self.assertEqual(profiler.run('CPUCollector', calls.append, 1), None)
+        self.assertEqual(self.profiles(), [])
+
+        profiler.request(['CPUCollector'])
+        profiler.run('CPUCollector', calls.append, 2)
+        profiler.run('MemoryCollector', calls.append, 3)
+        self.assertEqual(self.profiles(), [])
+
+        profiler.run('CPUCollector', calls.append, 4)
+        self.assertEqual(calls, [1, 2, 3, 4])
+
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(os.path.basename(profiles[0]).startswith(
+            'CPUCollector.'))
+        stats = pstats.Stats(profiles[0]).stats
+        appends = [stat[1] for func, stat in stats.iteritems()
+                   if 'append' in func[2]]
+        self.assertEqual(appends, [2])
+
+    def test_stack_sampler(self):
+        sampler = StackSampler('Handlers', self.config)
+        sampler.request()
+        sampler.thread.join(5)
+
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].endswith('.collapsed'))
+
+        f = open(profiles[0])
+        lines = f.readlines()
+        f.close()
+        threads = set()
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            threads.add(stack.split(';')[0])
+            self.assertTrue(int(count) > 0)
+        self.assertTrue('MainThread' in threads)
+        self.assertFalse('StackSampler' in threads)
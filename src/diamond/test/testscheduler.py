@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import signal
+import threading
+
+from test import unittest
+from mock import Mock
+from mock import patch
+
+import configobj
+
+from diamond.handler.Handler import Handler
+from diamond.utils.scheduler import get_splay
+from diamond.utils.dispatch import HandlerThread
+from diamond.utils.scheduler import _reload_handlers
+from diamond.utils.scheduler import handler_process
+from diamond.utils.scheduler import next_tick
+from diamond.utils.scheduler import sleep_until
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_next_tick_aligned(self):
+        self.assertEqual(next_tick(60, 0, 1000), 1020)
+        self.assertEqual(next_tick(60, 7.5, 1000), 1027.5)
+        self.assertEqual(next_tick(60, 7.5, 1027.4), 1027.5)
+
+    def test_next_tick_is_after(self):
+        self.assertEqual(next_tick(60, 0, 1020), 1080)
+        self.assertEqual(next_tick(60, 7.5, 1027.5), 1087.5)
+
+    def test_next_tick_skips_missed(self):
+        self.assertEqual(next_tick(10, 3, 1000.5), 1003)
+        self.assertEqual(next_tick(10, 3, 1047.1), 1053)
+
+    def test_splay_is_stable(self):
+        collector = Mock()
+        collector.name = 'CPUCollector'
+        collector.get_hostname.return_value = 'www1'
+
+        splay = get_splay(collector, 300)
+        self.assertEqual(get_splay(collector, 300), splay)
+        self.assertTrue(0 <= splay < 300)
+
+        collector.get_hostname.return_value = 'www2'
+        self.assertNotEqual(get_splay(collector, 300), splay)
+
+    @patch('diamond.utils.scheduler.time')
+    def test_sleep_until(self, time_mock):
+        # The first sleep is cut short, as by a signal
+        time_mock.time.side_effect = [100.0, 101.0, 103.0]
+        sleep_until(103.0)
+        self.assertEqual([call[0][0] for call in
+                          time_mock.sleep.call_args_list], [3.0, 2.0])
+
+    def test_handler_process_flushes_on_exit(self):
+        handler = Handler(configobj.ConfigObj())
+        handler.process = Mock()
+        handler.flush = Mock()
+        metric_queue = Mock()
+        metric_queue.get.side_effect = [['metric1', 'metric2'],
+                                        SystemExit(0)]
+
+        usr2 = signal.getsignal(signal.SIGUSR2)
+        try:
+            self.assertRaises(SystemExit, handler_process, [handler],
+                              metric_queue, Mock())
+        finally:
+            signal.signal(signal.SIGUSR2, usr2)
+
+        # What was queued for the handler is handled and flushed
+        self.assertEqual(handler.process.call_count, 2)
+        self.assertTrue(handler.flush.called)
+
+    @patch('diamond.utils.scheduler.HANDLER_STOP_TIMEOUT', 0.1)
+    def test_reload_leaves_stuck_handler_behind(self):
+        stuck = Handler(configobj.ConfigObj())
+        sending = threading.Event()
+        release = threading.Event()
+
+        def process(metric):
+            sending.set()
+            release.wait()
+        stuck.process = process
+        thread = HandlerThread(stuck)
+        thread.start()
+        thread.put(['metric1'])
+        sending.wait(5)
+        threads = {'NullHandler': thread}
+        log = Mock()
+
+        try:
+            _reload_handlers(threads, ['diamond.handler.null.NullHandler'],
+                             ['NullHandler'],
+                             {'NullHandler': configobj.ConfigObj()}, log)
+            self.assertTrue(log.error.called)
+            self.assertTrue(threads['NullHandler'] is not thread)
+            self.assertTrue(threads['NullHandler'].isAlive())
+        finally:
+            release.set()
+            for running in [thread] + threads.values():
+                running.stop(1)
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import os
+
+from test import unittest
+
+import configobj
+
+from diamond.utils.telemetry import create_telemetry
+from diamond.utils.telemetry import process_stats
+from diamond.utils.telemetry import telemetry_name
+from diamond.utils.telemetry import Histogram
+from diamond.utils.telemetry import Telemetry
+
+
+class TestTelemetry(unittest.TestCase):
+
+    def collect(self, telemetry):
+        return dict([(metric.path, metric.value)
+                     for metric in telemetry.collect()])
+
+    def test_counters_report_the_increase(self):
+        telemetry = Telemetry('servers.host.diamond')
+        telemetry.incr('queue.batches')
+        telemetry.incr('queue.batches', 2)
+        telemetry.total('handlers.A.dropped', 10)
+
+        self.assertEqual(self.collect(telemetry), {
+            'servers.host.diamond.queue.batches': 3,
+            'servers.host.diamond.handlers.A.dropped': 10,
+        })
+
+        telemetry.incr('queue.batches')
+        telemetry.total('handlers.A.dropped', 15)
+        self.assertEqual(self.collect(telemetry), {
+            'servers.host.diamond.queue.batches': 1,
+            'servers.host.diamond.handlers.A.dropped': 5,
+        })
+
+        # A running total that restarted
+        telemetry.total('handlers.A.dropped', 2)
+        self.assertEqual(
+            self.collect(telemetry)['servers.host.diamond.handlers.A.dropped'],
+            2)
+
+    def test_timings(self):
+        telemetry = Telemetry('diamond')
+        for value in range(1, 101):
+            telemetry.timing('run_time_ms', value)
+
+        metrics = self.collect(telemetry)
+        self.assertEqual(metrics['diamond.run_time_ms.count'], 100)
+        self.assertEqual(metrics['diamond.run_time_ms.mean'], 50.5)
+        self.assertEqual(metrics['diamond.run_time_ms.max'], 100)
+        self.assertEqual(metrics['diamond.run_time_ms.p50'], 50)
+        self.assertEqual(metrics['diamond.run_time_ms.p99'], 100)
+
+        # Timings start over every interval
+        self.assertEqual(self.collect(telemetry), {})
+
+    def test_histogram_overflow(self):
+        histogram = Histogram()
+        histogram.add(90000)
+        self.assertEqual(histogram.percentile(50), 90000)
+
+    def test_due(self):
+        telemetry = Telemetry('diamond', interval=60)
+        start = telemetry.next_publish
+        self.assertFalse(telemetry.due(start - 1))
+        self.assertTrue(telemetry.due(start))
+        self.assertFalse(telemetry.due(start + 1))
+        self.assertTrue(telemetry.due(start + 60))
+
+    def test_name(self):
+        self.assertEqual(telemetry_name('collectors', 'CPUCollector cpu.0',
+                                        'overruns'),
+                         'collectors.CPUCollector_cpu_0.overruns')
+
+    def test_create(self):
+        config = configobj.ConfigObj()
+        config['server'] = {}
+        config['collectors'] = {'default': {'path_prefix': 'hosts'}}
+        self.assertEqual(create_telemetry(config, 'www1'), None)
+
+        config['server']['telemetry'] = 'True'
+        self.assertEqual(create_telemetry(config, 'www1').prefix,
+                         'hosts.www1.diamond')
+
+    def test_process_stats(self):
+        if not os.path.exists('/proc/self/stat'):
+            return
+        rss, cpu = process_stats(os.getpid())
+        self.assertTrue(rss > 0)
+        self.assertTrue(cpu >= 0)
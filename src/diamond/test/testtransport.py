@@ -0,0 +1,187 @@
+#!/usr/bin/python
+# coding=utf-8
+################################################################################
+
+import multiprocessing
+import os
+import signal
+import time
+from Queue import Empty, Full
+
+from test import unittest
+from mock import patch
+
+from diamond.metric import Metric
+from diamond.utils.signals import SIGUSR1Exception
+from diamond.utils.signals import signal_to_exception
+from diamond.utils.transport import RingBufferQueue
+from diamond.utils.transport import create_metric_queue
+
+
+def produce(queue, count):
+    for i in range(count):
+        queue.put([Metric('servers.host.cpu.total.idle', i, timestamp=1)])
+
+
+def die_holding_lock(queue, dirty):
+    queue.put('a')
+    queue._acquire()
+    if dirty:
+        queue._state[7] = 1
+    os._exit(0)
+
+
+def die_taking_lock(queue):
+    queue.put('a')
+    # Killed after taking the lock, before recording the pid
+    queue._lock.acquire()
+    os._exit(0)
+
+
+class TestRingBufferQueue(unittest.TestCase):
+
+    def test_put_get(self):
+        queue = RingBufferQueue(1024)
+        queue.put(['a', 'b'])
+        queue.put({'c': 1})
+
+        self.assertEqual(queue.qsize(), 2)
+        self.assertEqual(queue.get(), ['a', 'b'])
+        self.assertEqual(queue.get(), {'c': 1})
+        self.assertTrue(queue.empty())
+        self.assertEqual(queue.used_bytes(), 0)
+
+    def test_wrap_around(self):
+        queue = RingBufferQueue(256)
+        for i in range(100):
+            item = ['x' * (i % 50), i]
+            queue.put(item)
+            self.assertEqual(queue.get(), item)
+
+    def test_full(self):
+        queue = RingBufferQueue(128)
+        queue.put('x' * 60, block=False)
+        self.assertRaises(Full, queue.put, 'y' * 60, block=False)
+        self.assertRaises(Full, queue.put, 'y' * 60, True, 0.01)
+        self.assertRaises(Full, queue.put, 'z' * 256, block=False)
+        self.assertEqual(queue.get(), 'x' * 60)
+
+    def test_empty(self):
+        queue = RingBufferQueue(128)
+        self.assertRaises(Empty, queue.get, block=False)
+        self.assertRaises(Empty, queue.get, True, 0.01)
+
+    def test_fill_level(self):
+        queue = RingBufferQueue(1000)
+        self.assertEqual(queue.fill_level(), 0.0)
+        queue.put('x' * 100)
+        self.assertTrue(0.1 < queue.fill_level() < 0.2)
+        queue.get()
+        self.assertEqual(queue.fill_level(), 0.0)
+
+    def test_multiple_processes(self):
+        queue = RingBufferQueue(4096)
+        processes = []
+        for i in range(3):
+            process = multiprocessing.Process(target=produce,
+                                              args=(queue, 50))
+            process.start()
+            processes.append(process)
+
+        values = []
+        for i in range(150):
+            metrics = queue.get(timeout=10)
+            values.append(metrics[0].value)
+
+        for process in processes:
+            process.join()
+
+        self.assertEqual(sorted(values), sorted(range(50) * 3))
+        self.assertTrue(queue.empty())
+
+    def test_dead_lock_holder(self):
+        queue = RingBufferQueue(1024)
+        process = multiprocessing.Process(target=die_holding_lock,
+                                          args=(queue, False))
+        process.start()
+        process.join()
+
+        # The lock is taken over rather than waited on forever
+        start = time.time()
+        self.assertEqual(queue.get(timeout=5), 'a')
+        self.assertRaises(Empty, queue.get, True, 0.1)
+        self.assertTrue(time.time() - start < 5)
+        queue.put('b')
+        self.assertEqual(queue.get(), 'b')
+
+    def test_killed_taking_lock(self):
+        queue = RingBufferQueue(1024)
+        process = multiprocessing.Process(target=die_taking_lock,
+                                          args=(queue,))
+        process.start()
+        process.join()
+
+        # Nobody took the lock for a whole LOCK_TIMEOUT, it is taken over
+        start = time.time()
+        self.assertEqual(queue.get(timeout=5), 'a')
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(queue.lost(), 0)
+        queue.put('b')
+        self.assertEqual(queue.get(), 'b')
+
+    def test_dead_lock_holder_while_updating(self):
+        queue = RingBufferQueue(1024)
+        process = multiprocessing.Process(target=die_holding_lock,
+                                          args=(queue, True))
+        process.start()
+        process.join()
+
+        # The state can not be trusted, so the ring is emptied
+        self.assertRaises(Empty, queue.get, True, 2)
+        self.assertEqual(queue.lost(), 1)
+        self.assertEqual(queue.used_bytes(), 0)
+        queue.put('b')
+        self.assertEqual(queue.get(), 'b')
+
+    def test_signal_during_put(self):
+        queue = RingBufferQueue(1024)
+        write = queue._write
+
+        def interrupted_write(offset, data):
+            os.kill(os.getpid(), signal.SIGUSR1)
+            write(offset, data)
+
+        queue._write = interrupted_write
+        handler = signal.signal(signal.SIGUSR1, signal_to_exception)
+        try:
+            # The signal is handled once the item is in
+            self.assertRaises(SIGUSR1Exception, queue.put, 'a')
+            self.assertEqual(signal.getsignal(signal.SIGUSR1),
+                             signal_to_exception)
+        finally:
+            signal.signal(signal.SIGUSR1, handler)
+
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.get(), 'a')
+        self.assertTrue(queue._lock.acquire(False))
+
+    def test_signal_handlers_installed_once(self):
+        queue = RingBufferQueue(1024)
+        handler = signal.signal(signal.SIGUSR1, signal_to_exception)
+        try:
+            queue.put('a')
+            queue.get()
+            with patch('signal.signal') as signal_mock:
+                for i in range(10):
+                    queue.put('a')
+                    queue.get()
+            self.assertEqual(signal_mock.call_count, 0)
+        finally:
+            signal.signal(signal.SIGUSR1, handler)
+
+    def test_create_metric_queue(self):
+        queue, manager = create_metric_queue({'metric_queue_size': '2048'})
+        self.assertEqual(queue.capacity, 2048)
+        self.assertEqual(manager, None)
+        self.assertRaises(ValueError, create_metric_queue,
+                          {'metric_queue_type': 'pipe'})
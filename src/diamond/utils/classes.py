@@ -1,5 +1,6 @@
 # coding=utf-8
 
+import ast
 import configobj
 import os
 import sys
@@ -7,9 +8,15 @@ import logging
 import inspect
 import traceback
 
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
 from diamond.util import load_class_from_name
 from diamond.collector import Collector
 from diamond.handler.Handler import Handler
+from diamond.utils.config import copy_config
 
 
 def load_include_path(paths):
@@ -47,6 +54,32 @@ def load_dynamic_class(fqn, subclass):
     return cls
 
 
+def get_handler_config(config, cls_name):
+    """
+    Returns the config of a handler class
+    """
+    # Initialize Handler config
+    handler_config = configobj.ConfigObj()
+    # Merge default Handler default config
+    handler_config.merge(config['handlers']['default'])
+    # Check if Handler config exists
+    if cls_name in config['handlers']:
+        # Merge Handler config section
+        handler_config.merge(config['handlers'][cls_name])
+
+    # Check for config file in config directory
+    if 'handlers_config_path' in config['server']:
+        configfile = os.path.join(
+            config['server']['handlers_config_path'],
+            cls_name) + '.conf'
+        if os.path.exists(configfile):
+            # Merge Collector config file
+            handler_config.merge(configobj.ConfigObj(configfile))
+
+    # merge() shares the lists of the config, copy them
+    return copy_config(handler_config)
+
+
 def load_handlers(config, handler_names):
     """
     Load handlers
@@ -59,44 +92,39 @@ def load_handlers(config, handler_names):
         handler_names = [handler_names]
 
     for handler in handler_names:
-        log.debug('Loading Handler %s', handler)
-        try:
-            # Load Handler Class
-            cls = load_dynamic_class(handler, Handler)
-            cls_name = cls.__name__
-
-            # Initialize Handler config
-            handler_config = configobj.ConfigObj()
-            # Merge default Handler default config
-            handler_config.merge(config['handlers']['default'])
-            # Check if Handler config exists
-            if cls_name in config['handlers']:
-                # Merge Handler config section
-                handler_config.merge(config['handlers'][cls_name])
-
-            # Check for config file in config directory
-            if 'handlers_config_path' in config['server']:
-                configfile = os.path.join(
-                    config['server']['handlers_config_path'],
-                    cls_name) + '.conf'
-                if os.path.exists(configfile):
-                    # Merge Collector config file
-                    handler_config.merge(configobj.ConfigObj(configfile))
-
-            # Initialize Handler class
-            h = cls(handler_config)
+        if isinstance(handler, basestring):
+            cls_name = handler.split('.')[-1]
+        else:
+            cls_name = handler.__name__
+        h = load_handler(handler, get_handler_config(config, cls_name))
+        if h is not None:
             handlers.append(h)
 
-        except (ImportError, SyntaxError):
-            # Log Error
-            log.warning("Failed to load handler %s. %s",
-                        handler,
-                        traceback.format_exc())
-            continue
-
     return handlers
 
 
+def load_handler(name, handler_config):
+    """
+    Load a handler with its config, as returned by get_handler_config.
+    Returns None if the handler can not be loaded
+    """
+    log = logging.getLogger('diamond')
+    log.debug('Loading Handler %s', name)
+    try:
+        # Load Handler Class
+        cls = load_dynamic_class(name, Handler)
+
+        # Initialize Handler class
+        return cls(handler_config)
+
+    except (ImportError, SyntaxError):
+        # Log Error
+        log.warning("Failed to load handler %s. %s",
+                    name,
+                    traceback.format_exc())
+        return None
+
+
 def load_collectors(paths=None, filter=None):
     """
     Scan for collectors to load from path
@@ -191,6 +219,186 @@ def load_collectors(paths=None, filter=None):
     return collectors
 
 
+# Classes defined in each collector module, keyed on the path of the module.
+# Entries are reused for as long as the mtime of the module is unchanged.
+_collector_manifest = {}
+
+
+def _scan_collector_module(fpath):
+    """
+    Statically list the classes defined in a module, without importing it
+    """
+    log = logging.getLogger('diamond')
+
+    try:
+        f = open(fpath)
+        try:
+            tree = ast.parse(f.read(), fpath)
+        finally:
+            f.close()
+    except (IOError, SyntaxError):
+        log.error("Failed to scan module: %s. %s",
+                  fpath, traceback.format_exc())
+        return []
+
+    classes = []
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.ClassDef)
+                and node.bases
+                and not node.name.startswith('parent_')):
+            classes.append(node.name)
+    return classes
+
+
+def _find_collector_modules(paths):
+    """
+    List the .py files under paths that load_collectors would import
+    """
+    modules = []
+
+    for path in paths:
+        if not os.path.exists(path):
+            raise OSError("Directory does not exist: %s" % path)
+
+        if path.endswith('tests') or path.endswith('fixtures'):
+            return modules
+
+        for f in os.listdir(path):
+            fpath = os.path.join(path, f)
+            if os.path.isdir(fpath):
+                modules.extend(_find_collector_modules([fpath]))
+            elif (os.path.isfile(fpath)
+                  and len(f) > 3
+                  and f[-3:] == '.py'
+                  and f[0:4] != 'test'
+                  and f[0] != '.'):
+                modules.append(fpath)
+
+    return modules
+
+
+def _read_collector_manifest(manifest_file):
+    log = logging.getLogger('diamond')
+
+    try:
+        f = open(manifest_file)
+        try:
+            manifest = json.load(f)
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        log.debug("Unable to read collector manifest %s", manifest_file)
+        return
+
+    for fpath, entry in manifest.iteritems():
+        if fpath not in _collector_manifest:
+            _collector_manifest[str(fpath)] = (entry[0], map(str, entry[1]))
+
+
+def _write_collector_manifest(manifest_file):
+    log = logging.getLogger('diamond')
+
+    tmpfile = '%s.%d' % (manifest_file, os.getpid())
+    try:
+        f = open(tmpfile, 'w')
+        try:
+            json.dump(_collector_manifest, f)
+        finally:
+            f.close()
+        os.rename(tmpfile, manifest_file)
+    except (IOError, OSError):
+        log.warning("Unable to write collector manifest %s. %s",
+                    manifest_file, traceback.format_exc())
+
+
+def get_collector_manifest(paths, manifest_file=None):
+    """
+    Map collector class names to the names of the modules defining them.
+
+    Modules are scanned statically rather than imported, and only when their
+    mtime changed since the last scan. If manifest_file is given, the scan
+    results are also kept there between runs.
+    """
+    if isinstance(paths, basestring):
+        paths = paths.split(',')
+        paths = map(str.strip, paths)
+
+    if manifest_file and not _collector_manifest:
+        _read_collector_manifest(manifest_file)
+
+    changed = False
+    modules = _find_collector_modules(paths)
+
+    for fpath in modules:
+        mtime = os.stat(fpath).st_mtime
+        entry = _collector_manifest.get(fpath)
+        if entry is None or entry[0] != mtime:
+            _collector_manifest[fpath] = (mtime, _scan_collector_module(fpath))
+            changed = True
+
+    for fpath in set(_collector_manifest) - set(modules):
+        del _collector_manifest[fpath]
+        changed = True
+
+    if manifest_file and changed:
+        _write_collector_manifest(manifest_file)
+
+    manifest = {}
+    for fpath in modules:
+        modname = os.path.basename(fpath)[:-3]
+        for cls_name in _collector_manifest[fpath][1]:
+            manifest.setdefault(cls_name, []).append(modname)
+
+    return manifest
+
+
+def load_collectors_from_manifest(paths, names, manifest_file=None):
+    """
+    Load only the named collector classes, importing just the modules that
+    define them according to the collector manifest
+    """
+    collectors = {}
+    log = logging.getLogger('diamond')
+
+    if isinstance(paths, basestring):
+        paths = paths.split(',')
+        paths = map(str.strip, paths)
+
+    load_include_path(paths)
+
+    manifest = get_collector_manifest(paths, manifest_file)
+
+    for name in names:
+        for modname in manifest.get(name, []):
+            try:
+                # Import the module
+                mod = __import__(modname, globals(), locals(), ['*'])
+            except (KeyboardInterrupt, SystemExit), err:
+                log.error(
+                    "System or keyboard interrupt "
+                    "while loading module %s"
+                    % modname)
+                if isinstance(err, SystemExit):
+                    sys.exit(err.code)
+                raise KeyboardInterrupt
+            except:
+                # Log error
+                log.error("Failed to import module: %s. %s",
+                          modname,
+                          traceback.format_exc())
+                continue
+
+            cls = getattr(mod, name, None)
+            if (inspect.isclass(cls)
+                    and issubclass(cls, Collector)
+                    and cls != Collector):
+                collectors[cls.__name__] = cls
+                break
+
+    # Return Collector classes
+    return collectors
+
+
 def initialize_collector(cls, name=None, configfile=None, handlers=[]):
     """
     Initialize collector
@@ -21,13 +21,90 @@ def str_to_bool(value):
     return value
 
 
+# Parsed configs keyed on the path of the main config file. Each entry also
+# holds the files and directories that went into the config, and their mtimes
+_config_cache = {}
+
+
+def _get_mtimes(paths):
+    mtimes = []
+    for path in paths:
+        try:
+            mtimes.append(os.stat(path).st_mtime)
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+
 def load_config(configfile):
     """
     Load the full config / merge splitted configs if configured
-    """
 
+    The config is only parsed again when one of the files or directories it
+    was built from changed, otherwise the previously parsed config is
+    copied. Every caller gets a copy of its own, so changing it can not
+    change the cached config.
+    """
     configfile = os.path.abspath(configfile)
+
+    if configfile in _config_cache:
+        paths, mtimes, config = _config_cache[configfile]
+        if _get_mtimes(paths) == mtimes:
+            return copy_config(config)
+
+    paths = []
+    config = _parse_config(configfile, paths)
+    _config_cache[configfile] = (paths, _get_mtimes(paths), config)
+    return copy_config(config)
+
+
+def copy_config(config):
+    """
+    Returns a deep copy of a config or a section of it, lists and
+    subsections included
+    """
+    copy = configobj.ConfigObj()
+    _copy_section(config, copy)
+    return copy
+
+
+def _copy_section(section, copy):
+    for key in section.scalars:
+        # Copy the raw value, reading it through the section would
+        # interpolate it, like the %(asctime)s of the logging formatters
+        value = dict.__getitem__(section, key)
+        if isinstance(value, list):
+            value = list(value)
+        copy[key] = value
+    for key in section.sections:
+        copy[key] = {}
+        _copy_section(section[key], copy[key])
+
+
+def get_collector_config(config, name):
+    """
+    Returns a copy of the default collector section with the section of the
+    named collector merged over it. Lists are copied too, so the collector
+    can not change the shared config by accident.
+    """
+    collector_config = configobj.ConfigObj()
+
+    if 'collectors' in config:
+        if 'default' in config['collectors']:
+            collector_config.merge(config['collectors']['default'])
+
+        if name in config['collectors']:
+            collector_config.merge(config['collectors'][name])
+
+    return copy_config(collector_config)
+
+
+def _parse_config(configfile, paths):
+    """
+    Parse the config, appending every file and directory read to paths
+    """
     config = configobj.ConfigObj(configfile)
+    paths.append(configfile)
 
     config_extension = '.conf'
 
@@ -40,12 +117,14 @@ def load_config(configfile):
 
         # Load other configs
         if 'path' in config['configs']:
+            paths.append(config['configs']['path'])
             for cfgfile in os.listdir(config['configs']['path']):
                 cfgfile = os.path.join(config['configs']['path'],
                                        cfgfile)
                 cfgfile = os.path.abspath(cfgfile)
                 if not cfgfile.endswith(config_extension):
                     continue
+                paths.append(cfgfile)
                 newconfig = configobj.ConfigObj(cfgfile)
                 config.merge(newconfig)
 
@@ -63,6 +142,7 @@ def load_config(configfile):
 
     if 'handlers_config_path' in config['server']:
         handlers_config_path = config['server']['handlers_config_path']
+        paths.append(handlers_config_path)
         if os.path.exists(handlers_config_path):
             for cfgfile in os.listdir(handlers_config_path):
                 cfgfile = os.path.join(handlers_config_path, cfgfile)
@@ -75,6 +155,7 @@ def load_config(configfile):
                 if handler not in config['handlers']:
                     config['handlers'][handler] = configobj.ConfigObj()
 
+                paths.append(cfgfile)
                 newconfig = configobj.ConfigObj(cfgfile)
                 config['handlers'][handler].merge(newconfig)
 
@@ -87,6 +168,7 @@ def load_config(configfile):
 
     if 'collectors_config_path' in config['server']:
         collectors_config_path = config['server']['collectors_config_path']
+        paths.append(collectors_config_path)
         if os.path.exists(collectors_config_path):
             for cfgfile in os.listdir(collectors_config_path):
                 cfgfile = os.path.join(collectors_config_path, cfgfile)
@@ -99,6 +181,7 @@ def load_config(configfile):
                 if collector not in config['collectors']:
                     config['collectors'][collector] = configobj.ConfigObj()
 
+                paths.append(cfgfile)
                 newconfig = configobj.ConfigObj(cfgfile)
                 config['collectors'][collector].merge(newconfig)
 
@@ -0,0 +1,192 @@
+# coding=utf-8
+
+"""
+Runs every handler in its own thread, fed by its own bounded queue, so a slow
+backend can not hold up the other handlers
+"""
+
+import collections
+import threading
+import time
+
+from diamond.utils.telemetry import telemetry_name
+
+OVERFLOW_POLICIES = ['drop_oldest', 'drop_newest']
+
+
+class BoundedQueue(object):
+    """
+    A thread safe queue of metric batches, bounded by the total number of
+    metrics it holds. When a new batch does not fit either the oldest batches
+    are dropped to make room (drop_oldest) or the new batch is dropped
+    (drop_newest). Dropped metrics are counted in self.dropped.
+    """
+
+    def __init__(self, maxsize, overflow='drop_oldest'):
+        if overflow not in OVERFLOW_POLICIES:
+            raise NotImplementedError('Unknown overflow policy %s' % overflow)
+        self.maxsize = int(maxsize)
+        self.overflow = overflow
+        self.size = 0
+        self.dropped = 0
+        self._batches = collections.deque()
+        self._cond = threading.Condition()
+
+    def put(self, batch):
+        """
+        Queue a batch, returns the number of metrics dropped to do so
+        """
+        count = len(batch)
+        dropped = 0
+
+        self._cond.acquire()
+        try:
+            if self.size + count > self.maxsize:
+                if self.overflow == 'drop_newest':
+                    self.dropped += count
+                    return count
+                while self._batches and self.size + count > self.maxsize:
+                    oldest = self._batches.popleft()
+                    self.size -= len(oldest)
+                    dropped += len(oldest)
+                self.dropped += dropped
+
+            self._batches.append(batch)
+            self.size += count
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+        return dropped
+
+    def get(self, timeout=None):
+        """
+        Remove and return the oldest batch, or None if there was none within
+        timeout seconds
+        """
+        self._cond.acquire()
+        try:
+            if not self._batches:
+                self._cond.wait(timeout)
+                if not self._batches:
+                    return None
+            batch = self._batches.popleft()
+            self.size -= len(batch)
+            return batch
+        finally:
+            self._cond.release()
+
+    def qsize(self):
+        """
+        Number of metrics waiting in the queue
+        """
+        return self.size
+
+
+class HandlerThread(threading.Thread):
+    """
+    Feeds the batches from its queue to a single handler
+    """
+
+    def __init__(self, handler, telemetry=None):
+        threading.Thread.__init__(self,
+                                  name=handler.__class__.__name__)
+        self.daemon = True
+        self.handler = handler
+        self.telemetry = telemetry
+        self.running = True
+        self.drain = False
+        self.queue = BoundedQueue(
+            handler.config['queue_size'],
+            handler.config['queue_overflow'].lower().strip())
+
+    def put(self, metrics):
+        dropped = self.queue.put(metrics)
+        if dropped:
+            self.handler._throttle_error(
+                '%s: Queue full, dropped %d metrics (%d in total)',
+                self.name, dropped, self.queue.dropped)
+
+    def stop(self, timeout=None, drain=False):
+        """
+        Stop the thread once the batch in progress is handled and flush the
+        handler. With drain set the batches still queued are handled first,
+        otherwise they are left for take_over().
+        """
+        self.drain = drain
+        self.running = False
+        self.join(timeout)
+
+    def take_over(self, thread):
+        """
+        Queue the batches another (stopped) thread did not get to
+        """
+        while True:
+            metrics = thread.queue.get(0)
+            if metrics is None:
+                break
+            self.put(metrics)
+
+    def run(self):
+        while self.running:
+            metrics = self.queue.get(1)
+            if metrics is None:
+                self.handler._idle()
+                continue
+            if self.telemetry is None:
+                self.handler._process_batch(metrics)
+                self.handler._flush()
+                continue
+
+            start = time.time()
+            self.handler._process_batch(metrics)
+            processed = time.time()
+            self.handler._flush()
+            flushed = time.time()
+
+            self.telemetry.timing(
+                telemetry_name('handlers', self.name, 'process_ms'),
+                (processed - start) * 1000)
+            self.telemetry.timing(
+                telemetry_name('handlers', self.name, 'flush_ms'),
+                (flushed - processed) * 1000)
+
+        while self.drain:
+            metrics = self.queue.get(0)
+            if metrics is None:
+                break
+            self.handler._process_batch(metrics)
+        # Send what is left, a spooling handler spools what it can not send
+        self.handler._flush(force=True)
+
+    def report(self):
+        """
+        Update the telemetry with the state of the handler
+        """
+        self.telemetry.gauge(
+            telemetry_name('handlers', self.name, 'backlog'),
+            self.queue.qsize())
+        self.telemetry.total(
+            telemetry_name('handlers', self.name, 'dropped'),
+            self.queue.dropped)
+        self.telemetry.total(
+            telemetry_name('handlers', self.name, 'failures'),
+            self.handler.failures)
+        self.telemetry.total(
+            telemetry_name('handlers', self.name, 'trimmed'),
+            self.handler.trimmed)
+        if self.handler.buffer is not None:
+            self.telemetry.gauge(
+                telemetry_name('handlers', self.name, 'buffered'),
+                len(self.handler.buffer))
+        if self.handler.spool is not None:
+            self.telemetry.gauge(
+                telemetry_name('handlers', self.name, 'spooled'),
+                len(self.handler.spool))
+            self.telemetry.total(
+                telemetry_name('handlers', self.name, 'spool_evicted'),
+                self.handler.spool.evicted)
+        if getattr(self.handler, 'change_filter', None) is not None:
+            self.telemetry.total(
+                telemetry_name('handlers', self.name, 'suppressed'),
+                self.handler.change_filter.suppressed)
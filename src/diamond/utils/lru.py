@@ -0,0 +1,71 @@
+# coding=utf-8
+
+"""
+A bounded cache for hot paths where an exact LRU list costs more than the
+values it saves.
+"""
+
+
+class LRUCache(object):
+    """
+    A dict bounded to maxsize entries that evicts the least recently used
+    entries.
+
+    Entries live in two generations. New entries go into the young
+    generation and entries found in the old generation are moved back into
+    it. Once the young generation holds half of maxsize entries, the old
+    generation is dropped and the young one takes its place. So everything
+    used within the last maxsize / 2 insertions is kept and a lookup is one
+    or two plain dict lookups.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = max(int(maxsize), 2)
+        self.young = {}
+        self.old = {}
+
+    def get(self, key, default=None):
+        try:
+            return self.young[key]
+        except KeyError:
+            pass
+        try:
+            value = self.old.pop(key)
+        except KeyError:
+            return default
+        self[key] = value
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        young = self.young
+        if key not in young:
+            self.old.pop(key, None)
+            if len(young) >= self.maxsize // 2:
+                self.old = young
+                self.young = young = {}
+        young[key] = value
+
+    def __delitem__(self, key):
+        found = False
+        for generation in (self.young, self.old):
+            if key in generation:
+                del generation[key]
+                found = True
+        if not found:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.young or key in self.old
+
+    def __len__(self):
+        return len(self.young) + len(self.old)
+
+    def clear(self):
+        self.young = {}
+        self.old = {}
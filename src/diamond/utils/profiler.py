@@ -0,0 +1,167 @@
+# coding=utf-8
+
+"""
+On demand profiling of a running collector or handler process, triggered by
+SIGUSR2.
+
+Collector processes profile the next profile_cycles runs of each of their
+collectors with cProfile and write the stats of every collector to a pstats
+file. The handler process samples the stacks of all of its threads for
+profile_seconds seconds and writes them in the collapsed format understood by
+flamegraph.pl.
+
+The files are written to profile_dir, named after the process, the collector
+and the time the profile was finished.
+"""
+
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+
+DEFAULT_PROFILE_DIR = '/tmp/diamond-profiles'
+
+# Seconds between two samples of the thread stacks
+SAMPLE_INTERVAL = 0.01
+
+
+def _profile_path(directory, name, extension):
+    """
+    Returns the path of a new profile, creating the directory if needed
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    name = name.replace(os.sep, '_').replace(' ', '_')
+    return os.path.join(directory, '%s.%d.%d.%s' % (
+        name, os.getpid(), int(time.time()), extension))
+
+
+class CollectorProfiler(object):
+    """
+    Profiles the next runs of collectors with cProfile
+    """
+
+    def __init__(self, config=None, log=None):
+        if config is None:
+            config = {}
+        if log is None:
+            log = logging.getLogger('diamond')
+        self.log = log
+        self.directory = config.get('profile_dir', DEFAULT_PROFILE_DIR)
+        self.cycles = int(config.get('profile_cycles', 5))
+        # collector name -> [cProfile.Profile, runs left]
+        self.profiles = {}
+        self.requested = []
+
+    def request(self, names):
+        """
+        Profile the next runs of the named collectors. This only takes note
+        of the names, so it is safe to call from a signal handler.
+        """
+        self.requested = list(names)
+
+    def run(self, name, func, *args, **kwargs):
+        """
+        Call func, under the profiler if the collector is being profiled
+        """
+        if self.requested:
+            requested, self.requested = self.requested, []
+            for collector_name in requested:
+                if collector_name not in self.profiles:
+                    self.log.info('Profiling the next %d runs of %s',
+                                  self.cycles, collector_name)
+                    self.profiles[collector_name] = [cProfile.Profile(),
+                                                     self.cycles]
+
+        if name not in self.profiles:
+            return func(*args, **kwargs)
+
+        profile = self.profiles[name]
+        try:
+            return profile[0].runcall(func, *args, **kwargs)
+        finally:
+            profile[1] -= 1
+            if profile[1] <= 0:
+                del self.profiles[name]
+                self.dump(name, profile[0])
+
+    def dump(self, name, profile):
+        try:
+            path = _profile_path(self.directory, name, 'pstats')
+            profile.dump_stats(path)
+        except (IOError, OSError), e:
+            self.log.error('Failed to write the profile of %s: %s', name, e)
+            return
+        self.log.info('Wrote the profile of %s to %s', name, path)
+
+
+class StackSampler(object):
+    """
+    Samples the stacks of every thread of the process from a background
+    thread, which also covers code running in other threads such as the
+    handler threads
+    """
+
+    def __init__(self, name, config=None, log=None):
+        if config is None:
+            config = {}
+        if log is None:
+            log = logging.getLogger('diamond')
+        self.name = name
+        self.log = log
+        self.directory = config.get('profile_dir', DEFAULT_PROFILE_DIR)
+        self.seconds = float(config.get('profile_seconds', 30))
+        self.thread = None
+
+    def request(self):
+        """
+        Start sampling unless a sample is already being taken
+        """
+        if self.thread is not None and self.thread.isAlive():
+            return
+        self.log.info('Sampling stacks for %d seconds', self.seconds)
+        self.thread = threading.Thread(name='StackSampler', target=self.sample)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def sample(self):
+        stacks = {}
+        me = threading.currentThread().ident
+        deadline = time.time() + self.seconds
+
+        while time.time() < deadline:
+            names = dict([(thread.ident, thread.name)
+                          for thread in threading.enumerate()])
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s (%s:%d)' % (
+                        code.co_name, os.path.basename(code.co_filename),
+                        code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stack.reverse()
+                stack = ';'.join(stack)
+                stacks[stack] = stacks.get(stack, 0) + 1
+            time.sleep(SAMPLE_INTERVAL)
+
+        self.dump(stacks)
+
+    def dump(self, stacks):
+        try:
+            path = _profile_path(self.directory, self.name, 'collapsed')
+            f = open(path, 'w')
+            try:
+                for stack, count in sorted(stacks.iteritems()):
+                    f.write('%s %d\n' % (stack, count))
+            finally:
+                f.close()
+        except (IOError, OSError), e:
+            self.log.error('Failed to write the stack samples: %s', e)
+            return
+        self.log.info('Wrote the stack samples to %s', path)
@@ -1,31 +1,111 @@
 # coding=utf-8
 
+import heapq
+import math
 import time
 import multiprocessing
 import os
 import sys
 import signal
+import zlib
 
 try:
     from setproctitle import getproctitle, setproctitle
 except ImportError:
     setproctitle = None
 
+from Queue import Empty
+
+from diamond.aggregator import Aggregator
+from diamond.collector import get_hostname
+from diamond.error import DiamondException
+from diamond.utils.classes import initialize_collector
+from diamond.utils.classes import load_collectors_from_manifest
+from diamond.utils.classes import load_handler
+from diamond.utils.config import get_collector_config
+from diamond.utils.config import load_config
+from diamond.utils.dispatch import HandlerThread
+from diamond.utils.profiler import CollectorProfiler
+from diamond.utils.profiler import StackSampler
 from diamond.utils.signals import signal_to_exception
 from diamond.utils.signals import SIGALRMException
 from diamond.utils.signals import SIGHUPException
+from diamond.utils.telemetry import create_telemetry
+from diamond.utils.telemetry import telemetry_name
+
+
+# Seconds the handlers get to flush when the handler process is stopped
+HANDLER_STOP_TIMEOUT = 10
+
+
+def get_splay(collector, interval):
+    """
+    Returns a stable offset within the interval for the collector, derived
+    from the hostname and the collector name. This spreads the collectors of
+    a fleet over the interval instead of all of them firing at :00
+    """
+    seed = '%s:%s' % (collector.get_hostname() or '', collector.name)
+    return ((zlib.crc32(seed) & 0xffffffff)
+            % max(int(interval * 1000), 1)) / 1000.0
+
+
+def next_tick(interval, splay, after):
+    """
+    Returns the first collection time after the given time. Collection times
+    are aligned to wall clock multiples of the interval, offset by the splay
+    """
+    tick = math.floor((after - splay) / interval) * interval + splay
+    while tick <= after:
+        tick += interval
+    return tick
+
+
+def sleep_until(when):
+    """
+    Sleep until the given time. A handled signal, like a profile request,
+    ends time.sleep() early, so sleep on until it is time.
+    """
+    time_to_sleep = when - time.time()
+    while time_to_sleep > 0:
+        time.sleep(time_to_sleep)
+        time_to_sleep = when - time.time()
+
+
+def get_server_config(configfile):
+    """
+    Returns the server section of the config, if there is a config
+    """
+    if configfile is None:
+        return {}
+    return load_config(configfile)['server']
 
 
-def collector_process(collector, metric_queue, log):
+def count_overrun(collector):
     """
+    Count a collection that was killed for taking too long
+    """
+    if collector.telemetry is not None:
+        collector.telemetry.incr(
+            telemetry_name('collectors', collector.name, 'overruns'))
+
+
+def collector_process(collector, metric_queue, log, control=None):
+    """
+    Run a collector in its own process
+
+    On a HUP the collector is reloaded with the last config the server sent
+    over control, or from the config files if it sent none.
     """
     proc = multiprocessing.current_process()
     if setproctitle:
         setproctitle('%s - %s' % (getproctitle(), proc.name))
 
+    profiler = CollectorProfiler(get_server_config(collector.configfile), log)
+
     signal.signal(signal.SIGALRM, signal_to_exception)
     signal.signal(signal.SIGHUP, signal_to_exception)
-    signal.signal(signal.SIGUSR2, signal_to_exception)
+    signal.signal(signal.SIGUSR2,
+                  lambda signum, frame: profiler.request([collector.name]))
 
     interval = float(collector.config['interval'])
     max_time = int(interval * 0.9)
@@ -39,7 +119,10 @@ def collector_process(collector, metric_queue, log):
         log.critical('interval of %s is not valid!', interval)
         sys.exit(1)
 
-    next_collection = time.time()
+    splay = get_splay(collector, interval)
+    log.debug('Splay: %s seconds', splay)
+
+    next_collection = next_tick(interval, splay, time.time())
     reload_config = False
 
     # Setup stderr/stdout as /dev/null so random print statements in thrid
@@ -50,17 +133,18 @@ def collector_process(collector, metric_queue, log):
 
     while(True):
         try:
-            time_to_sleep = next_collection - time.time()
-            if time_to_sleep > 0:
-                time.sleep(time_to_sleep)
+            sleep_until(next_collection)
 
-            next_collection += interval
+            scheduled = next_collection
+            # Skip over any collections we missed
+            next_collection = next_tick(
+                interval, splay, max(next_collection, time.time()))
 
             # Ensure collector run times fit into the collection window
             signal.alarm(max_time)
 
             # Collect!
-            collector._run()
+            profiler.run(collector.name, collector._run, scheduled)
 
             # Success! Disable the alarm
             signal.alarm(0)
@@ -70,12 +154,21 @@ def collector_process(collector, metric_queue, log):
             # it and end up with half a loaded config
             if reload_config:
                 log.debug('Reloading config')
-                collector.load_config()
+                collector.load_config(
+                    collector_config=_latest_config(control))
                 log.info('Config reloaded')
                 reload_config = False
 
+                # The interval may have changed
+                if float(collector.config['interval']) > 0:
+                    interval = float(collector.config['interval'])
+                    max_time = int(interval * 0.9)
+                    splay = get_splay(collector, interval)
+                    next_collection = next_tick(interval, splay, time.time())
+
         except SIGALRMException:
             log.error('Took too long to run! Killed!')
+            count_overrun(collector)
             continue
 
         except SIGHUPException:
@@ -83,22 +176,371 @@ def collector_process(collector, metric_queue, log):
             reload_config = True
             pass
 
+        except SystemExit:
+            # Keep the counters for the next start
+            collector.save_counters()
+            raise
+
         except Exception:
             log.exception('Collector failed!')
             break
 
 
-def handler_process(handlers, metric_queue, log):
+def _latest_config(control):
+    """
+    Returns the last config the server sent over control, or None
+    """
+    config = None
+    try:
+        while control is not None and control.poll():
+            action, config = control.recv()
+    except (EOFError, IOError):
+        # The server went away
+        pass
+    return config
+
+
+def _schedule_collector(schedule, name, collector, after):
+    """
+    Add the next collection of a collector to the schedule
+    """
+    interval = float(collector.config['interval'])
+    heapq.heappush(schedule, (
+        next_tick(interval, get_splay(collector, interval), after), name))
+
+
+def _unschedule_collector(schedule, name):
+    schedule[:] = [entry for entry in schedule if entry[1] != name]
+    heapq.heapify(schedule)
+
+
+def _load_collector(name, configfile, handlers, log):
+    """
+    Load the class of a collector and initialize it
+    """
+    config = load_config(configfile)
+    cls_name = name.split()[0]
+    collectors = load_collectors_from_manifest(
+        config['server']['collectors_path'],
+        [cls_name],
+        config['server'].get('collectors_manifest'))
+
+    if cls_name not in collectors:
+        log.error('Can not find collector %s', cls_name)
+        return None
+
+    return initialize_collector(collectors[cls_name], name=name,
+                                configfile=configfile, handlers=handlers)
+
+
+def collector_worker_process(collectors, metric_queue, log, control=None,
+                             configfile=None, handlers=None):
+    """
+    Run several collectors in one process on a shared schedule. Every
+    collector keeps its own interval and splay and its run time is limited
+    to 90% of that interval.
+
+    The server adds, removes and reloads collectors by sending
+    (action, collector name, config) messages over control, config is the
+    merged config of the collector to reload it with.
+    """
     proc = multiprocessing.current_process()
     if setproctitle:
         setproctitle('%s - %s' % (getproctitle(), proc.name))
 
-    log.debug('Starting process %s', proc.name)
+    log.debug('Starting with collectors: %s', ', '.join(sorted(collectors)))
+
+    collectors = dict(collectors)
+    profiler = CollectorProfiler(get_server_config(configfile), log)
+
+    signal.signal(signal.SIGALRM, signal_to_exception)
+    signal.signal(signal.SIGHUP, signal_to_exception)
+    signal.signal(signal.SIGUSR2,
+                  lambda signum, frame: profiler.request(collectors.keys()))
+
+    # Heap of (next collection time, collector name)
+    schedule = []
+    now = time.time()
+    for name, collector in collectors.items():
+        # Validate the interval
+        if float(collector.config['interval']) <= 0:
+            log.critical('%s: interval of %s is not valid!',
+                         name, collector.config['interval'])
+            del collectors[name]
+            continue
+        _schedule_collector(schedule, name, collector, now)
+
+    if not schedule:
+        sys.exit(1)
+
+    reload_config = False
+
+    # Setup stderr/stdout as /dev/null so random print statements in thrid
+    # party libs do not fail and prevent collectors from running.
+    # https://github.com/BrightcoveOS/Diamond/issues/722
+    sys.stdout = open(os.devnull, 'w')
+    sys.stderr = open(os.devnull, 'w')
 
     while(True):
-        metrics = metric_queue.get(block=True, timeout=None)
-        for metric in metrics:
-            for handler in handlers:
-                handler._process(metric)
-        for handler in handlers:
-            handler._flush()
+        name = None
+        try:
+            # Reload the config if requested
+            # This is outside of the alarm code as we don't want to interrupt
+            # it and end up with half a loaded config
+            if reload_config:
+                log.debug('Reloading config')
+                for name, collector in collectors.iteritems():
+                    collector.load_config()
+                    _unschedule_collector(schedule, name)
+                    _schedule_collector(schedule, name, collector,
+                                        time.time())
+                log.info('Config reloaded')
+                reload_config = False
+
+            # Handle messages from the server
+            while control is not None and control.poll():
+                action, name, config = control.recv()
+                if action == 'add' and name not in collectors:
+                    collector = _load_collector(name, configfile, handlers,
+                                                log)
+                    if collector is not None:
+                        collectors[name] = collector
+                        _schedule_collector(schedule, name, collector,
+                                            time.time())
+                        log.info('Added %s', name)
+                elif action == 'remove' and name in collectors:
+                    collectors.pop(name).save_counters()
+                    _unschedule_collector(schedule, name)
+                    log.info('Removed %s', name)
+                elif action == 'reload' and name in collectors:
+                    collectors[name].load_config(collector_config=config)
+                    _unschedule_collector(schedule, name)
+                    _schedule_collector(schedule, name, collectors[name],
+                                        time.time())
+                    log.info('Reloaded config of %s', name)
+
+            if not schedule:
+                # Wait for the server to hand us something to do
+                if control is None:
+                    sys.exit(1)
+                control.poll(None)
+                continue
+
+            next_collection, name = schedule[0]
+            collector = collectors[name]
+
+            time_to_sleep = next_collection - time.time()
+            if time_to_sleep > 0:
+                if control is None:
+                    sleep_until(next_collection)
+                elif control.poll(time_to_sleep):
+                    # The schedule may change, start over
+                    continue
+                elif time.time() < next_collection:
+                    # Woken early by a signal, like a profile request
+                    continue
+
+            # Skip over any collections we missed
+            heapq.heappop(schedule)
+            _schedule_collector(schedule, name, collector,
+                                max(next_collection, time.time()))
+
+            # Ensure collector run times fit into the collection window
+            signal.alarm(int(float(collector.config['interval']) * 0.9))
+
+            # Collect!
+            profiler.run(name, collector._run, next_collection)
+
+            # Success! Disable the alarm
+            signal.alarm(0)
+
+        except SIGALRMException:
+            log.error('%s took too long to run! Killed!', name)
+            if name in collectors:
+                count_overrun(collectors[name])
+            continue
+
+        except SIGHUPException:
+            log.info('Scheduling config reload due to HUP')
+            reload_config = True
+            pass
+
+        except SystemExit:
+            # Keep the counters for the next start
+            signal.alarm(0)
+            for collector in collectors.itervalues():
+                collector.save_counters()
+            raise
+
+        except (EOFError, IOError):
+            # The server went away
+            log.error('Lost connection to the server')
+            for collector in collectors.itervalues():
+                collector.save_counters()
+            break
+
+        except Exception:
+            # Keep the other collectors in this worker going
+            signal.alarm(0)
+            log.exception('%s failed!', name)
+
+
+def handler_process(handlers, metric_queue, log, control=None,
+                    configfile=None):
+    """
+    Read batches of metrics from the metric queue, roll them up by the
+    rules in the [aggregations] section and hand them to the handlers.
+
+    The server reconfigures the handlers by sending ('reload', handler names,
+    names of the handler classes whose config changed, merged config of every
+    handler class, [aggregations] section) over control.
+    """
+    proc = multiprocessing.current_process()
+    if setproctitle:
+        setproctitle('%s - %s' % (getproctitle(), proc.name))
+
+    log.debug('Starting process %s', proc.name)
+
+    telemetry = None
+    aggregator = None
+    if configfile is not None:
+        config = load_config(configfile)
+        telemetry = create_telemetry(
+            config, get_hostname(get_collector_config(config, 'default')))
+        aggregator = _load_aggregator(config.get('aggregations'), log)
+
+    sampler = StackSampler(proc.name, get_server_config(configfile), log)
+    signal.signal(signal.SIGUSR2, lambda signum, frame: sampler.request())
+
+    # Every handler gets a thread and a bounded queue of its own
+    threads = {}
+    for handler in handlers:
+        thread = HandlerThread(handler, telemetry)
+        thread.start()
+        threads[handler.__class__.__name__] = thread
+
+    try:
+        while(True):
+            while control is not None and control.poll():
+                (action, handler_names, changed, handler_configs,
+                 aggregations) = control.recv()
+                if action == 'reload':
+                    _reload_handlers(threads, handler_names, changed,
+                                     handler_configs, log, telemetry)
+                    aggregator = _load_aggregator(aggregations, log)
+
+            if telemetry is not None and telemetry.due():
+                metrics = _handler_telemetry(telemetry, metric_queue,
+                                             threads)
+                for thread in threads.itervalues():
+                    thread.put(metrics)
+
+            try:
+                metrics = metric_queue.get(block=True, timeout=1)
+            except Empty:
+                continue
+
+            if telemetry is not None:
+                telemetry.incr('queue.batches_dequeued')
+                telemetry.incr('queue.metrics_dequeued', len(metrics))
+
+            if aggregator is not None:
+                try:
+                    metrics = aggregator.process(metrics)
+                except Exception:
+                    log.exception('Failed to aggregate metrics')
+
+            for thread in threads.itervalues():
+                thread.put(metrics)
+
+    except SystemExit:
+        # Send or spool what the handlers still hold before going away
+        log.info('Stopping handlers')
+        _stop_handlers(threads, log)
+        raise
+
+
+def _stop_handlers(threads, log):
+    """
+    Stop the handler threads, each handles what is still queued for it and
+    flushes its handler on the way out
+    """
+    deadline = time.time() + HANDLER_STOP_TIMEOUT
+    for thread in threads.itervalues():
+        thread.stop(0, drain=True)
+    for thread in threads.itervalues():
+        thread.join(max(deadline - time.time(), 0))
+        if thread.isAlive():
+            log.error('Handler %s did not stop in time', thread.name)
+
+
+def _load_aggregator(aggregations, log):
+    """
+    Returns the aggregator for the [aggregations] section of the config
+    """
+    try:
+        return Aggregator.from_config(aggregations)
+    except DiamondException, e:
+        log.error('Invalid aggregations, not aggregating: %s', e)
+        return None
+
+
+def _handler_telemetry(telemetry, metric_queue, threads):
+    """
+    Returns the telemetry of the handler process
+    """
+    try:
+        telemetry.gauge('queue.depth', metric_queue.qsize())
+    except NotImplementedError:
+        # Not every platform can tell the size of a multiprocessing queue
+        pass
+
+    if hasattr(metric_queue, 'counts'):
+        enqueued, dequeued = metric_queue.counts()
+        telemetry.total('queue.batches_enqueued', enqueued)
+        telemetry.gauge('queue.fill_level', metric_queue.fill_level())
+        telemetry.total('queue.batches_lost', metric_queue.lost())
+
+    for thread in threads.itervalues():
+        thread.report()
+
+    return telemetry.collect()
+
+
+def _reload_handlers(threads, handler_names, changed, handler_configs, log,
+                     telemetry=None):
+    """
+    Stop the threads of handlers that were removed or whose config changed
+    and start threads for new and changed handlers
+    """
+    cls_names = [name.split('.')[-1] for name in handler_names]
+    stopped = {}
+
+    for cls_name, thread in threads.items():
+        if cls_name not in cls_names or cls_name in changed:
+            log.info('Stopping handler %s', cls_name)
+            thread.stop(0)
+            stopped[cls_name] = threads.pop(cls_name)
+
+    # A handler stuck sending must not hold up the others, leave it behind,
+    # it is a daemon thread
+    deadline = time.time() + HANDLER_STOP_TIMEOUT
+    for cls_name, thread in stopped.iteritems():
+        thread.join(max(deadline - time.time(), 0))
+        if thread.isAlive():
+            log.error('Handler %s did not stop in time, leaving it behind',
+                      cls_name)
+
+    for name in handler_names:
+        cls_name = name.split('.')[-1]
+        if cls_name in threads:
+            continue
+        handler = load_handler(name, handler_configs[cls_name])
+        if handler is not None:
+            log.info('Starting handler %s', cls_name)
+            thread = HandlerThread(handler, telemetry)
+            if cls_name in stopped:
+                # Don't lose what the old handler had not sent yet
+                thread.take_over(stopped[cls_name])
+            thread.start()
+            threads[cls_name] = thread
@@ -1,6 +1,7 @@
 # coding=utf-8
 
 import signal
+import threading
 
 
 def signal_to_exception(signum, frame):
@@ -36,3 +37,86 @@ class SIGUSR1Exception(SignalException):
 
 class SIGUSR2Exception(SignalException):
     pass
+
+
+# Signals whose handlers may raise or exit in the middle of an update of
+# shared state
+DEFERRED_SIGNALS = [signal.SIGALRM, signal.SIGHUP, signal.SIGINT,
+                    signal.SIGTERM, signal.SIGUSR1, signal.SIGUSR2]
+
+
+class _Deferred(object):
+    """
+    Depth of the DeferredSignals blocks the main thread is in, and the
+    signals that arrived in them
+    """
+    depth = 0
+    pending = []
+
+
+class DeferrableHandler(object):
+    """
+    Wraps a signal handler so DeferredSignals can hold it back. Compares
+    equal to the handler it wraps.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def __call__(self, signum, frame):
+        if _Deferred.depth:
+            if signum not in _Deferred.pending:
+                _Deferred.pending.append(signum)
+            return
+        self.handler(signum, frame)
+
+    def __eq__(self, other):
+        if isinstance(other, DeferrableHandler):
+            other = other.handler
+        return self.handler == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.handler)
+
+
+class DeferredSignals(object):
+    """
+    Context manager that holds back signals until the block is done, so a
+    signal handler can not raise halfway through it. The held back signals
+    are handled on the way out. Python only handles signals in the main
+    thread, in other threads this does nothing.
+
+    The python handlers are wrapped in a DeferrableHandler the first time,
+    after that entering the block only sets a flag the wrappers check.
+    Signals left to their default action are not held back, they kill the
+    process like SIGKILL would.
+    """
+
+    def __enter__(self):
+        self.active = isinstance(threading.current_thread(),
+                                 threading._MainThread)
+        if not self.active:
+            return self
+        for signum in DEFERRED_SIGNALS:
+            handler = signal.getsignal(signum)
+            if (isinstance(handler, DeferrableHandler) or
+                    not callable(handler)):
+                continue
+            signal.signal(signum, DeferrableHandler(handler))
+        _Deferred.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.active:
+            return False
+        _Deferred.depth -= 1
+        # A handler that raises leaves the rest for the next block
+        while not _Deferred.depth and _Deferred.pending:
+            signum = _Deferred.pending.pop(0)
+            handler = signal.getsignal(signum)
+            if callable(handler):
+                handler(signum, None)
+        return False
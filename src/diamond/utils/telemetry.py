@@ -0,0 +1,242 @@
+# coding=utf-8
+
+"""
+Diamond's own instrumentation. Every process keeps its counters, gauges and
+timings in a Telemetry registry, which is turned into metrics under
+<path_prefix>.<hostname>.diamond. every telemetry_interval seconds.
+
+Counters are reported as the increase over the last interval, timings as the
+count, mean, max and 50th/90th/99th percentile of the values recorded during
+the last interval.
+"""
+
+import os
+import re
+import threading
+import time
+
+from diamond.metric import Metric
+from diamond.utils.config import get_collector_config
+from diamond.utils.config import str_to_bool
+
+# Upper bounds of the timing histogram buckets, in milliseconds
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000,
+           30000, 60000)
+
+PERCENTILES = (50, 90, 99)
+
+_invalid_chars = re.compile(r'[^a-zA-Z0-9_-]')
+
+
+def telemetry_name(*parts):
+    """
+    Join parts into a metric name, making each part safe to use as a single
+    path component
+    """
+    return '.'.join([_invalid_chars.sub('_', str(part)) for part in parts])
+
+
+class Histogram(object):
+    """
+    Counts values into fixed buckets, so percentiles can be estimated without
+    keeping every value
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        index = 0
+        for bound in BUCKETS:
+            if value <= bound:
+                break
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+    def percentile(self, pct):
+        """
+        Returns the upper bound of the bucket holding the pct percentile,
+        never more than the largest value seen
+        """
+        rank = self.count * pct / 100.0
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                if index < len(BUCKETS):
+                    return min(BUCKETS[index], self.max)
+                break
+        return self.max
+
+
+class Telemetry(object):
+    """
+    Thread safe registry of internal metrics
+    """
+
+    def __init__(self, prefix, hostname=None, interval=60):
+        self.prefix = prefix
+        self.hostname = hostname
+        self.interval = float(interval)
+        self.next_publish = time.time() + self.interval
+        self.counters = {}
+        self.reported = {}
+        self.gauges = {}
+        self.timings = {}
+        self.lock = threading.Lock()
+
+    def incr(self, name, value=1):
+        """
+        Increase a counter
+        """
+        self.lock.acquire()
+        try:
+            self.counters[name] = self.counters.get(name, 0) + value
+        finally:
+            self.lock.release()
+
+    def total(self, name, value):
+        """
+        Set a counter to a running total kept elsewhere
+        """
+        self.lock.acquire()
+        try:
+            self.counters[name] = value
+        finally:
+            self.lock.release()
+
+    def gauge(self, name, value):
+        self.lock.acquire()
+        try:
+            self.gauges[name] = value
+        finally:
+            self.lock.release()
+
+    def timing(self, name, value):
+        """
+        Record a duration in milliseconds
+        """
+        self.lock.acquire()
+        try:
+            if name not in self.timings:
+                self.timings[name] = Histogram()
+            self.timings[name].add(value)
+        finally:
+            self.lock.release()
+
+    def due(self, now=None):
+        """
+        Returns True once per interval
+        """
+        if now is None:
+            now = time.time()
+        if now < self.next_publish:
+            return False
+        self.next_publish = max(self.next_publish + self.interval,
+                                now + self.interval / 2)
+        return True
+
+    def collect(self, timestamp=None):
+        """
+        Returns the metrics for the last interval and starts a new one
+        """
+        self.lock.acquire()
+        try:
+            counters = self.counters.copy()
+            gauges = self.gauges
+            timings = self.timings
+            self.gauges = {}
+            self.timings = {}
+        finally:
+            self.lock.release()
+
+        values = []
+        for name, value in counters.iteritems():
+            delta = value - self.reported.get(name, 0)
+            if delta < 0:
+                # The running total was reset
+                delta = value
+            values.append((name, delta, 0))
+        self.reported = counters
+
+        for name, value in gauges.iteritems():
+            values.append((name, value, isinstance(value, float) and 2 or 0))
+
+        for name, histogram in timings.iteritems():
+            values.append((name + '.count', histogram.count, 0))
+            values.append((name + '.mean', histogram.mean(), 2))
+            values.append((name + '.max', histogram.max, 2))
+            for pct in PERCENTILES:
+                values.append(('%s.p%d' % (name, pct),
+                               histogram.percentile(pct), 2))
+
+        if timestamp is None:
+            timestamp = int(time.time())
+        ttl = self.interval * 2
+
+        metrics = []
+        for name, value, precision in sorted(values):
+            metrics.append(Metric('%s.%s' % (self.prefix, name), value,
+                                  timestamp=timestamp, precision=precision,
+                                  host=self.hostname, metric_type='GAUGE',
+                                  ttl=ttl))
+        return metrics
+
+
+def create_telemetry(config, hostname):
+    """
+    Returns a Telemetry registry if the telemetry option is enabled in the
+    server section, None otherwise
+    """
+    if not str_to_bool(config['server'].get('telemetry', False)):
+        return None
+
+    default = get_collector_config(config, 'default')
+    prefix = default.get('path_prefix', 'servers')
+    if hostname:
+        prefix = '.'.join([part for part in (prefix, hostname) if part])
+
+    return Telemetry('.'.join([part for part in (prefix, 'diamond') if part]),
+                     hostname=hostname,
+                     interval=config['server'].get('telemetry_interval', 60))
+
+
+_clock_ticks = None
+_page_size = None
+
+
+def process_stats(pid):
+    """
+    Returns the resident set size in bytes and the user plus system CPU time
+    in seconds of a process, or None if they can not be read
+    """
+    global _clock_ticks, _page_size
+    try:
+        if _clock_ticks is None:
+            _clock_ticks = float(os.sysconf('SC_CLK_TCK'))
+            _page_size = os.sysconf('SC_PAGE_SIZE')
+        f = open('/proc/%d/stat' % pid)
+        try:
+            stat = f.read()
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError, AttributeError):
+        return None
+
+    # The process name may contain spaces, skip past it
+    fields = stat[stat.rindex(')') + 2:].split()
+    cpu = (int(fields[11]) + int(fields[12])) / _clock_ticks
+    rss = int(fields[21]) * _page_size
+    return rss, cpu
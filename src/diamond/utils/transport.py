@@ -0,0 +1,356 @@
+# coding=utf-8
+
+"""
+Transports used to move batches of metrics from the collector processes to
+the handler process
+"""
+
+import ctypes
+import errno
+import multiprocessing
+import os
+import struct
+import time
+from Queue import Empty, Full
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle as pickle
+
+try:
+    from setproctitle import getproctitle, setproctitle
+except ImportError:
+    setproctitle = None
+
+from diamond.utils.signals import DeferredSignals
+
+# Default size of the shared memory ring buffer (8 MiB)
+DEFAULT_RING_SIZE = 8 * 1024 * 1024
+
+# Seconds to wait for the lock before checking whether its holder died
+LOCK_TIMEOUT = 0.5
+
+# Seconds between checks for room in a full ring buffer
+FULL_POLL_INTERVAL = 0.05
+
+# Offsets in the shared state array
+_HEAD = 0
+_TAIL = 1
+_USED = 2
+_ITEMS = 3
+_PUTS = 4
+_GETS = 5
+# Pid of the process holding the lock
+_OWNER = 6
+# Set while the head, tail and counts are being updated
+_DIRTY = 7
+# Items lost when the ring was reset after its lock holder died
+_LOST = 8
+# Number of times the lock was taken
+_GENERATION = 9
+
+
+def _alive(pid):
+    """
+    Returns False if the process has exited, zombies included
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno != errno.ESRCH
+    try:
+        f = open('/proc/%d/stat' % pid)
+        try:
+            stat = f.read()
+        finally:
+            f.close()
+    except IOError:
+        return True
+    return stat[stat.rfind(')') + 2:][:1] != 'Z'
+
+
+class RingBufferQueue(object):
+    """
+    A bounded, multi producer queue backed by a shared memory ring buffer.
+
+    Producers pickle their items straight into shared memory and the consumer
+    unpickles them from there, so unlike a SyncManager queue there is no third
+    process serializing every batch. The queue must be created before the
+    collector and handler processes are forked.
+
+    Each item is stored as a 4 byte big endian length header followed by the
+    pickled payload. Both may wrap around the end of the buffer.
+
+    Collector processes get terminated at any time, so signals are held back
+    while the lock is held and a lock left behind by a process that died
+    anyway is taken over. Nobody waits on a condition while holding the
+    lock, the consumer waits on a semaphore that is released for every item.
+    """
+
+    _header = struct.Struct('!L')
+
+    def __init__(self, capacity=DEFAULT_RING_SIZE):
+        self.capacity = int(capacity)
+        if self.capacity <= self._header.size:
+            raise ValueError('Ring buffer capacity of %s bytes is too small'
+                             % capacity)
+        self._buffer = multiprocessing.RawArray(ctypes.c_char, self.capacity)
+        self._address = ctypes.addressof(self._buffer)
+        self._state = multiprocessing.RawArray(ctypes.c_ulong, 10)
+        self._lock = multiprocessing.Lock()
+        # Generation of the lock when it was last found held by nobody
+        self._suspect = None
+        # Guards taking over the lock from a dead process
+        self._recovery = multiprocessing.Lock()
+        # Released once for every item put, only a hint to the consumer
+        self._items = multiprocessing.Semaphore(0)
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Pickle item into the ring buffer. Raises Queue.Full if there is not
+        enough room for it, after waiting up to timeout seconds if block is
+        set.
+        """
+        data = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+        frame = self._header.pack(len(data)) + data
+        size = len(frame)
+
+        if size > self.capacity:
+            raise Full('Item of %d bytes does not fit in a ring buffer of %d '
+                       'bytes' % (size, self.capacity))
+
+        if block and timeout is not None:
+            deadline = time.time() + timeout
+
+        while True:
+            with DeferredSignals():
+                if self._acquire():
+                    try:
+                        if self.capacity - self._state[_USED] >= size:
+                            self._push(frame)
+                            self._items.release()
+                            return
+                    finally:
+                        self._release()
+
+            if not block:
+                raise Full()
+            wait = FULL_POLL_INTERVAL
+            if timeout is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise Full()
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    def put_nowait(self, item):
+        return self.put(item, block=False)
+
+    def get(self, block=True, timeout=None):
+        """
+        Remove and return the oldest item. Raises Queue.Empty if there is no
+        item, after waiting up to timeout seconds if block is set.
+        """
+        if block and timeout is not None:
+            deadline = time.time() + timeout
+
+        woken = False
+        while True:
+            data = None
+            with DeferredSignals():
+                if self._acquire():
+                    try:
+                        data = self._pop()
+                    finally:
+                        self._release()
+            if data is not None:
+                if not woken:
+                    self._items.acquire(False)
+                break
+
+            if not block:
+                raise Empty()
+            wait = LOCK_TIMEOUT
+            if timeout is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise Empty()
+                wait = min(wait, remaining)
+            # Check again every now and then, the semaphore is only a hint
+            woken = self._items.acquire(True, wait)
+
+        # Unpickle outside of the lock so producers are not held up
+        return pickle.loads(data)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def _acquire(self):
+        """
+        Take the lock, returns False if it could not be had in LOCK_TIMEOUT
+        """
+        if self._lock.acquire(True, LOCK_TIMEOUT):
+            self._state[_GENERATION] += 1
+            self._state[_OWNER] = os.getpid()
+            return True
+        return self._recover()
+
+    def _release(self):
+        self._state[_OWNER] = 0
+        self._lock.release()
+
+    def _recover(self):
+        """
+        Take over the lock if the process holding it died. If it died
+        halfway through updating the state the ring is emptied.
+        """
+        owner = self._state[_OWNER]
+        generation = self._state[_GENERATION]
+        if owner:
+            if _alive(owner):
+                return False
+        elif self._suspect != generation:
+            # Held by a process that has not recorded its pid yet, or has
+            # cleared it but not released the lock. It gets another
+            # LOCK_TIMEOUT to do so, if nobody took the lock by then it was
+            # killed in between, by SIGKILL or the OOM killer.
+            self._suspect = generation
+            return False
+        if not self._recovery.acquire(False):
+            return False
+        try:
+            # Someone else may have taken it over in the meantime
+            if (self._state[_OWNER] != owner or
+                    self._state[_GENERATION] != generation):
+                return False
+            # The lock is still held as nobody but its dead owner, and
+            # whoever holds _recovery, could release it
+            self._lock.acquire(False)
+            self._state[_GENERATION] += 1
+            self._state[_OWNER] = os.getpid()
+            if self._state[_DIRTY]:
+                self._state[_LOST] += self._state[_ITEMS]
+                self._state[_HEAD] = 0
+                self._state[_TAIL] = 0
+                self._state[_USED] = 0
+                self._state[_ITEMS] = 0
+                self._state[_DIRTY] = 0
+            return True
+        finally:
+            self._recovery.release()
+
+    def _push(self, frame):
+        """
+        Append a frame, with the lock held
+        """
+        head = self._state[_HEAD]
+        self._write(head, frame)
+        # Only publish the new item once it is completely written
+        self._state[_DIRTY] = 1
+        self._state[_HEAD] = (head + len(frame)) % self.capacity
+        self._state[_USED] += len(frame)
+        self._state[_ITEMS] += 1
+        self._state[_PUTS] += 1
+        self._state[_DIRTY] = 0
+
+    def _pop(self):
+        """
+        Remove the oldest frame and return its payload, or None if there is
+        none, with the lock held
+        """
+        if self._state[_ITEMS] == 0:
+            return None
+        tail = self._state[_TAIL]
+        length = self._header.unpack(self._read(tail, self._header.size))[0]
+        size = self._header.size + length
+        data = self._read(tail + self._header.size, length)
+
+        self._state[_DIRTY] = 1
+        self._state[_TAIL] = (tail + size) % self.capacity
+        self._state[_USED] -= size
+        self._state[_ITEMS] -= 1
+        self._state[_GETS] += 1
+        self._state[_DIRTY] = 0
+        return data
+
+    def qsize(self):
+        """
+        Number of items waiting in the queue
+        """
+        return self._state[_ITEMS]
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        return self._state[_USED] >= self.capacity
+
+    def counts(self):
+        """
+        Total number of items put into and taken from the queue
+        """
+        return self._state[_PUTS], self._state[_GETS]
+
+    def lost(self):
+        """
+        Number of items dropped when the ring was emptied after the process
+        holding the lock died halfway through an update
+        """
+        return self._state[_LOST]
+
+    def used_bytes(self):
+        """
+        Number of bytes currently held in the ring buffer
+        """
+        return self._state[_USED]
+
+    def fill_level(self):
+        """
+        Fraction of the ring buffer currently in use, between 0.0 and 1.0
+        """
+        return float(self._state[_USED]) / self.capacity
+
+    def _write(self, offset, data):
+        offset %= self.capacity
+        first = min(len(data), self.capacity - offset)
+        ctypes.memmove(self._address + offset, data, first)
+        if first < len(data):
+            ctypes.memmove(self._address, data[first:], len(data) - first)
+
+    def _read(self, offset, length):
+        offset %= self.capacity
+        first = min(length, self.capacity - offset)
+        data = ctypes.string_at(self._address + offset, first)
+        if first < length:
+            data += ctypes.string_at(self._address, length - first)
+        return data
+
+
+def create_metric_queue(config):
+    """
+    Create the queue used between the collectors and the handlers as
+    configured by metric_queue_type / metric_queue_size in the server section.
+
+    Returns a (queue, manager) tuple. manager is None unless a SyncManager had
+    to be started to back the queue.
+    """
+    queue_type = config.get('metric_queue_type', 'ring').lower().strip()
+
+    if queue_type == 'ring':
+        size = int(config.get('metric_queue_size', DEFAULT_RING_SIZE))
+        return RingBufferQueue(size), None
+
+    if queue_type == 'manager':
+        # We do this weird process title swap around to get the sync manager
+        # title correct for ps
+        if setproctitle:
+            oldproctitle = getproctitle()
+            setproctitle('%s - SyncManager' % getproctitle())
+        manager = multiprocessing.Manager()
+        if setproctitle:
+            setproctitle(oldproctitle)
+        return manager.Queue(), manager
+
+    raise ValueError('Unknown metric_queue_type %s, use ring or manager'
+                     % queue_type)
@@ -32,6 +32,9 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),
                                              'src', 'collectors')))
 
+from diamond.handler.Handler import Handler
+from diamond.metric import Metric
+
 
 def run_only(func, predicate):
     if predicate():
@@ -53,6 +56,32 @@ def get_collector_config(key, value):
     return config
 
 
+def metrics(count, path='servers.host.cpu.cpu%d.idle'):
+    return [Metric(path % i, i, timestamp=123) for i in range(count)]
+
+
+class BufferedHandler(Handler):
+    """
+    Handler for the tests of buffered handlers. Encodes metrics as their
+    value, keeps the batches it sends in sent and fails while fail is set.
+    """
+
+    buffered = True
+
+    def __init__(self, config=None):
+        Handler.__init__(self, config)
+        self.sent = []
+        self.fail = False
+
+    def encode(self, metric):
+        return str(metric.value)
+
+    def send(self, metrics):
+        if self.fail:
+            raise IOError('Backend down')
+        self.sent.append(list(metrics))
+
+
 class CollectorTestCase(unittest.TestCase):
 
     def setDocExample(self, collector, metrics, defaultpath=None):